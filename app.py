@@ -1,68 +1,48 @@
 import streamlit as st
-import pandas as pd
-from sentence_transformers import SentenceTransformer
-from pinecone import Pinecone
 
-import os
-from dotenv import load_dotenv, find_dotenv
+from metrics import Metrics
+from render import has_results, show_results, start_results
+from service import ServiceClient
+from settings import load_config
 
-load_dotenv()
+config = load_config()
 
-# Cargar el DataFrame
-df = pd.read_csv("data/clean_data/series.csv")  
 
-# Inicializa el modelo de embeddings
-model = SentenceTransformer('all-MiniLM-L6-v2')  
+# Toda la búsqueda la resuelve el servicio de recomendación (python service.py); la app es su cliente
+@st.cache_resource
+def load_client():
+    return ServiceClient(config['service']['url'])
 
-# Conecta a Pinecone
-API_key = os.getenv("key")
-pc = Pinecone(api_key=API_key)  
-index = pc.Index('series')  
 
+# Tiempos de la llamada al servicio y del pintado de cada página, en un fichero propio de la app
+@st.cache_resource
+def load_metrics():
+    settings = config.get('metrics') or {}
+    return Metrics.from_config(settings, export_path=settings.get('app_export_path'))
 
 
-# Función de búsqueda
-def search_series(query, search_type, min_rating):
-    if search_type in ['Synopsis', 'Title']:
-        # Genera un vector para la consulta
-        vector = model.encode(query).tolist()
-        # Realiza la búsqueda en Pinecone usando argumentos nombrados
-        results = index.query(vector=vector, top_k=10, include_values=True)
-        # Obtiene los IDs y valores de los resultados
-        recommended_series = []
-        for match in results['matches']:
-            series_id = match['id']
-            score = match['score']
-            # Busca en el DataFrame original para obtener más información sobre la serie
-            series_info = df[df['IMDb ID'] == series_id].iloc[0]  
-            # Filtrar series con al menos 1000 valoraciones
-            if series_info['Number of Votes'] >= 1000 and series_info['Rating'] >= min_rating:
-                recommended_series.append({
-                    'Title': series_info['Title'],
-                    'Genre': series_info['Genre'],
-                    'Cast': series_info['Cast'],
-                    'Synopsis': series_info['Synopsis'],  
-                    'Rating': series_info['Rating'],
-                    'Score': score
-                })
-        return recommended_series
+client = load_client()
+metrics = load_metrics()
 
-    # Lógica para buscar por título o autor (en este caso, autor se cambiará a 'Cast')
 
-    elif search_type == 'Cast':
-        return df[df['Cast'].str.contains(query, case=False)& (df['Rating'] >= min_rating)].to_dict('records')
+page_size = config['search'].get('page_size', 10)
 
 
+# Función de búsqueda: una página de resultados a partir de `offset`
+def search_series(query, search_type, min_rating, offset=0, limit=10):
+    return client.search(query, search_type, min_rating, offset=offset, limit=limit)
+
 
 # Función para obtener las 10 mejores series por género
 def get_top_series_by_genre_and_subgenre(genre, subgenres, n=10):
-    filtered_series = df[df['Genre'].str.contains(genre, case=False)].drop_duplicates()
-    
-    if subgenres: 
-        filtered_series = filtered_series[filtered_series['Genre'].str.contains('|'.join(subgenres), case=False)]
-    filtered_series = filtered_series[filtered_series['Number of Votes'] >= 10000]
-    top_series = filtered_series.nlargest(n, 'Rating')
-    return top_series.to_dict('records')
+    return client.top(genre, subgenres, n=n)
+
+
+# Guarda la serie elegida con "More like this" y pide sus parecidas; el botón vuelve a ejecutar la página
+def choose_more_like_this(series):
+    st.session_state['more_like_this'] = {'IMDb ID': series['IMDb ID'], 'Title': series['Title']}
+    start_results('similar', lambda offset, limit: client.similar(series['IMDb ID'], n=offset + limit)[offset:],
+                  page_size=page_size, max_results=10)
 
 
 # Interfaz de usuario en Streamlit
@@ -84,33 +64,24 @@ if page == "Recommender":
     Use our search tool to find titles, cast members, or synopses. 
     Filter results by rating to discover the best shows that match your query!
     """)
-    search_type = st.selectbox("Select search type", ["Title", "Cast", "Synopsis"])
+    search_type = st.selectbox("Select search type", ["Title", "Cast", "Synopsis", "Hybrid"])
     query = st.text_input("Please enter your search:")
     rating_filter = st.slider("Minimum Rating", 0.0, 10.0, 5.0)
-    if st.button("Search"):
-        if query:
-            if search_type == "Synopsis":
-                results = search_series(query, search_type, rating_filter)
-                
-                for series in results:
-                    st.write(f"**✨{series['Title']}✨**")
-                    st.write(f"🎭 Genre: {series['Genre']}")
-                    st.write(f"🎥 Cast: {series['Cast']}")
-                    st.write(f"⭐️ Rating: {series['Rating']}")
-                    st.write(f"**🎬 Synopsis:** {series['Synopsis']}")
-                    st.markdown("---")
+    with metrics.trace('page', page=page, query=query, search_type=search_type,
+                       min_rating=rating_filter) as trace:
+        if st.button("Search"):
+            st.session_state.pop('more_like_this', None)
+            if query:
+                # Solo se pide la primera página; las siguientes se piden al pulsar "Next"
+                with trace.stage('service'):
+                    start_results('search', lambda offset, limit: search_series(query, search_type, rating_filter,
+                                                                               offset, limit),
+                                  page_size=page_size)
             else:
-                results = search_series(query, search_type, rating_filter)
-               
-                for series in results:
-                    st.write(f"**✨{series['Title']}✨**")  # Título de la serie
-                    st.write(f"🎭 Genre: {series['Genre']}")  # Género de la serie
-                    st.write(f"🎥 Cast: {series['Cast']}")  # Reparto de la serie
-                    st.write(f"⭐️ Rating: {series['Rating']}")
-                    st.write(f"**🎬 Synopsis:** {series['Synopsis']}")  # Sinopsis de la serie
-                    st.markdown("---")
-        else:
-            st.warning("Please enter a search term.")
+                st.session_state.pop('search', None)
+                st.warning("Please enter a search term.")
+        with trace.stage('render'):
+            show_results('search', on_more_like_this=choose_more_like_this)
 
 
 elif page == "Top 10":
@@ -120,20 +91,20 @@ elif page == "Top 10":
     You can select a main genre and even choose subgenres to narrow down your options. 
     Our top-rated recommendations will help you find the most acclaimed shows to watch.
     """)
+    options = client.options()
     # Seleccionar un género principal
-    genre = st.selectbox("Select a gendre", df['Main Genre'].unique())
+    genre = st.selectbox("Select a gendre", options['main_genres'])
     # Seleccionar subgéneros (puede seleccionar múltiples)
-    subgenres = st.multiselect("Do you want to choose a subgenre?", df['Genre'].str.split(',').explode().unique())
+    subgenres = st.multiselect("Do you want to choose a subgenre?", options['genres'])
     
-    if st.button("Show the best series"):
-        top_series = get_top_series_by_genre_and_subgenre(genre, subgenres)
-        for series in top_series:
-            st.write(f"**✨{series['Title']}✨**")
-            st.write(f"🎭 Genre: {series['Genre']}")
-            st.write(f"🎥 Cast: {series['Cast']}")
-            st.write(f"⭐️ Rating: {series['Rating']}")
-            st.write(f"**🎬 Synopsis:** {series['Synopsis']}")
-            st.markdown("---")  # Línea horizontal separadora
+    with metrics.trace('page', page=page, genre=genre, subgenres=subgenres) as trace:
+        if st.button("Show the best series"):
+            st.session_state.pop('more_like_this', None)
+            with trace.stage('service'):
+                start_results('top', lambda offset, limit: get_top_series_by_genre_and_subgenre(
+                    genre, subgenres, n=offset + limit)[offset:], page_size=page_size, max_results=10)
+        with trace.stage('render'):
+            show_results('top', on_more_like_this=choose_more_like_this)
 
 elif page == "Our Story":
      # Título
@@ -167,26 +138,34 @@ elif page == "Moods":
         Whether you want something funny, romantic, or adventurous, we've got you covered.
         """)
     # Pregunta al usuario qué estado de ánimo le apetece ver
-    selected_mood = st.selectbox("What do you feel like watching today?", ['😂 Fun 😂', '🥰 Romantic 🥰', '😢 Sad 😢', '🤠 Adventurous 🤠', '🫣 Tense 🫣', '🤪 Mixed 🤪'])
-
-    if st.button("Buscar"):
-        # Filtrar las series según el estado de ánimo seleccionado
-        recommended_series = df[df['Mood'] == selected_mood]
-        
-        if not recommended_series.empty:
-            # Obtener las 10 mejores series según el rating
-            recommended_series = recommended_series[recommended_series['Number of Votes'] >= 10000]
-            top_series = recommended_series.nlargest(10, 'Rating')
-            
-            if not top_series.empty:
-                for _, series in top_series.iterrows():
-                    st.write(f"**✨{series['Title']}✨**")
-                    st.write(f"🎭 Genre: {series['Main Genre']}")
-                    st.write(f"🎥 Cast: {series['Cast']}")
-                    st.write(f"⭐️ Rating: {series['Rating']}")
-                    st.write(f"**🎬 Synopsis:** {series['Synopsis']}")
-                    st.markdown("---")
-            else:
+    moods = [rule['mood'] for rule in config['moods']['rules']] + [config['moods']['default']]
+    selected_mood = st.selectbox("What do you feel like watching today?", moods)
+
+    with metrics.trace('page', page=page, mood=selected_mood) as trace:
+        if st.button("Buscar"):
+            st.session_state.pop('more_like_this', None)
+            # Obtener las 10 mejores series según el rating, si hay series con ese estado de ánimo
+            with trace.stage('service'):
+                answer = client.mood(selected_mood, n=10)
+            st.session_state['mood_known'] = answer['known']
+            start_results('mood', lambda offset, limit: answer['results'][offset:offset + limit],
+                          page_size=page_size, max_results=10)
+        if has_results('mood'):
+            with trace.stage('render'):
+                show_results('mood', genre_column='Main Genre', on_more_like_this=choose_more_like_this)
+        elif 'mood_known' in st.session_state:
+            if st.session_state['mood_known']:
                 st.warning("No highly-rated shows were found for this mood.")
+            else:
+                st.warning("No shows were found for this mood.")
+
+# Series parecidas a la elegida con "More like this", leídas de la tabla precalculada
+selected = st.session_state.get('more_like_this')
+if selected and page != "Our Story":
+    st.markdown(f"### More like {selected['Title']}")
+    with metrics.trace('page', page='More like this', imdb_id=selected['IMDb ID']) as trace:
+        if has_results('similar'):
+            with trace.stage('render'):
+                show_results('similar', on_more_like_this=choose_more_like_this)
         else:
-            st.warning("No shows were found for this mood.")
+            st.warning("No similar series were found for this title.")
@@ -0,0 +1,411 @@
+"""
+Precompiled serving artifact.
+
+Everything the app needs to serve is compiled into a versioned directory that the app
+memory-maps at startup instead of parsing CSVs and building indexes:
+
+    artifacts/
+        CURRENT               name of the version being served
+        <version>/
+            manifest.json     format, row count, files, build and cold-start timings
+            catalog.arrow     compact serving columns as an uncompressed Arrow IPC file
+            indexes/          cast and title posting lists, BM25 keyword index,
+                              genre/mood bitmaps and the "more like this" neighbour table
+            embeddings/       embedding matrix, IDs, norms and vector metadata
+
+Run ``python artifact.py`` from the project root to build a new version from the
+clean CSV and the embeddings; the settings live in the ``artifact`` section of
+``config.yaml``. Every build keeps the last few versions besides the one served and
+removes the older ones.
+"""
+import json
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+
+from bm25_index import BM25Index
+from cast_index import CastIndex
+from catalog import Catalog, compact_catalog, memory_report
+from genre_index import GenreIndex, load_genre_matrix
+from neighbors import NeighborTable, load_neighbors
+from title_index import TitleIndex
+from vector_index import (build_ivf, load_embeddings, open_index, quantization_report, save_embeddings,
+                          save_ivf, save_quantized)
+
+FORMAT_VERSION = 1
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+CATALOG_FILE = 'catalog.arrow'
+INDEXES_DIR = 'indexes'
+EMBEDDINGS_DIR = 'embeddings'
+SERVING_COLUMNS = ['IMDb ID', 'Title', 'Genre', 'Main Genre', 'Cast', 'Synopsis',
+                   'Rating', 'Number of Votes', 'Mood']
+
+
+class Serving:
+    """
+    Everything needed to answer searches: catalog, lookup indexes and vector index
+
+    Parameters
+    ----------
+    catalog : Catalog
+        The series catalog
+    cast_index : CastIndex
+        Index for the Cast search
+    genre_index : GenreIndex
+        Index for the Top 10 and Moods pages
+    title_index : TitleIndex
+        Index for the Title search
+    vector_index : LocalIndex or pinecone.Index, optional
+        Index for the Synopsis search
+    manifest : dict, optional
+        Manifest of the artifact the data was opened from
+    neighbors : NeighborTable, optional
+        Table for "more like this", when it was computed
+    bm25_index : BM25Index, optional
+        Keyword index for the Hybrid search
+    """
+
+    def __init__(self, catalog, cast_index, genre_index, title_index, vector_index=None, manifest=None,
+                 neighbors=None, bm25_index=None):
+        self.catalog = catalog
+        self.cast_index = cast_index
+        self.genre_index = genre_index
+        self.title_index = title_index
+        self.vector_index = vector_index
+        self.manifest = manifest or {}
+        self.neighbors = neighbors
+        self.bm25_index = bm25_index
+        self.open_seconds = 0.0
+
+    @property
+    def version(self):
+        return self.manifest.get('version')
+
+
+def build_serving(df, vector_settings=None, pinecone_client=None, genre_matrix=None):
+    """
+    Build the serving data in memory from the clean catalog
+
+    Used when no artifact has been compiled yet.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The clean catalog
+    vector_settings : dict, optional
+        The ``vector_index`` section of ``config.yaml``; no vector index when None
+    pinecone_client : pinecone.Pinecone, optional
+        Client used when the vector backend is ``'pinecone'``
+    genre_matrix : pandas.DataFrame, optional
+        The genre matrix saved with the clean catalog, see `load_genre_matrix`
+
+    Returns
+    -------
+    Serving
+        The serving data
+    """
+    start = time.perf_counter()
+    df = df.reset_index(drop=True)
+    catalog = Catalog(compact_catalog(df, SERVING_COLUMNS))
+    neighbors = None
+    if vector_settings and vector_settings.get('embeddings_dir'):
+        table = load_neighbors(vector_settings['embeddings_dir'])
+        if table is not None:
+            ids, _, _ = load_embeddings(vector_settings['embeddings_dir'])
+            neighbors = NeighborTable.from_embeddings(*table, ids, catalog)
+    serving = Serving(
+        catalog,
+        CastIndex(df['Cast Names'], df['Rating'], df['Number of Votes']),
+        GenreIndex(df['Genre'], df['Main Genre'], df['Mood'], df['Rating'], df['Number of Votes'],
+                   genre_matrix=genre_matrix),
+        TitleIndex(df['Title'], df['Rating'], df['Number of Votes']),
+        open_index(vector_settings, pinecone_client) if vector_settings else None,
+        neighbors=neighbors,
+        bm25_index=BM25Index(df['Title'], df['Synopsis'], df['Rating'], df['Number of Votes']),
+    )
+    serving.open_seconds = time.perf_counter() - start
+    return serving
+
+
+def build_artifact(df, embeddings_dir, root='artifacts', version=None, vector_settings=None,
+                   cold_start_budget_ms=None, genre_matrix=None, evaluate_quantization=False, keep=3):
+    """
+    Compile the clean catalog, its indexes and its embeddings into a new artifact version
+
+    The version is written to a temporary directory, renamed into place and only then
+    published in ``CURRENT``, so a running app never sees a half-written artifact.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The clean catalog, as written to ``data/clean_data/series.csv``
+    embeddings_dir : str
+        Directory written by the embedding build stage
+    root : str
+        Directory holding the artifact versions
+    version : str, optional
+        Name of the new version; a UTC timestamp with a random suffix by default
+    vector_settings : dict, optional
+        The ``vector_index`` section of ``config.yaml``; the IVF lists are precomputed
+        when its mode is ``'ivf'``
+    cold_start_budget_ms : float, optional
+        Cold-start budget recorded in the manifest and checked after the build
+    genre_matrix : pandas.DataFrame, optional
+        The genre matrix saved with the clean catalog, see `load_genre_matrix`
+    evaluate_quantization : bool
+        Whether to record in the manifest the memory saved and the recall@10 of the
+        quantized vectors, measured with `quantization_report`
+    keep : int or None
+        Older versions kept besides the new one, see `prune_versions`; all of them
+        when None
+
+    Returns
+    -------
+    str
+        Path of the new version
+    """
+    # Two builds within the same second get different names
+    version = version or f"{datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    path = os.path.join(root, version)
+    tmp_path = os.path.join(root, f".tmp-{version}")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(os.path.join(tmp_path, INDEXES_DIR))
+    start = time.perf_counter()
+
+    # Compact catalog table, with the row order every index refers to
+    df = df.reset_index(drop=True)
+    compact = compact_catalog(df, SERVING_COLUMNS)
+    memory = memory_report(compact, df)
+    table = pa.Table.from_pandas(compact, preserve_index=False)
+    with pa.OSFile(os.path.join(tmp_path, CATALOG_FILE), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    # Lookup indexes
+    CastIndex(df['Cast Names'], df['Rating'], df['Number of Votes']).save(os.path.join(tmp_path, INDEXES_DIR))
+    GenreIndex(df['Genre'], df['Main Genre'], df['Mood'], df['Rating'], df['Number of Votes'],
+               genre_matrix=genre_matrix).save(os.path.join(tmp_path, INDEXES_DIR))
+    TitleIndex(df['Title'], df['Rating'], df['Number of Votes']).save(os.path.join(tmp_path, INDEXES_DIR))
+    BM25Index(df['Title'], df['Synopsis'], df['Rating'], df['Number of Votes']).save(
+        os.path.join(tmp_path, INDEXES_DIR))
+
+    # Embeddings, rewritten so the norms and metadata files are always present
+    ids, vectors, metadata = load_embeddings(embeddings_dir)
+    embeddings_path = os.path.join(tmp_path, EMBEDDINGS_DIR)
+    save_embeddings(embeddings_path, ids, vectors, pd.DataFrame(metadata) if metadata else None)
+    if vector_settings and vector_settings.get('mode') == 'ivf':
+        save_ivf(embeddings_path, *build_ivf(vectors, nlist=vector_settings.get('nlist', 256)))
+    quantization = None
+    if vector_settings and vector_settings.get('quantization'):
+        save_quantized(embeddings_path, vectors, vector_settings['quantization'])
+        if evaluate_quantization:
+            quantization = quantization_report(vectors, vector_settings['quantization'],
+                                               rescore=vector_settings.get('rescore', 4))
+
+    # "More like this" table, remapped from embedding rows to catalog rows
+    table = load_neighbors(embeddings_dir)
+    if table is not None:
+        NeighborTable.from_embeddings(*table, ids, Catalog(compact)).save(os.path.join(tmp_path, INDEXES_DIR))
+
+    manifest = {
+        'format': FORMAT_VERSION,
+        'version': version,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'rows': len(df),
+        'vectors': len(ids),
+        'columns': SERVING_COLUMNS,
+        'column_bytes': {column: int(size) for column, size in memory['bytes'].items()},
+        'build_seconds': time.perf_counter() - start,
+        'cold_start_budget_ms': cold_start_budget_ms,
+        'quantization': quantization,
+    }
+    _write_manifest(tmp_path, manifest)
+    os.replace(tmp_path, path)
+
+    # Measure how long the app takes to open the new version with the local vector index
+    serving = open_artifact(path, dict(vector_settings or {}, backend='local'))
+    manifest['cold_start_ms'] = serving.open_seconds * 1000
+    manifest['files'] = {os.path.relpath(os.path.join(folder, name), path): os.path.getsize(os.path.join(folder, name))
+                         for folder, _, names in os.walk(path) for name in names}
+    _write_manifest(path, manifest)
+
+    publish(root, version)
+    if keep is not None:
+        prune_versions(root, keep)
+    print(f"Built artifact {version}: {len(df)} rows, {len(ids)} vectors "
+          f"in {manifest['build_seconds']:.1f}s.")
+    report_cold_start(manifest['cold_start_ms'], cold_start_budget_ms)
+    return path
+
+
+def _write_manifest(path, manifest):
+    with open(os.path.join(path, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def publish(root, version):
+    """
+    Atomically make `version` the artifact served by the app
+
+    Parameters
+    ----------
+    root : str
+        Directory holding the artifact versions
+    version : str
+        Name of the version to serve
+
+    Returns
+    -------
+    None
+    """
+    tmp_file = os.path.join(root, f".{CURRENT_FILE}.tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(tmp_file, os.path.join(root, CURRENT_FILE))
+
+
+def prune_versions(root, keep=3):
+    """
+    Remove the oldest artifact versions, keeping the served one and the `keep` newest
+
+    Parameters
+    ----------
+    root : str
+        Directory holding the artifact versions
+    keep : int
+        Number of versions kept besides the one in ``CURRENT``
+
+    Returns
+    -------
+    list of str
+        Names of the removed versions
+    """
+    current = current_version(root)
+    # Only directories with a manifest are versions
+    versions = {}
+    for name in os.listdir(root):
+        manifest_path = os.path.join(root, name, MANIFEST_FILE)
+        if name.startswith('.') or name == current or not os.path.exists(manifest_path):
+            continue
+        with open(manifest_path, encoding='utf-8') as f:
+            versions[name] = json.load(f).get('created_at', '')
+    removed = sorted(versions, key=lambda name: (versions[name], name))[:max(len(versions) - keep, 0)]
+    for name in removed:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    return removed
+
+
+def current_version(root='artifacts'):
+    """
+    Return the name of the artifact version being served
+
+    Parameters
+    ----------
+    root : str
+        Directory holding the artifact versions
+
+    Returns
+    -------
+    str or None
+        The version, or None when no artifact has been built
+    """
+    try:
+        with open(os.path.join(root, CURRENT_FILE), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def open_artifact(path, vector_settings=None, pinecone_client=None):
+    """
+    Open an artifact version, memory-mapping its table, indexes and embeddings
+
+    Parameters
+    ----------
+    path : str
+        Path of the artifact version
+    vector_settings : dict, optional
+        The ``vector_index`` section of ``config.yaml``; no vector index when None
+    pinecone_client : pinecone.Pinecone, optional
+        Client used when the vector backend is ``'pinecone'``
+
+    Returns
+    -------
+    Serving
+        The serving data, with the time it took to open in `open_seconds`
+    """
+    start = time.perf_counter()
+    with open(os.path.join(path, MANIFEST_FILE), encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest['format'] != FORMAT_VERSION:
+        raise ValueError(f"Artifact {path} has format {manifest['format']}, expected {FORMAT_VERSION}")
+
+    # Arrow-backed columns keep pointing at the memory-mapped file instead of being copied
+    table = pa.ipc.open_file(pa.memory_map(os.path.join(path, CATALOG_FILE))).read_all()
+    catalog = Catalog(table.to_pandas(types_mapper=pd.ArrowDtype))
+    df = catalog.df
+
+    indexes_path = os.path.join(path, INDEXES_DIR)
+    vector_index = None
+    if vector_settings:
+        vector_index = open_index(vector_settings, pinecone_client,
+                                  embeddings_dir=os.path.join(path, EMBEDDINGS_DIR))
+    serving = Serving(
+        catalog,
+        CastIndex.load(indexes_path, df['Rating'], df['Number of Votes']),
+        GenreIndex.load(indexes_path),
+        TitleIndex.load(indexes_path, df['Rating'], df['Number of Votes']),
+        vector_index,
+        manifest,
+        neighbors=NeighborTable.load(indexes_path),
+        bm25_index=BM25Index.load(indexes_path, df['Rating'], df['Number of Votes']),
+    )
+    serving.open_seconds = time.perf_counter() - start
+    return serving
+
+
+def report_cold_start(cold_start_ms, budget_ms=None):
+    """
+    Print the cold-start time and whether it fits the budget
+
+    Parameters
+    ----------
+    cold_start_ms : float
+        Measured time to open the serving data
+    budget_ms : float, optional
+        The cold-start budget
+
+    Returns
+    -------
+    bool
+        Whether the cold start is within budget (always True without a budget)
+    """
+    if budget_ms is None:
+        print(f"Cold start: {cold_start_ms:.0f} ms.")
+        return True
+    within = cold_start_ms <= budget_ms
+    print(f"Cold start: {cold_start_ms:.0f} ms of a {budget_ms:.0f} ms budget"
+          f"{'' if within else ' (OVER BUDGET)'}.")
+    return within
+
+
+if __name__ == '__main__':
+    from settings import load_config
+
+    config = load_config()
+    settings = config['artifact']
+    df = pd.read_csv(config['paths']['data_cleaned'])
+    build_artifact(df,
+                   config['vector_index']['embeddings_dir'],
+                   root=settings['dir'],
+                   vector_settings=config['vector_index'],
+                   cold_start_budget_ms=settings.get('cold_start_budget_ms'),
+                   genre_matrix=load_genre_matrix(config['paths'].get('genre_matrix'), df['IMDb ID']),
+                   evaluate_quantization=config['embedding_build'].get('evaluate_quantization', False),
+                   keep=settings.get('keep', 3))
@@ -0,0 +1,5 @@
+"""
+Benchmark suite of the recommender and of the data preparation pipeline.
+
+Run ``python -m benchmarks.run`` from the project root; see ``benchmarks/run.py``.
+"""
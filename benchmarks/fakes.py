@@ -0,0 +1,124 @@
+"""
+In-process stand-ins for Pinecone and the sentence-transformers encoder.
+
+`FakePinecone` is passed to `open_index` as the Pinecone client, so the code under
+benchmark takes its real Pinecone path; the index answers from a `LocalIndex` after
+waiting a configurable network latency. `FakeEncoder` hashes the query into a vector
+in a configurable time, so encoder cost can be included or left out of a run.
+"""
+import hashlib
+import time
+
+import numpy as np
+
+from query_cache import QueryEmbeddingCache
+
+
+class FakeIndex:
+    """
+    Pinecone ``Index`` answering from a `LocalIndex`
+
+    Parameters
+    ----------
+    index : LocalIndex
+        The index answering the queries
+    latency_ms : float
+        Time every call waits, standing for the network round trip
+    jitter_ms : float
+        Standard deviation of a normal jitter added to `latency_ms`
+    seed : int
+        Seed of the jitter
+    """
+
+    def __init__(self, index, latency_ms=0.0, jitter_ms=0.0, seed=0):
+        self.index = index
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.calls = 0
+        self._rng = np.random.default_rng(seed)
+
+    def _wait(self):
+        self.calls += 1
+        delay = self.latency_ms + (self._rng.normal(0, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def query(self, vector, top_k=10, filter=None, include_values=False, **kwargs):
+        """Answer like ``pinecone.Index.query``, see `LocalIndex.query`."""
+        self._wait()
+        return self.index.query(vector, top_k=top_k, filter=filter, include_values=include_values)
+
+    def describe_index_stats(self, **kwargs):
+        """Answer like ``pinecone.Index.describe_index_stats``."""
+        self._wait()
+        return {'dimension': self.index.vectors.shape[1], 'total_vector_count': len(self.index)}
+
+
+class FakePinecone:
+    """
+    Pinecone client whose indexes are all the same `FakeIndex`
+
+    Parameters
+    ----------
+    index : FakeIndex
+        The index returned by `Index`
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def Index(self, name):
+        return self.index
+
+
+class FakeEncoder:
+    """
+    Deterministic query encoder with a fixed cost per call
+
+    Parameters
+    ----------
+    dim : int
+        Embedding dimension
+    latency_ms : float
+        Time every `encode` call takes, whatever the batch size
+    """
+
+    def __init__(self, dim=384, latency_ms=0.0):
+        self.dim = dim
+        self.latency_ms = latency_ms
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def encode(self, texts, **kwargs):
+        """Encode one text or a list of texts, like ``SentenceTransformer.encode``."""
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        if isinstance(texts, str):
+            return self._vector(texts)
+        return np.stack([self._vector(text) for text in texts])
+
+    def get_sentence_embedding_dimension(self):
+        """Return `dim`, like ``SentenceTransformer.get_sentence_embedding_dimension``."""
+        return self.dim
+
+
+def fake_query_cache(dim=384, latency_ms=0.0, maxsize=0):
+    """
+    Return a query embedding cache in front of a `FakeEncoder`
+
+    Parameters
+    ----------
+    dim, latency_ms
+        See `FakeEncoder`
+    maxsize : int
+        Size of the cache; 0 so that every query reaches the encoder
+
+    Returns
+    -------
+    QueryEmbeddingCache
+        The cache, used by `Recommender` like the real one
+    """
+    return QueryEmbeddingCache(FakeEncoder(dim, latency_ms), maxsize=maxsize)
@@ -0,0 +1,309 @@
+"""
+Benchmarks of the data preparation pipeline and of every recommender entry point.
+
+For every catalog size of the ``benchmarks`` section of ``config.yaml``, a synthetic
+catalog is written as genre CSV files and then:
+
+- the pipeline of ``main.ipynb`` (`load_data`, `clean_data`, `unique_films`,
+  `new_columns`, `drop_near_duplicates`, `classify_moods`) is timed stage by stage;
+- the serving data is built with the vector index behind a `FakePinecone` client,
+  which answers from memory after a configurable network latency;
+- each `Recommender` entry point (every search type, Top 10, Moods) answers a sample
+  of queries drawn from the catalog, and its throughput and p50/p95/p99 latency are
+  recorded.
+
+The results are saved as JSON in ``output_dir``. Given a previous results file, the
+run is compared with it and any latency or stage time that grew by more than
+``regression_tolerance`` is reported as a regression, with a non-zero exit status:
+
+    python -m benchmarks.run                                  # from the project root
+    python -m benchmarks.run benchmarks/results/<previous>.json
+
+The 1M-row catalog needs about 5 GB of memory with 384-dimensional embeddings;
+lower ``dim`` or drop the size on smaller machines.
+"""
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from artifact import build_serving
+from benchmarks.fakes import FakeIndex, FakePinecone, fake_query_cache
+from benchmarks.synthetic import synthetic_catalog, synthetic_embeddings, write_genre_files
+from embedding_build import vector_metadata
+from recommender import SEARCH_TYPES, Recommender
+from vector_index import LocalIndex, save_embeddings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'notebooks'))
+from functions import (classify_moods, clean_data, drop_columns, drop_near_duplicates,  # noqa: E402
+                       load_data, new_columns, unique_films)
+
+# Latency and stage time metrics compared against a baseline
+COMPARED_METRICS = ('p50_ms', 'p95_ms', 'seconds')
+# Stage times below this are too noisy to compare
+MIN_COMPARED_SECONDS = 0.01
+
+
+def latency_summary(seconds):
+    """
+    Summarize the latencies of a series of calls
+
+    Parameters
+    ----------
+    seconds : array-like of float
+        Duration of every call
+
+    Returns
+    -------
+    dict
+        Call count, throughput (calls per second, back to back), mean and
+        p50/p95/p99/max latency in milliseconds
+    """
+    milliseconds = np.asarray(seconds, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+    return {
+        'calls': len(milliseconds),
+        'throughput_per_second': len(milliseconds) / (milliseconds.sum() / 1000),
+        'mean_ms': float(milliseconds.mean()),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'max_ms': float(milliseconds.max()),
+    }
+
+
+def time_calls(function, arguments):
+    """Call `function` once per tuple of `arguments` and summarize the latencies."""
+    seconds = []
+    for args in arguments:
+        start = time.perf_counter()
+        function(*args)
+        seconds.append(time.perf_counter() - start)
+    return latency_summary(seconds)
+
+
+def sample_queries(df, count, seed=0):
+    """
+    Draw realistic queries of every entry point from a clean catalog
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The clean catalog
+    count : int
+        Number of queries per entry point
+    seed : int
+        Seed of the random generator
+
+    Returns
+    -------
+    dict
+        The argument tuples of every entry point, by name
+    """
+    rng = np.random.default_rng(seed)
+    rows = df.iloc[rng.integers(len(df), size=count)]
+    titles = rows['Title'].str.split().str[:2].str.join(' ')
+    # A surname alone, as typed in the Cast search
+    surnames = rows['Cast Names'].str.split('|').str[0].str.split().str[-1]
+    synopses = [' '.join(rng.choice(words, size=min(5, len(words)), replace=False))
+                for words in rows['Synopsis'].str.split()]
+    ratings = rng.choice([0.0, 5.0, 7.0], size=count)
+    genres = rows['Main Genre'].tolist()
+    subgenres = rows['Genre'].str.split(', ').str[1:].tolist()
+
+    texts = {'Title': titles, 'Cast': surnames, 'Synopsis': synopses, 'Hybrid': synopses}
+    queries = {f"search:{search_type}": list(zip(texts[search_type], [search_type] * count, ratings))
+               for search_type in SEARCH_TYPES}
+    queries.update({
+        'top_by_genre': list(zip(genres, subgenres)),
+        'top_by_mood': [(mood,) for mood in rows['Mood']],
+    })
+    return queries
+
+
+def run_pipeline(data_dir, moods, workers):
+    """
+    Run the data preparation pipeline of ``main.ipynb`` on the genre files of `data_dir`
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory of the genre CSV files
+    moods : dict
+        The ``moods`` section of ``config.yaml``
+    workers : int
+        Files read at the same time by `load_data`
+
+    Returns
+    -------
+    tuple
+        The clean catalog and the seconds and rows per second of every stage
+    """
+    stages = {}
+
+    def stage(name, function, rows=None):
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+        rows = len(result) if rows is None else rows
+        stages[name] = {'seconds': seconds, 'rows': rows, 'rows_per_second': rows / seconds}
+        return result
+
+    df = stage('load_data', lambda: load_data(data_dir, workers=workers))
+    df = stage('drop_columns', lambda: drop_columns(df), len(df))
+    df = stage('clean_data', lambda: clean_data(df), len(df))
+    df = stage('unique_films', lambda: unique_films(df), len(df))
+    df = stage('new_columns', lambda: new_columns(df), len(df))
+    # After new_columns, so the cast check reuses the parsed `Cast Names`
+    df = stage('drop_near_duplicates', lambda: drop_near_duplicates(df), len(df))
+    df['Mood'] = stage('classify_moods', lambda: classify_moods(df['Main Genre'], moods), len(df))
+    return df.reset_index(drop=True), stages
+
+
+def benchmark_size(rows, settings, moods):
+    """
+    Benchmark the pipeline and every entry point on a synthetic catalog
+
+    Parameters
+    ----------
+    rows : int
+        Number of series of the synthetic catalog
+    settings : dict
+        The ``benchmarks`` section of ``config.yaml``
+    moods : dict
+        The ``moods`` section of ``config.yaml``
+
+    Returns
+    -------
+    dict
+        The pipeline stages, the serving build and the entry point latencies
+    """
+    start = time.perf_counter()
+    raw = synthetic_catalog(rows, seed=settings.get('seed', 0))
+    generate_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_genre_files(raw, os.path.join(directory, 'data'))
+        del raw
+        df, pipeline = run_pipeline(os.path.join(directory, 'data'), moods, settings.get('workers', 8))
+
+        embeddings_dir = os.path.join(directory, 'embeddings')
+        vectors = synthetic_embeddings(len(df), settings['dim'], seed=settings.get('seed', 0))
+        save_embeddings(embeddings_dir, df['IMDb ID'].astype(str).tolist(), vectors, vector_metadata(df))
+        del vectors
+
+        start = time.perf_counter()
+        index = FakeIndex(LocalIndex.from_directory(embeddings_dir), latency_ms=settings['pinecone_latency_ms'],
+                          jitter_ms=settings.get('pinecone_jitter_ms', 0.0))
+        serving = build_serving(df, {'backend': 'pinecone'}, FakePinecone(index))
+        build_seconds = time.perf_counter() - start
+
+        recommender = Recommender(serving, fake_query_cache(settings['dim'], settings['encoder_latency_ms']))
+        queries = {}
+        for name, arguments in sample_queries(df, settings['queries'], seed=settings.get('seed', 0)).items():
+            function = recommender.search if name.startswith('search:') else getattr(recommender, name)
+            queries[name] = time_calls(function, arguments)
+            print(f"  {name:<16} p50 {queries[name]['p50_ms']:8.2f} ms  p95 {queries[name]['p95_ms']:8.2f} ms  "
+                  f"p99 {queries[name]['p99_ms']:8.2f} ms  {queries[name]['throughput_per_second']:8.1f}/s")
+
+    return {
+        'rows': rows,
+        'clean_rows': len(df),
+        'generate_seconds': generate_seconds,
+        'pipeline': pipeline,
+        'serving': {'build': {'seconds': build_seconds}},
+        'queries': queries,
+    }
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    List the metrics of `results` that regressed against `baseline`
+
+    Parameters
+    ----------
+    results, baseline : dict
+        Two results files, as saved by `run`
+    tolerance : float
+        Relative growth of a metric tolerated before it counts as a regression
+
+    Returns
+    -------
+    list of dict
+        One entry per regressed metric: its path, the baseline and the new value
+    """
+    regressions = []
+
+    def walk(new, old, path):
+        for key, value in new.items():
+            if key not in old:
+                continue
+            if isinstance(value, dict):
+                walk(value, old[key], path + [key])
+            elif key in COMPARED_METRICS and value > old[key] * (1 + tolerance) \
+                    and old[key] > (MIN_COMPARED_SECONDS if key == 'seconds' else 0):
+                regressions.append({'metric': '/'.join(path + [key]), 'baseline': old[key], 'value': value,
+                                    'change': value / old[key] - 1})
+
+    walk(results['sizes'], baseline.get('sizes', {}), [])
+    return regressions
+
+
+def run(settings, moods, baseline_path=None):
+    """
+    Run the benchmarks of every size and save the results
+
+    Parameters
+    ----------
+    settings : dict
+        The ``benchmarks`` section of ``config.yaml``
+    moods : dict
+        The ``moods`` section of ``config.yaml``
+    baseline_path : str, optional
+        Results file of a previous run to compare with
+
+    Returns
+    -------
+    dict
+        The results, with the regressions found against the baseline
+    """
+    started = datetime.now(timezone.utc)
+    results = {
+        'started': started.isoformat(),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count(), 'numpy': np.__version__, 'pandas': pd.__version__},
+        'settings': settings,
+        'sizes': {},
+    }
+    for rows in settings['sizes']:
+        print(f"Benchmarking {rows} rows")
+        results['sizes'][str(rows)] = benchmark_size(rows, settings, moods)
+
+    if baseline_path:
+        with open(baseline_path, encoding='utf-8') as f:
+            results['baseline'] = baseline_path
+            results['regressions'] = compare(results, json.load(f), settings.get('regression_tolerance', 0.2))
+        for regression in results['regressions']:
+            print(f"Regression: {regression['metric']} {regression['baseline']:.4g} -> "
+                  f"{regression['value']:.4g} (+{regression['change']:.0%})")
+
+    os.makedirs(settings['output_dir'], exist_ok=True)
+    path = os.path.join(settings['output_dir'], f"benchmark-{started:%Y%m%d-%H%M%S}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {path}")
+    return results
+
+
+if __name__ == '__main__':
+    from settings import load_config
+
+    config = load_config()
+    results = run(config['benchmarks'], config['moods'], sys.argv[1] if len(sys.argv) > 1 else None)
+    sys.exit(1 if results.get('regressions') else 0)
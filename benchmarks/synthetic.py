@@ -0,0 +1,181 @@
+"""
+Synthetic catalogs with the schema of the genre CSV files.
+
+The generated rows look like the scraped ones: the columns and their formats are the
+same (``"Stars:, Name, , Name"`` casts, ``"Drama, Crime"`` genres, text votes), a few
+values are missing or malformed, and popular series are listed again in the file of
+each of their genres. Titles, synopses and names are drawn from a Zipf-distributed
+vocabulary, so the text indexes see realistic posting list lengths.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+GENRES = ['Action', 'Adventure', 'Animation', 'Biography', 'Comedy', 'Crime', 'Documentary', 'Drama',
+          'Family', 'Fantasy', 'History', 'Horror', 'Music', 'Musical', 'Mystery', 'Romance', 'Sci-Fi',
+          'Sport', 'Thriller', 'War', 'Western']
+COLUMNS = ['Title', 'IMDb ID', 'Release Year', 'Genre', 'Cast', 'Synopsis', 'Rating', 'Runtime',
+           'Certificate', 'Number of Votes', 'Gross Revenue']
+CERTIFICATES = ['G', 'PG', 'PG-13', 'R', 'TV-14', 'TV-MA', 'TV-PG', 'Not Rated']
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'ten', 'sa', 'vor', 'el', 'din', 'mar', 'ko', 'lu', 'an', 'bri', 'che',
+             'do', 'fa', 'gor', 'ha', 'is', 'jun', 'ne', 'or', 'pa', 'qui', 'ste', 'tri', 'um', 'wen', 'zy']
+
+
+def _words(rng, count, syllables=(2, 4)):
+    """Return `count` distinct made-up words; 2 to 4 syllables allow a few hundred thousand."""
+    words = np.empty(0, dtype=object)
+    while len(words) < count:
+        # Draw a batch of syllable sequences; short words are padded with empty syllables
+        pieces = np.array(SYLLABLES + [''], dtype=object)
+        codes = rng.integers(len(SYLLABLES), size=(2 * count, syllables[1]))
+        sizes = rng.integers(syllables[0], syllables[1] + 1, size=(2 * count, 1))
+        codes[np.arange(syllables[1]) >= sizes] = len(SYLLABLES)
+        batch = pieces[codes].sum(axis=1)
+        words = pd.unique(np.concatenate([words, batch]))
+    return np.sort(words[:count])
+
+
+def _phrases(rng, vocabulary, rows, lengths, zipf=1.2):
+    """Return one phrase per row, with words drawn from a Zipf distribution over `vocabulary`."""
+    ranks = np.minimum(rng.zipf(zipf, size=int(lengths.sum())), len(vocabulary)) - 1
+    words = vocabulary[rng.permutation(len(vocabulary))][ranks]
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    return [' '.join(words[bounds[i]:bounds[i + 1]]) for i in range(rows)]
+
+
+def synthetic_catalog(rows, seed=0, vocabulary_size=50000, people=None):
+    """
+    Generate a catalog of series with the columns of the genre CSV files
+
+    Parameters
+    ----------
+    rows : int
+        Number of distinct series
+    seed : int
+        Seed of the random generator, the same seed gives the same catalog
+    vocabulary_size : int
+        Number of distinct words of the titles and synopses
+    people : int, optional
+        Number of distinct first names of the cast; a third of `rows` by default, at
+        most 200,000
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per series, with the `COLUMNS` of the genre files
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = _words(rng, vocabulary_size)
+    people = max(people or min(rows // 3, 200000), 10)
+    names = _words(rng, people)
+    surnames = _words(rng, max(people // 4, 10))
+
+    # 1 to 3 genres per series, the first one being the main genre
+    genre_counts = rng.choice([1, 2, 3], size=rows, p=[0.3, 0.3, 0.4])
+    genre_codes = np.argsort(rng.random((rows, len(GENRES))), axis=1)[:, :3]
+    genres = [', '.join(GENRES[code] for code in codes[:count]) for codes, count in zip(genre_codes, genre_counts)]
+
+    # Four stars per series, names are "first last" with shared surnames
+    first = names[rng.integers(len(names), size=(rows, 4))]
+    last = surnames[np.minimum(rng.zipf(1.3, size=(rows, 4)), len(surnames)) - 1]
+    cast = ['Stars:, ' + ', , '.join(f"{a.title()} {b.title()}" for a, b in zip(f, l)) for f, l in zip(first, last)]
+
+    votes = np.maximum(rng.lognormal(6.5, 2.0, size=rows), 5).astype(np.int64)
+    df = pd.DataFrame({
+        'Title': [title.title() for title in _phrases(rng, vocabulary, rows, rng.integers(1, 5, size=rows))],
+        'IMDb ID': [f"tt{number:08d}" for number in rng.permutation(rows * 10)[:rows]],
+        'Release Year': rng.integers(1950, 2024, size=rows).astype(str),
+        'Genre': genres,
+        'Cast': cast,
+        'Synopsis': [text.capitalize() + '.' for text in
+                     _phrases(rng, vocabulary, rows, rng.integers(12, 40, size=rows))],
+        'Rating': np.round(np.clip(rng.normal(6.6, 1.1, size=rows), 1, 10), 1),
+        'Runtime': [f"{minutes} min" for minutes in rng.integers(20, 180, size=rows)],
+        'Certificate': rng.choice(CERTIFICATES, size=rows),
+        'Number of Votes': votes.astype(str).astype(object),
+        'Gross Revenue': np.nan,
+    }, columns=COLUMNS)
+
+    # Scraped files have holes and the odd malformed vote count
+    df.loc[rng.random(rows) < 0.02, 'Synopsis'] = np.nan
+    df.loc[rng.random(rows) < 0.02, 'Rating'] = np.nan
+    df.loc[rng.random(rows) < 0.005, 'Number of Votes'] = 'N/A'
+    return df
+
+
+def genre_files(df):
+    """
+    Split a catalog into the rows of every genre file
+
+    A series is listed in the file of each of its genres, so the files overlap like
+    the scraped ones.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        A catalog returned by `synthetic_catalog`
+
+    Returns
+    -------
+    dict of str to pandas.DataFrame
+        The rows of every genre file, by file name
+    """
+    genres = df['Genre'].str.split(', ').explode()
+    return {f"{genre.lower()}_series.csv": df.loc[genres.index[genres == genre]] for genre in GENRES}
+
+
+def write_genre_files(df, directory):
+    """
+    Write a catalog as genre CSV files, ready for `load_data`
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        A catalog returned by `synthetic_catalog`
+    directory : str
+        Target directory, created if needed
+
+    Returns
+    -------
+    list of str
+        The paths of the written files
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name, rows in genre_files(df).items():
+        path = os.path.join(directory, name)
+        rows.to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+
+def synthetic_embeddings(rows, dim, seed=0, clusters=64):
+    """
+    Generate clustered embeddings, one per series
+
+    Parameters
+    ----------
+    rows : int
+        Number of embeddings
+    dim : int
+        Embedding dimension
+    seed : int
+        Seed of the random generator
+    clusters : int
+        Number of topics the embeddings are grouped around
+
+    Returns
+    -------
+    numpy.ndarray
+        A ``float32`` matrix of unit-norm rows
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    vectors = np.empty((rows, dim), dtype=np.float32)
+    for start in range(0, rows, 65536):
+        stop = min(start + 65536, rows)
+        block = centers[rng.integers(clusters, size=stop - start)]
+        block += rng.standard_normal((stop - start, dim), dtype=np.float32)
+        vectors[start:stop] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    return vectors
@@ -0,0 +1,251 @@
+"""
+BM25 keyword index over `Title` and `Synopsis`, for the Hybrid search.
+
+Every term points to the sorted catalog rows containing it, stored CSR-style with the
+precomputed BM25 contribution (impact) of the term to each row as ``float16``, so a
+query only adds impacts. Queries run term at a time with MaxScore pruning: terms are
+processed from the highest upper bound down, and once the bounds of the remaining
+terms cannot lift an unseen row into the top k, those terms are only looked up for
+the rows still in the running.
+
+`reciprocal_rank_fusion` merges these results with the dense results of the vector
+index.
+"""
+import json
+import os
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# Rank constant of reciprocal-rank fusion
+RRF_K = 60
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he her his in into is it its of on or
+she that the their them they this to was were when where which while who will with
+""".split())
+
+
+def tokenize(text):
+    """
+    Split text into lowercase ASCII terms, without stopwords
+
+    Parameters
+    ----------
+    text : str
+        The text
+
+    Returns
+    -------
+    list of str
+        The terms, in order
+    """
+    text = unicodedata.normalize('NFKD', text).encode('ascii', errors='ignore').decode('ascii').lower()
+    return [term for term in re.findall(r'[a-z0-9]+', text) if term not in STOPWORDS]
+
+
+def _tokenize_column(texts):
+    """Tokenize a text column like `tokenize`, returning one term per element indexed by row."""
+    terms = (texts.fillna('').reset_index(drop=True)
+             .str.normalize('NFKD').str.encode('ascii', errors='ignore').str.decode('ascii')
+             .str.lower().str.findall(r'[a-z0-9]+').explode().dropna())
+    return terms[~terms.isin(STOPWORDS)]
+
+
+class BM25Index:
+    """
+    Inverted index with BM25 impacts over the titles and synopses
+
+    Parameters
+    ----------
+    titles : pandas.Series
+        The `Title` column
+    synopses : pandas.Series
+        The `Synopsis` column
+    ratings : array-like of float
+        The `Rating` of every row, used to filter results
+    votes : array-like of float
+        The `Number of Votes` of every row, used to filter results
+
+    Without `titles` an empty index is created, to be filled by `load`.
+    """
+
+    def __init__(self, titles=None, synopses=None, ratings=None, votes=None):
+        if titles is None:
+            return
+        terms = _tokenize_column(titles.astype(object).fillna('') + ' ' + synopses.astype(object).fillna(''))
+        rows = terms.index.to_numpy(dtype=np.int64)
+        size = len(titles)
+        lengths = np.bincount(rows, minlength=size).astype(np.float32)
+
+        # Term frequency of every (term, row) pair, grouped by term and sorted by row
+        codes, keys = pd.factorize(terms.to_numpy(dtype=object), sort=True)
+        pairs, tf = np.unique(codes.astype(np.int64) * size + rows, return_counts=True)
+        pair_terms, pair_rows = pairs // size, pairs % size
+        offsets = np.searchsorted(pair_terms, np.arange(len(keys) + 1)).astype(np.int64)
+
+        df = np.diff(offsets).astype(np.float32)
+        idf = np.log1p((size - df + 0.5) / (df + 0.5))
+        norm = K1 * (1 - B + B * lengths / max(lengths.mean(), 1.0))
+        impacts = idf[pair_terms] * tf * (K1 + 1) / (tf + norm[pair_rows])
+
+        self.keys = np.asarray(keys, dtype=str)
+        self.offsets = offsets
+        self.rows = pair_rows.astype(np.int32)
+        self.impacts = impacts.astype(np.float16)
+        # Upper bound of every term's impact, for MaxScore
+        self.max_impacts = np.maximum.reduceat(impacts, offsets[:-1]).astype(np.float32) if len(keys) \
+            else np.empty(0, dtype=np.float32)
+        self.ratings = np.asarray(ratings, dtype=np.float32)
+        self.votes = np.asarray(votes, dtype=np.float64)
+
+    def save(self, directory):
+        """
+        Save the index so it can be memory-mapped with `load`
+
+        Parameters
+        ----------
+        directory : str
+            Target directory
+
+        Returns
+        -------
+        None
+        """
+        for part in ('keys', 'offsets', 'rows', 'impacts', 'max_impacts'):
+            np.save(os.path.join(directory, f"bm25_{part}.npy"), getattr(self, part))
+        with open(os.path.join(directory, 'bm25_index.json'), 'w', encoding='utf-8') as f:
+            json.dump({'k1': K1, 'b': B, 'terms': len(self.keys), 'postings': len(self.rows)}, f)
+
+    @classmethod
+    def load(cls, directory, ratings, votes):
+        """
+        Memory-map an index saved with `save`
+
+        Parameters
+        ----------
+        directory : str
+            Source directory
+        ratings, votes : array-like of float
+            See `BM25Index`
+
+        Returns
+        -------
+        BM25Index or None
+            The loaded index, None when the directory has none
+        """
+        if not os.path.exists(os.path.join(directory, 'bm25_keys.npy')):
+            return None
+        index = cls()
+        for part in ('keys', 'offsets', 'rows', 'impacts', 'max_impacts'):
+            setattr(index, part, np.load(os.path.join(directory, f"bm25_{part}.npy"), mmap_mode='r'))
+        index.ratings = np.asarray(ratings, dtype=np.float32)
+        index.votes = np.asarray(votes, dtype=np.float64)
+        return index
+
+    def _postings(self, term):
+        """Return the rows and impacts of `term`, or None for unknown terms."""
+        position = np.searchsorted(self.keys, term)
+        if position == len(self.keys) or self.keys[position] != term:
+            return None
+        lo, hi = self.offsets[position], self.offsets[position + 1]
+        return (np.asarray(self.rows[lo:hi]), np.asarray(self.impacts[lo:hi], dtype=np.float32),
+                float(self.max_impacts[position]))
+
+    def search(self, query, min_rating=0.0, min_votes=0, limit=10):
+        """
+        Return the `limit` rows with the highest BM25 score for `query`
+
+        Parameters
+        ----------
+        query : str
+            Keywords
+        min_rating : float
+            Minimum rating of the returned rows
+        min_votes : float
+            Minimum number of votes of the returned rows
+        limit : int
+            Maximum number of rows returned
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            The row positions and their scores, best first
+        """
+        terms = [self._postings(term) for term in dict.fromkeys(tokenize(query))]
+        terms = sorted((term for term in terms if term is not None), key=lambda term: -term[2])
+        if not terms:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        allowed = (self.ratings >= min_rating) & (self.votes >= min_votes)
+        bounds = np.cumsum([term[2] for term in terms][::-1])[::-1]
+
+        # Essential terms: every row they contain may still reach the top k
+        scores = np.zeros(len(self.ratings), dtype=np.float32)
+        candidates = None
+        for i, (rows, impacts, _) in enumerate(terms):
+            if candidates is None:
+                scores[rows] += impacts
+                remaining = bounds[i + 1] if i + 1 < len(terms) else 0.0
+                threshold = self._threshold(scores, allowed, limit)
+                if remaining < threshold:
+                    # No unseen row can enter the top k: keep only the rows that still can
+                    candidates = np.flatnonzero(allowed & (scores + remaining >= threshold))
+                    candidate_scores = scores[candidates]
+            else:
+                # Non-essential terms only add to the remaining candidates
+                positions = np.minimum(np.searchsorted(rows, candidates), len(rows) - 1)
+                hit = rows[positions] == candidates
+                candidate_scores[hit] += impacts[positions[hit]]
+
+        if candidates is None:
+            candidates = np.flatnonzero(allowed & (scores > 0))
+            candidate_scores = scores[candidates]
+        best = np.argsort(-candidate_scores, kind='stable')[:limit]
+        return candidates[best].astype(np.int32), candidate_scores[best]
+
+    @staticmethod
+    def _threshold(scores, allowed, limit):
+        """Return the score of the `limit`-th best allowed row, 0 when fewer rows scored."""
+        scored = scores[allowed]
+        if len(scored) < limit:
+            return 0.0
+        return float(np.partition(scored, len(scored) - limit)[len(scored) - limit])
+
+
+def reciprocal_rank_fusion(rankings, limit=10, k=RRF_K):
+    """
+    Merge ranked lists with reciprocal-rank fusion
+
+    Every item scores ``sum(1 / (k + rank))`` over the lists it appears in, with ranks
+    starting at 1.
+
+    Parameters
+    ----------
+    rankings : list of array-like of int
+        Row positions, best first, one list per retriever
+    limit : int
+        Maximum number of rows returned
+    k : float
+        Rank constant; larger values flatten the contribution of the top ranks
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        The fused row positions and their fused scores, best first
+    """
+    rankings = [np.asarray(ranking, dtype=np.int64) for ranking in rankings if len(ranking)]
+    if not rankings:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+    rows = np.concatenate(rankings)
+    contributions = np.concatenate([1.0 / (k + np.arange(1, len(ranking) + 1)) for ranking in rankings])
+    unique, inverse = np.unique(rows, return_inverse=True)
+    fused = np.bincount(inverse, weights=contributions)
+    # Ties keep the row seen first in the rankings
+    first = np.full(len(unique), len(rows))
+    np.minimum.at(first, inverse, np.arange(len(rows)))
+    best = np.lexsort((first, -fused))[:limit]
+    return unique[best].astype(np.int32), fused[best].astype(np.float32)
@@ -0,0 +1,259 @@
+"""
+Inverted index for the Cast search.
+
+Built from the `Cast Names` column produced by `new_columns` in
+``notebooks/functions.py``: every person name, and every word of it, points to the
+sorted list of catalog rows where it appears. A query is answered with prefix lookups
+on the sorted key array and intersections of the posting lists.
+"""
+import os
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+
+def normalize_query(text):
+    """
+    Normalize a search query the same way `normalize_names` normalizes cast names
+
+    Parameters
+    ----------
+    text : str
+        The query
+
+    Returns
+    -------
+    str
+        The query without accents, lowercased and with single spaces
+    """
+    text = unicodedata.normalize('NFKD', text).encode('ascii', errors='ignore').decode('ascii')
+    return re.sub(r'\s+', ' ', text.lower()).strip()
+
+
+class PostingLists:
+    """
+    Sorted string keys mapped to sorted int32 row lists, stored CSR-style
+
+    Parameters
+    ----------
+    keys : pandas.Series
+        The key of every (key, row) pair
+    rows : array-like of int
+        The row of every (key, row) pair
+
+    Without arguments empty posting lists are created, to be filled by `load`.
+    """
+
+    def __init__(self, keys=None, rows=None):
+        if keys is None:
+            return
+        codes, keys = pd.factorize(np.asarray(keys, dtype=object), sort=True)
+        rows = np.asarray(rows, dtype=np.int64)
+        # Pack (key, row) pairs into one integer so a single sort groups and dedupes them
+        width = int(rows.max()) + 1 if len(rows) else 1
+        pairs = np.unique(codes.astype(np.int64) * width + rows)
+        self.keys = np.asarray(keys, dtype=str)
+        self.offsets = np.searchsorted(pairs // width, np.arange(len(self.keys) + 1)).astype(np.int64)
+        self.rows = (pairs % width).astype(np.int32)
+
+    def save(self, directory, name):
+        """
+        Save the posting lists as ``<name>_keys.npy``, ``<name>_offsets.npy`` and ``<name>_rows.npy``
+
+        Parameters
+        ----------
+        directory : str
+            Target directory
+        name : str
+            File name prefix
+
+        Returns
+        -------
+        None
+        """
+        for part in ('keys', 'offsets', 'rows'):
+            np.save(os.path.join(directory, f"{name}_{part}.npy"), getattr(self, part))
+
+    @classmethod
+    def load(cls, directory, name):
+        """
+        Memory-map posting lists saved with `save`
+
+        Parameters
+        ----------
+        directory : str
+            Source directory
+        name : str
+            File name prefix
+
+        Returns
+        -------
+        PostingLists
+            The loaded posting lists
+        """
+        postings = cls()
+        for part in ('keys', 'offsets', 'rows'):
+            # Plain ndarray views of the maps, slicing a memmap object costs more than the lookup
+            setattr(postings, part, np.asarray(np.load(os.path.join(directory, f"{name}_{part}.npy"), mmap_mode='r')))
+        return postings
+
+    def _width(self):
+        """Return the length of the longest key, the width of the key array."""
+        return self.keys.dtype.itemsize // np.dtype('U1').itemsize
+
+    def exact(self, key):
+        """
+        Return the rows of `key`
+
+        Parameters
+        ----------
+        key : str
+            The key
+
+        Returns
+        -------
+        numpy.ndarray
+            The sorted rows, empty for unknown keys
+        """
+        # A key longer than every stored key would make searchsorted widen the whole array
+        if len(key) > self._width():
+            return np.empty(0, dtype=np.int32)
+        position = np.searchsorted(self.keys, key, side='left')
+        if position == len(self.keys) or self.keys[position] != key:
+            return np.empty(0, dtype=np.int32)
+        return self.rows[self.offsets[position]:self.offsets[position + 1]]
+
+    def prefix(self, prefix):
+        """
+        Return the rows of every key starting with `prefix`
+
+        Parameters
+        ----------
+        prefix : str
+            The key prefix
+
+        Returns
+        -------
+        numpy.ndarray
+            The sorted, unique rows
+        """
+        # Keys starting with the prefix form one contiguous range of the sorted key array
+        if len(prefix) > self._width():
+            return np.empty(0, dtype=np.int32)
+        lo = np.searchsorted(self.keys, prefix, side='left')
+        hi = np.searchsorted(self.keys, prefix + '\uffff', side='left') if len(prefix) < self._width() \
+            else np.searchsorted(self.keys, prefix, side='right')
+        if lo == hi:
+            return np.empty(0, dtype=np.int32)
+        if hi - lo == 1:
+            return self.rows[self.offsets[lo]:self.offsets[hi]]
+        return np.unique(self.rows[self.offsets[lo]:self.offsets[hi]])
+
+
+class CastIndex:
+    """
+    Inverted index from person names to catalog rows
+
+    Parameters
+    ----------
+    cast_names : pandas.Series
+        The `Cast Names` column, one '|'-joined list of normalized names per row
+    ratings : array-like of float
+        The `Rating` of every row, used to filter results
+    votes : array-like of float
+        The `Number of Votes` of every row, used to rank results
+    names, words : PostingLists, optional
+        Prebuilt posting lists, `cast_names` is ignored when they are given
+    """
+
+    def __init__(self, cast_names, ratings, votes, names=None, words=None):
+        if names is None:
+            cast_names = cast_names.fillna('').reset_index(drop=True).str.split('|').explode()
+            cast_names = cast_names[cast_names != '']
+            names = PostingLists(cast_names, cast_names.index)
+            cast_words = cast_names.str.split(' ').explode()
+            words = PostingLists(cast_words, cast_words.index)
+        self.names = names
+        self.words = words
+
+        self.ratings = np.asarray(ratings, dtype=np.float32)
+        self.votes = np.asarray(votes, dtype=np.float64)
+
+    def save(self, directory):
+        """
+        Save the posting lists so the index can be memory-mapped with `load`
+
+        Parameters
+        ----------
+        directory : str
+            Target directory
+
+        Returns
+        -------
+        None
+        """
+        self.names.save(directory, 'cast_names')
+        self.words.save(directory, 'cast_words')
+
+    @classmethod
+    def load(cls, directory, ratings, votes):
+        """
+        Memory-map an index saved with `save`
+
+        Parameters
+        ----------
+        directory : str
+            Source directory
+        ratings, votes : array-like of float
+            See `CastIndex`
+
+        Returns
+        -------
+        CastIndex
+            The loaded index
+        """
+        return cls(None, ratings, votes,
+                   names=PostingLists.load(directory, 'cast_names'),
+                   words=PostingLists.load(directory, 'cast_words'))
+
+    def search(self, query, min_rating=0.0, limit=50):
+        """
+        Find the rows whose cast matches `query`
+
+        Every word of the query must be the prefix of a word of some person in the cast,
+        so "cox" and "brian c" both match Brian Cox. Rows where the whole query is the
+        prefix of a single person's name rank first, then rows are ranked by number of
+        votes.
+
+        Parameters
+        ----------
+        query : str
+            A full or partial person name
+        min_rating : float
+            Minimum rating of the returned rows
+        limit : int
+            Maximum number of rows returned
+
+        Returns
+        -------
+        numpy.ndarray
+            The matching row positions, best first
+        """
+        query = normalize_query(query)
+        if not query:
+            return np.empty(0, dtype=np.int32)
+
+        rows = None
+        for word in query.split(' '):
+            postings = self.words.prefix(word)
+            rows = postings if rows is None else np.intersect1d(rows, postings, assume_unique=True)
+            if len(rows) == 0:
+                return rows
+        rows = rows[self.ratings[rows] >= min_rating]
+
+        # Whole-name matches first, then the most voted series
+        whole_name = np.isin(rows, self.names.prefix(query), assume_unique=True)
+        order = np.lexsort((-self.votes[rows], ~whole_name))
+        return rows[order[:limit]]
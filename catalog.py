@@ -0,0 +1,187 @@
+"""
+Serving-side view of the clean series catalog.
+
+The catalog keeps a hash index from IMDb ID to row position, built once at load time,
+so turning a list of matched IDs into display records is a single gather instead of
+one DataFrame scan per match.
+
+`compact_catalog` shrinks the clean catalog to the columns and types served: low
+cardinality labels become categoricals, numbers use 32 bits and text is Arrow-backed.
+Written to the artifact and memory-mapped (see ``artifact.py``), the same pages are
+shared by every worker on the host.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+DISPLAY_COLUMNS = ['IMDb ID', 'Title', 'Genre', 'Main Genre', 'Cast', 'Synopsis', 'Rating']
+# Types of the served columns; any other column (`embedding`, `Cast Names`...) is only
+# needed to build embeddings and indexes and is dropped
+COMPACT_TYPES = {
+    'IMDb ID': pd.ArrowDtype(pa.string()),
+    'Title': pd.ArrowDtype(pa.string()),
+    'Genre': 'category',
+    'Main Genre': 'category',
+    'Cast': pd.ArrowDtype(pa.string()),
+    'Synopsis': pd.ArrowDtype(pa.string()),
+    'Rating': np.float32,
+    'Number of Votes': np.int32,
+    'Mood': 'category',
+}
+
+
+def compact_catalog(df, columns=None):
+    """
+    Keep the served columns of the catalog, with compact types
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The clean catalog
+    columns : list of str, optional
+        Columns to keep, all the columns of `COMPACT_TYPES` by default
+
+    Returns
+    -------
+    pandas.DataFrame
+        The compact catalog, with a fresh row index
+    """
+    columns = columns or list(COMPACT_TYPES)
+    df = df[columns].reset_index(drop=True)
+    return df.astype({column: COMPACT_TYPES[column] for column in columns if column in COMPACT_TYPES})
+
+
+def memory_report(df, original=None):
+    """
+    Print and return the memory used by every column
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The catalog to measure
+    original : pandas.DataFrame, optional
+        The catalog before compaction, reported next to `df` for comparison
+
+    Returns
+    -------
+    pandas.DataFrame
+        The dtype and bytes of every column, plus the original bytes when given
+    """
+    report = pd.DataFrame({'dtype': df.dtypes.astype(str),
+                           'bytes': df.memory_usage(deep=True, index=False)})
+    if original is not None:
+        report['original bytes'] = original.memory_usage(deep=True, index=False).reindex(report.index)
+    total = report['bytes'].sum()
+    print(report.to_string())
+    if original is not None:
+        before = original.memory_usage(deep=True, index=False).sum()
+        print(f"Catalog: {total / 2**20:.1f} MiB, was {before / 2**20:.1f} MiB.")
+    else:
+        print(f"Catalog: {total / 2**20:.1f} MiB.")
+    return report
+
+
+class Catalog:
+    """
+    Clean series catalog with an IMDb ID to row lookup table
+
+    When an IMDb ID appears more than once, the lookup resolves to its first row,
+    which is the one with the most votes in the output of `unique_films`.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The clean catalog, as written to ``data/clean_data/series.csv``
+    """
+
+    def __init__(self, df):
+        self.df = df.reset_index(drop=True)
+        ids = self.df['IMDb ID'].astype(str)
+        first = ~ids.duplicated().to_numpy()
+        self._rows = np.flatnonzero(first)
+        self.id_index = pd.Index(ids[first].to_numpy())
+        self._display = {}
+
+    def __len__(self):
+        return len(self.df)
+
+    def positions(self, ids):
+        """
+        Look up the row position of every IMDb ID
+
+        Parameters
+        ----------
+        ids : sequence of str
+            The IMDb IDs to look up
+
+        Returns
+        -------
+        numpy.ndarray
+            The row position of every ID, -1 for unknown IDs
+        """
+        found = self.id_index.get_indexer(pd.Index(ids, dtype=object).astype(str))
+        return np.where(found >= 0, self._rows[np.maximum(found, 0)], -1)
+
+    def records(self, positions, columns=DISPLAY_COLUMNS):
+        """
+        Gather the display records of the given rows in one step
+
+        Parameters
+        ----------
+        positions : array-like of int
+            Row positions in the catalog
+        columns : list of str
+            Columns included in every record
+
+        Returns
+        -------
+        list of dict
+            One record per position, in the same order
+        """
+        positions = np.asarray(positions, dtype=np.intp)
+        values = [self._display_values(column).take(positions) for column in columns]
+        values = [taken.to_pylist() if isinstance(taken, (pa.Array, pa.ChunkedArray)) else taken.tolist()
+                  for taken in values]
+        return [dict(zip(columns, row)) for row in zip(*values)]
+
+    def _display_values(self, column):
+        """Return the values of a column ready for display, prepared on first use."""
+        values = self._display.get(column)
+        if values is None:
+            series = self.df[column]
+            # NumPy and Arrow columns as plain arrays, so the lists hold Python scalars and None
+            if isinstance(series.dtype, pd.ArrowDtype):
+                values = pa.array(series.array)
+            else:
+                values = series.to_numpy() if isinstance(series.dtype, np.dtype) else series.array
+            if getattr(series.dtype, 'numpy_dtype', series.dtype) == np.float32:
+                # A float32 9.1 would be displayed as 9.100000381469727 once widened to a Python float
+                values = np.round(np.asarray(values, dtype=np.float64), 6)
+            self._display[column] = values
+        return values
+
+    def hydrate(self, ids, scores=None, columns=DISPLAY_COLUMNS):
+        """
+        Turn a list of matched IMDb IDs into display records
+
+        Parameters
+        ----------
+        ids : sequence of str
+            The matched IMDb IDs, in ranking order
+        scores : sequence of float, optional
+            The score of every match, added to its record as 'Score'
+        columns : list of str
+            Columns included in every record
+
+        Returns
+        -------
+        list of dict
+            One record per known ID, in the same order; unknown IDs are skipped
+        """
+        positions = self.positions(ids)
+        known = positions >= 0
+        records = self.records(positions[known], columns)
+        if scores is not None:
+            for record, score in zip(records, np.asarray(scores)[known]):
+                record['Score'] = float(score)
+        return records
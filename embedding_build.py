@@ -0,0 +1,393 @@
+"""
+Resumable embedding build stage.
+
+Encodes the ``Title + ' ' + Synopsis`` text of every series in batches, caches the
+vectors on disk keyed by a hash of the model and the content so a re-run only encodes
+rows that changed,
+bulk-upserts them to Pinecone and writes the matrix used by the local vector index.
+
+Run it from the project root with ``python embedding_build.py``; the settings live in
+the ``embedding_build`` section of ``config.yaml``.
+"""
+import glob
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from vector_index import METADATA_COLUMNS, connect_pinecone, quantization_report, save_embeddings, save_quantized
+
+CHUNK_PATTERN = 'chunk_*.npz'
+UPSERTED_FILE = 'upserted.tsv'
+
+
+def content_hash(titles, synopses, model_name='', dimension=None):
+    """
+    Hash the text that is embedded for every series, together with the model
+
+    The model name and dimension are part of the hash, so switching the model
+    encodes every series again instead of mixing vectors of two models.
+
+    Parameters
+    ----------
+    titles, synopses : sequence of str
+        The `Title` and `Synopsis` of every series
+    model_name : str
+        Name of the embedding model
+    dimension : int, optional
+        Dimension of its vectors
+
+    Returns
+    -------
+    numpy.ndarray
+        The hexadecimal SHA-1 of ``model_name/dimension + '\\n' + Title + '\\n' + Synopsis``
+        for every series
+    """
+    model_key = f"{model_name}/{dimension}"
+    return np.array([hashlib.sha1(f"{model_key}\n{title}\n{synopsis}".encode('utf-8')).hexdigest()
+                     for title, synopsis in zip(titles, synopses)])
+
+
+def vector_metadata(df):
+    """
+    Build the metadata stored with every vector so searches can filter in the index
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The clean catalog
+
+    Returns
+    -------
+    pandas.DataFrame
+        The 'Rating', 'Number of Votes', 'Main Genre' and 'Mood' columns with plain
+        float and string types
+    """
+    metadata = df[METADATA_COLUMNS].copy()
+    metadata['Rating'] = metadata['Rating'].astype(float)
+    metadata['Number of Votes'] = metadata['Number of Votes'].astype(float)
+    metadata['Main Genre'] = metadata['Main Genre'].astype(str)
+    metadata['Mood'] = metadata['Mood'].astype(str)
+    return metadata
+
+
+class EmbeddingCache:
+    """
+    On-disk cache of embeddings keyed by content hash
+
+    Vectors are appended as numbered ``.npz`` chunks. Each chunk is written to a
+    temporary file and renamed, so a build that dies halfway leaves only complete
+    chunks behind and the next run resumes from them.
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding the chunks
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.vectors = {}
+        for path in sorted(glob.glob(os.path.join(directory, CHUNK_PATTERN))):
+            with np.load(path) as chunk:
+                self.vectors.update(zip(chunk['hashes'], chunk['vectors']))
+        self._next_chunk = len(glob.glob(os.path.join(directory, CHUNK_PATTERN)))
+
+    def __contains__(self, key):
+        return key in self.vectors
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def add(self, hashes, vectors):
+        """
+        Persist a chunk of freshly encoded vectors
+
+        Parameters
+        ----------
+        hashes : numpy.ndarray
+            Content hash of every vector
+        vectors : numpy.ndarray
+            The encoded vectors
+
+        Returns
+        -------
+        None
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        path = os.path.join(self.directory, f"chunk_{self._next_chunk:05d}.npz")
+        tmp_path = os.path.join(self.directory, f"tmp_chunk_{self._next_chunk:05d}.npz")
+        np.savez(tmp_path, hashes=np.asarray(hashes), vectors=vectors)
+        os.replace(tmp_path, path)
+        self._next_chunk += 1
+        self.vectors.update(zip(hashes, vectors))
+
+    def matrix(self, hashes):
+        """
+        Gather the cached vectors for `hashes` into one matrix
+
+        Parameters
+        ----------
+        hashes : sequence of str
+            Content hashes, all of them already cached
+
+        Returns
+        -------
+        numpy.ndarray
+            The embedding matrix in the order of `hashes`
+        """
+        return np.stack([self.vectors[key] for key in hashes]).astype(np.float32)
+
+
+def encode_missing(model, texts, hashes, cache, batch_size=256, chunk_size=8192, workers=1):
+    """
+    Encode the texts whose hash is not cached yet, checkpointing every chunk
+
+    Parameters
+    ----------
+    model : sentence_transformers.SentenceTransformer
+        The embedding model
+    texts : sequence of str
+        The text of every series
+    hashes : numpy.ndarray
+        The content hash of every text
+    cache : EmbeddingCache
+        Cache updated with the new vectors
+    batch_size : int
+        Number of texts per `model.encode` batch
+    chunk_size : int
+        Number of texts encoded between two checkpoints
+    workers : int
+        Number of encoder processes; 1 encodes in the current process
+
+    Returns
+    -------
+    int
+        The number of texts encoded
+    """
+    # Encode each distinct pending text only once
+    pending = {}
+    for text, key in zip(texts, hashes):
+        if key not in cache and key not in pending:
+            pending[key] = text
+    keys = list(pending)
+
+    pool = model.start_multi_process_pool(['cpu'] * workers) if workers > 1 else None
+    try:
+        for start in range(0, len(keys), chunk_size):
+            chunk_keys = keys[start:start + chunk_size]
+            chunk_texts = [pending[key] for key in chunk_keys]
+            if pool is None:
+                vectors = model.encode(chunk_texts, batch_size=batch_size, convert_to_numpy=True)
+            else:
+                vectors = model.encode_multi_process(chunk_texts, pool, batch_size=batch_size)
+            cache.add(chunk_keys, vectors)
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+    return len(keys)
+
+
+def upsert_batches(index, ids, hashes, vectors, directory, batch_size=200, metadata=None):
+    """
+    Upsert vectors to Pinecone in batches, skipping the ones already uploaded
+
+    Every successful batch is appended to ``upserted.tsv`` in `directory`, so an
+    interrupted upload resumes where it stopped and a re-run only sends changed rows.
+    A change in the metadata of a row also counts as a change.
+
+    Parameters
+    ----------
+    index : pinecone.Index
+        The target index
+    ids : sequence of str
+        The IMDb ID of every vector
+    hashes : sequence of str
+        The content hash of every vector
+    vectors : numpy.ndarray
+        The embedding matrix
+    directory : str
+        Directory holding the upsert log
+    batch_size : int
+        Number of vectors per `upsert` call
+    metadata : list of dict, optional
+        Metadata stored with every vector
+
+    Returns
+    -------
+    int
+        The number of vectors upserted
+    """
+    if metadata is not None:
+        hashes = [hashlib.sha1(f"{key}\n{json.dumps(meta, sort_keys=True)}".encode('utf-8')).hexdigest()
+                  for key, meta in zip(hashes, metadata)]
+    log_path = os.path.join(directory, UPSERTED_FILE)
+    done = set()
+    if os.path.exists(log_path):
+        with open(log_path, encoding='utf-8') as f:
+            done = {tuple(line.rstrip('\n').split('\t')) for line in f}
+
+    pending = [i for i, (series_id, key) in enumerate(zip(ids, hashes)) if (series_id, key) not in done]
+    with open(log_path, 'a', encoding='utf-8') as log:
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            records = []
+            for i in batch:
+                record = {'id': ids[i], 'values': vectors[i].tolist()}
+                if metadata is not None:
+                    record['metadata'] = metadata[i]
+                records.append(record)
+            index.upsert(vectors=records)
+            log.writelines(f"{ids[i]}\t{hashes[i]}\n" for i in batch)
+            log.flush()
+    return len(pending)
+
+
+def build_embeddings(df, model, cache_dir, output_dir, index=None, batch_size=256,
+                     chunk_size=8192, workers=1, upsert_batch_size=200, quantize=(),
+                     evaluate_quantization=False, model_name=''):
+    """
+    Build the embeddings of the catalog, reusing every vector already on disk
+
+    The 'Rating', 'Number of Votes', 'Main Genre' and 'Mood' of every series are
+    stored as vector metadata, both in Pinecone and next to the local matrix, so the
+    search filters run inside the vector query.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The clean catalog with the 'IMDb ID', 'Title', 'Synopsis' and metadata columns
+    model : sentence_transformers.SentenceTransformer
+        The embedding model; its dimension is part of the content hash
+    cache_dir : str
+        Directory of the content-hash cache and upsert log
+    output_dir : str
+        Directory where the matrix for the local vector index is written
+    index : pinecone.Index, optional
+        Pinecone index to upsert to; skipped when None
+    batch_size, chunk_size, workers
+        See `encode_missing`
+    upsert_batch_size : int
+        Number of vectors per `upsert` call
+    quantize : list of str
+        Quantized copies (``'float16'``, ``'int8'``) saved next to the matrix
+    evaluate_quantization : bool
+        Whether to report the memory saved and the recall@10 of each quantized copy,
+        measured with `quantization_report` on a sample of queries
+    model_name : str
+        Name of the embedding model, part of the content hash so vectors cached for
+        another model are never reused
+
+    Returns
+    -------
+    dict
+        Row counts, timings and throughput of each step
+    """
+    df = df.reset_index(drop=True)
+    ids = df['IMDb ID'].astype(str).tolist()
+    hashes = content_hash(df['Title'], df['Synopsis'], model_name, model.get_sentence_embedding_dimension())
+    texts = (df['Title'] + ' ' + df['Synopsis']).tolist()
+    cache = EmbeddingCache(cache_dir)
+
+    start = time.perf_counter()
+    encoded = encode_missing(model, texts, hashes, cache, batch_size=batch_size,
+                             chunk_size=chunk_size, workers=workers)
+    encode_seconds = time.perf_counter() - start
+
+    vectors = cache.matrix(hashes)
+    metadata = vector_metadata(df)
+    save_embeddings(output_dir, ids, vectors, metadata=metadata)
+    quantization = {}
+    for mode in quantize:
+        save_quantized(output_dir, vectors, mode)
+        if evaluate_quantization:
+            quantization[mode] = quantization_report(vectors, mode)
+
+    upserted, upsert_seconds = 0, 0.0
+    if index is not None:
+        start = time.perf_counter()
+        upserted = upsert_batches(index, ids, hashes, vectors, cache_dir, batch_size=upsert_batch_size,
+                                  metadata=metadata.to_dict('records'))
+        upsert_seconds = time.perf_counter() - start
+
+    stats = {
+        'rows': len(df),
+        'encoded': encoded,
+        'reused': len(df) - encoded,
+        'encode_seconds': encode_seconds,
+        'encode_rows_per_second': encoded / encode_seconds if encoded else 0.0,
+        'upserted': upserted,
+        'upsert_seconds': upsert_seconds,
+        'upsert_rows_per_second': upserted / upsert_seconds if upserted else 0.0,
+        'quantization': quantization,
+    }
+    print(f"Encoded {encoded} of {len(df)} rows in {encode_seconds:.1f}s "
+          f"({stats['encode_rows_per_second']:.0f} rows/s), reused {stats['reused']}.")
+    if index is not None:
+        print(f"Upserted {upserted} vectors in {upsert_seconds:.1f}s "
+              f"({stats['upsert_rows_per_second']:.0f} rows/s).")
+    return stats
+
+
+def upsert_enabled(config):
+    """
+    Whether the build uploads the vectors to Pinecone
+
+    ``embedding_build.upsert`` follows ``vector_index.backend`` when it is not set, and
+    a warning is printed when the two disagree.
+
+    Parameters
+    ----------
+    config : dict
+        The parsed ``config.yaml``
+
+    Returns
+    -------
+    bool
+        True when the vectors are upserted
+    """
+    upsert = config['embedding_build'].get('upsert')
+    pinecone = config['vector_index']['backend'] == 'pinecone'
+    if upsert is None:
+        return pinecone
+    if upsert and not pinecone:
+        print("Warning: embedding_build.upsert is true but vector_index.backend is not pinecone; "
+              "the vectors are uploaded to an index the service does not query.")
+    elif not upsert and pinecone:
+        print("Warning: vector_index.backend is pinecone but embedding_build.upsert is false; "
+              "the Pinecone index will not get the new or changed vectors.")
+    return bool(upsert)
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from sentence_transformers import SentenceTransformer
+
+    from settings import load_config
+
+    load_dotenv()
+    config = load_config()
+    settings = config['embedding_build']
+
+    pinecone_index = None
+    if upsert_enabled(config):
+        pc = connect_pinecone(os.getenv("key"))
+        pinecone_index = pc.Index(config['vector_index']['pinecone_index'])
+
+    model_name = settings.get('model', 'all-MiniLM-L6-v2')
+    build_embeddings(pd.read_csv(config['paths']['data_cleaned']),
+                     SentenceTransformer(model_name),
+                     cache_dir=settings['cache_dir'],
+                     output_dir=config['vector_index']['embeddings_dir'],
+                     index=pinecone_index,
+                     batch_size=settings.get('batch_size', 256),
+                     chunk_size=settings.get('chunk_size', 8192),
+                     workers=settings.get('workers', 1),
+                     upsert_batch_size=settings.get('upsert_batch_size', 200),
+                     quantize=settings.get('quantize', []),
+                     evaluate_quantization=settings.get('evaluate_quantization', False),
+                     model_name=model_name)
@@ -0,0 +1,236 @@
+"""
+Bitmap index over genres and moods for the Top 10 and Moods pages.
+
+Rows are presorted once by rating (best first) and every genre and mood gets a packed
+bitmap over that order. A top-N query is a bitmap AND plus a walk down the presorted
+order until N rows pass the vote threshold.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Bytes of a bitmap unpacked at a time by the walk, 32768 rows
+WALK_CHUNK = 4096
+
+
+def split_genres(genres):
+    """
+    Split the comma-separated `Genre` strings into exact genre names
+
+    Parameters
+    ----------
+    genres : pandas.Series
+        The `Genre` column
+
+    Returns
+    -------
+    pandas.Series
+        One genre name per element, indexed by the row it comes from
+    """
+    tokens = genres.fillna('').str.split(',').explode().str.strip()
+    return tokens[tokens != '']
+
+
+def load_genre_matrix(path, ids):
+    """
+    Load the genre matrix saved next to the clean CSV by ``notebooks/functions.py``
+
+    Parameters
+    ----------
+    path : str
+        Path of ``genre_matrix.npz``
+    ids : array-like of str
+        The `IMDb ID` of every catalog row, to check the matrix rows match
+
+    Returns
+    -------
+    pandas.DataFrame or None
+        One boolean column per genre, None when the file does not exist
+    """
+    if not path or not os.path.exists(path):
+        return None
+    with np.load(path) as saved:
+        if not np.array_equal(saved['ids'], np.asarray(ids, dtype=str)):
+            raise ValueError(f"{path} does not match the catalog rows, rerun to_csv")
+        return pd.DataFrame(saved['matrix'], columns=list(saved['labels']))
+
+
+class GenreIndex:
+    """
+    Packed genre and mood bitmaps over the rows presorted by rating
+
+    Parameters
+    ----------
+    genres : pandas.Series
+        The `Genre` column
+    main_genres : pandas.Series
+        The `Main Genre` column
+    moods : pandas.Series
+        The `Mood` column
+    ratings : array-like of float
+        The `Rating` of every row
+    votes : array-like of float
+        The `Number of Votes` of every row
+    genre_matrix : pandas.DataFrame, optional
+        One boolean column per genre, as loaded by `load_genre_matrix`; `genres` is only
+        parsed when it is not given
+
+    Without arguments an empty index is created, to be filled by `load`.
+    """
+
+    def __init__(self, genres=None, main_genres=None, moods=None, ratings=None, votes=None,
+                 genre_matrix=None):
+        if genres is None:
+            return
+        self.size = len(genres)
+        # Row positions sorted by rating, ties keep the catalog order like nlargest
+        self.order = np.argsort(-np.asarray(ratings, dtype=np.float64), kind='stable')
+        self.votes = np.asarray(votes, dtype=np.float64)[self.order]
+        rank = np.empty(self.size, dtype=np.int64)
+        rank[self.order] = np.arange(self.size)
+
+        if genre_matrix is None:
+            tokens = split_genres(genres.reset_index(drop=True))
+            self.genre_bits = self._bitmaps(tokens, rank)
+            self.genre_options = list(tokens.unique())
+        else:
+            # Reorder the rows by rating and pack every genre column into a bitmap
+            matrix = np.asarray(genre_matrix, dtype=bool)[self.order]
+            self.genre_bits = dict(zip(genre_matrix.columns, np.packbits(matrix.T, axis=1)))
+            self.genre_options = list(genre_matrix.columns)
+        self.mood_bits = self._bitmaps(moods.reset_index(drop=True), rank)
+
+        self.main_genre_options = list(main_genres.dropna().unique())
+        self._empty = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+
+    def save(self, directory):
+        """
+        Save the index so it can be memory-mapped with `load`
+
+        The bitmaps are stacked into one matrix per kind, the labels and option lists
+        go to ``genre_index.json``.
+
+        Parameters
+        ----------
+        directory : str
+            Target directory
+
+        Returns
+        -------
+        None
+        """
+        np.save(os.path.join(directory, 'genre_order.npy'), self.order)
+        np.save(os.path.join(directory, 'genre_votes.npy'), self.votes)
+        np.save(os.path.join(directory, 'genre_bits.npy'), np.stack(list(self.genre_bits.values())))
+        np.save(os.path.join(directory, 'mood_bits.npy'), np.stack(list(self.mood_bits.values())))
+        with open(os.path.join(directory, 'genre_index.json'), 'w', encoding='utf-8') as f:
+            json.dump({'size': self.size,
+                       'genres': list(self.genre_bits),
+                       'moods': list(self.mood_bits),
+                       'main_genre_options': self.main_genre_options,
+                       'genre_options': self.genre_options}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Memory-map an index saved with `save`
+
+        Parameters
+        ----------
+        directory : str
+            Source directory
+
+        Returns
+        -------
+        GenreIndex
+            The loaded index
+        """
+        index = cls()
+        with open(os.path.join(directory, 'genre_index.json'), encoding='utf-8') as f:
+            labels = json.load(f)
+        index.size = labels['size']
+        index.order = np.load(os.path.join(directory, 'genre_order.npy'), mmap_mode='r')
+        index.votes = np.load(os.path.join(directory, 'genre_votes.npy'), mmap_mode='r')
+        genre_bits = np.load(os.path.join(directory, 'genre_bits.npy'), mmap_mode='r')
+        mood_bits = np.load(os.path.join(directory, 'mood_bits.npy'), mmap_mode='r')
+        index.genre_bits = dict(zip(labels['genres'], genre_bits))
+        index.mood_bits = dict(zip(labels['moods'], mood_bits))
+        index.main_genre_options = labels['main_genre_options']
+        index.genre_options = labels['genre_options']
+        index._empty = np.zeros((index.size + 7) // 8, dtype=np.uint8)
+        return index
+
+    def _bitmaps(self, labels, rank):
+        """Build one packed bitmap per label, with bits in rating order."""
+        bitmaps = {}
+        for label, rows in labels.groupby(labels, sort=False).groups.items():
+            mask = np.zeros(self.size, dtype=bool)
+            mask[rank[np.asarray(rows)]] = True
+            bitmaps[label] = np.packbits(mask)
+        return bitmaps
+
+    def _walk(self, bits, min_votes, n):
+        """Return the first `n` rows of `bits` with enough votes, in rating order."""
+        found = []
+        for start in range(0, len(bits), WALK_CHUNK):
+            # Positions of the rows of this chunk, stopping once n rows passed the votes filter
+            hits = 8 * start + np.flatnonzero(np.unpackbits(bits[start:start + WALK_CHUNK],
+                                                            count=min(8 * WALK_CHUNK, self.size - 8 * start)))
+            hits = hits[self.votes[hits] >= min_votes]
+            found.append(hits[:n])
+            n -= len(found[-1])
+            if n <= 0:
+                break
+        return self.order[np.concatenate(found)] if found else self.order[:0]
+
+    def top(self, genre, subgenres=(), min_votes=10000, n=10):
+        """
+        Return the best rated rows of a genre, optionally narrowed to some subgenres
+
+        Parameters
+        ----------
+        genre : str
+            Genre every row must have
+        subgenres : list of str
+            When not empty, every row must also have at least one of them
+        min_votes : float
+            Minimum number of votes
+        n : int
+            Maximum number of rows returned
+
+        Returns
+        -------
+        numpy.ndarray
+            Row positions, best rated first
+        """
+        bits = self.genre_bits.get(genre, self._empty)
+        if subgenres:
+            any_subgenre = np.bitwise_or.reduce([self.genre_bits.get(g, self._empty) for g in subgenres])
+            bits = bits & any_subgenre
+        return self._walk(bits, min_votes, n)
+
+    def top_by_mood(self, mood, min_votes=10000, n=10):
+        """
+        Return the best rated rows of a mood
+
+        Parameters
+        ----------
+        mood : str
+            The mood
+        min_votes : float
+            Minimum number of votes
+        n : int
+            Maximum number of rows returned
+
+        Returns
+        -------
+        numpy.ndarray
+            Row positions, best rated first
+        """
+        return self._walk(self.mood_bits.get(mood, self._empty), min_votes, n)
+
+    def has_mood(self, mood):
+        """Return whether any row has the given mood."""
+        return mood in self.mood_bits
@@ -0,0 +1,353 @@
+"""
+Per-stage latency histograms and slow-query log of the search path.
+
+Every search, Top 10, Moods or "more like this" call is traced: `Metrics.trace`
+returns a `Trace` whose ``stage(name)`` blocks time the steps of the call (query
+encoding, index lookups, hydration of the records, rendering in the app...). When
+the trace closes, each stage and the total go into histograms, which `render`
+writes in the Prometheus text format; the service serves it on ``GET /metrics``
+and it can also be written to a file every ``export_every`` seconds. Calls slower
+than ``slow_query_ms`` are appended to a JSON-lines slow-query log with their
+query, filters and stage timings.
+
+With ``enabled: false`` in the ``metrics`` section of ``config.yaml`` every trace is
+a shared no-op object, so the instrumented code only pays for a method call.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+PREFIX = 'series_recommender'
+
+
+class Histogram:
+    """
+    Cumulative histogram of durations, like a Prometheus histogram
+
+    Parameters
+    ----------
+    buckets : sequence of float
+        Sorted upper bounds of the buckets, in seconds
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def render(self, name, labels):
+        """Return the Prometheus text lines of the histogram."""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f"{name}_bucket{_labels(dict(labels, le=le))} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {self.sum!r}")
+        lines.append(f"{name}_count{_labels(labels)} {self.count}")
+        return lines
+
+
+def _labels(labels):
+    """Format a label set as ``{name="value",...}``."""
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class _NullStage:
+    """Reusable no-op context manager returned by disabled traces."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _NullTrace:
+    """Trace of disabled metrics: records nothing."""
+
+    _stage = _NullStage()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def stage(self, name):
+        return self._stage
+
+    def annotate(self, **fields):
+        pass
+
+
+_NULL_TRACE = _NullTrace()
+
+
+class _Stage:
+    """Times one stage of a trace."""
+
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        self.trace.stages[self.name] = self.trace.stages.get(self.name, 0.0) + seconds
+        return False
+
+
+class Trace:
+    """
+    Stage timings of one call, recorded into its `Metrics` when it closes
+
+    A trace can be entered again by the code it is passed to: only the outermost
+    ``with`` block records it, so a caller can time its own stages (e.g. waiting for
+    the encoder batch) around the ones of the callee.
+
+    Parameters
+    ----------
+    metrics : Metrics
+        Where the trace is recorded
+    operation : str
+        Name of the traced call, e.g. ``'search'``
+    fields : dict
+        Query and filters, written to the slow-query log
+    """
+
+    def __init__(self, metrics, operation, fields):
+        self.metrics = metrics
+        self.operation = operation
+        self.fields = fields
+        self.stages = {}
+        self._depth = 0
+        self._start = None
+
+    def __enter__(self):
+        if self._depth == 0:
+            self._start = time.perf_counter()
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            if exc_type is not None:
+                self.fields['error'] = exc_type.__name__
+            self.metrics.record(self, time.perf_counter() - self._start)
+        return False
+
+    def stage(self, name):
+        """
+        Time a stage of the call
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage; the time of repeated stages adds up
+
+        Returns
+        -------
+        context manager
+            Times the ``with`` block
+        """
+        return _Stage(self, name)
+
+    def annotate(self, **fields):
+        """Add fields to the slow-query log entry of the call."""
+        self.fields.update(fields)
+
+
+class Metrics:
+    """
+    Histograms of the traced calls, with Prometheus export and slow-query log
+
+    Parameters
+    ----------
+    enabled : bool
+        When False, `trace` returns a no-op trace and nothing is recorded
+    buckets : sequence of float
+        Upper bounds of the histogram buckets, in seconds
+    slow_query_ms : float, optional
+        Calls slower than this are written to `slow_query_log`; no log when None
+    slow_query_log : str, optional
+        JSON-lines file the slow calls are appended to
+    export_path : str, optional
+        File the Prometheus text is written to
+    export_every : float
+        Minimum seconds between two writes of `export_path`
+    """
+
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS, slow_query_ms=None, slow_query_log=None,
+                 export_path=None, export_every=10.0):
+        self.enabled = enabled
+        self.buckets = tuple(sorted(buckets))
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_log = slow_query_log
+        self.export_path = export_path
+        self.export_every = export_every
+        self.stage_seconds = defaultdict(lambda: Histogram(self.buckets))
+        self.total_seconds = defaultdict(lambda: Histogram(self.buckets))
+        self.slow_queries = defaultdict(int)
+        self._last_export = 0.0
+        # The service records traces from its executor threads
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, settings, export_path=None):
+        """
+        Create the metrics of the ``metrics`` section of ``config.yaml``
+
+        Parameters
+        ----------
+        settings : dict, optional
+            The ``metrics`` section; disabled metrics when None
+        export_path : str, optional
+            Overrides the ``export_path`` setting, for processes exporting their own file
+
+        Returns
+        -------
+        Metrics
+            The configured metrics
+        """
+        settings = settings or {}
+        return cls(enabled=settings.get('enabled', False),
+                   buckets=settings.get('buckets') or DEFAULT_BUCKETS,
+                   slow_query_ms=settings.get('slow_query_ms'),
+                   slow_query_log=settings.get('slow_query_log'),
+                   export_path=export_path or settings.get('export_path'),
+                   export_every=settings.get('export_every', 10.0))
+
+    def trace(self, operation, **fields):
+        """
+        Start tracing a call
+
+        Parameters
+        ----------
+        operation : str
+            Name of the call, e.g. ``'search'`` or ``'top_by_genre'``
+        **fields
+            Query and filters, written to the slow-query log
+
+        Returns
+        -------
+        Trace
+            The trace, to be used as a context manager
+        """
+        if not self.enabled:
+            return _NULL_TRACE
+        return Trace(self, operation, fields)
+
+    def record(self, trace, seconds):
+        """
+        Record a closed trace in the histograms, and in the slow-query log if slow
+
+        Parameters
+        ----------
+        trace : Trace
+            The closed trace
+        seconds : float
+            Total duration of the call
+
+        Returns
+        -------
+        None
+        """
+        slow = self.slow_query_ms is not None and seconds * 1000 >= self.slow_query_ms
+        with self._lock:
+            for stage, stage_seconds in trace.stages.items():
+                self.stage_seconds[trace.operation, stage].observe(stage_seconds)
+            self.total_seconds[trace.operation].observe(seconds)
+            if slow:
+                self.slow_queries[trace.operation] += 1
+            export = self.export_path and time.monotonic() - self._last_export >= self.export_every
+            if export:
+                self._last_export = time.monotonic()
+        if slow and self.slow_query_log:
+            self._log_slow(trace, seconds)
+        if export:
+            self.export()
+
+    def _log_slow(self, trace, seconds):
+        entry = {
+            'time': datetime.now(timezone.utc).isoformat(),
+            'operation': trace.operation,
+            'total_ms': round(seconds * 1000, 3),
+            'stages_ms': {stage: round(stage_seconds * 1000, 3) for stage, stage_seconds in trace.stages.items()},
+            **trace.fields,
+        }
+        line = json.dumps(entry, default=str) + '\n'
+        os.makedirs(os.path.dirname(self.slow_query_log) or '.', exist_ok=True)
+        # One write per line, so concurrent processes appending to the log do not interleave
+        with self._lock, open(self.slow_query_log, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+    def render(self):
+        """
+        Return the histograms and counters in the Prometheus text format
+
+        Returns
+        -------
+        str
+            The exposition text
+        """
+        lines = []
+        with self._lock:
+            lines.append(f"# HELP {PREFIX}_stage_seconds Duration of each stage of a call.")
+            lines.append(f"# TYPE {PREFIX}_stage_seconds histogram")
+            for (operation, stage), histogram in sorted(self.stage_seconds.items()):
+                lines += histogram.render(f"{PREFIX}_stage_seconds", {'operation': operation, 'stage': stage})
+            lines.append(f"# HELP {PREFIX}_call_seconds Total duration of a call.")
+            lines.append(f"# TYPE {PREFIX}_call_seconds histogram")
+            for operation, histogram in sorted(self.total_seconds.items()):
+                lines += histogram.render(f"{PREFIX}_call_seconds", {'operation': operation})
+            lines.append(f"# HELP {PREFIX}_slow_calls_total Calls slower than the slow-query threshold.")
+            lines.append(f"# TYPE {PREFIX}_slow_calls_total counter")
+            for operation, count in sorted(self.slow_queries.items()):
+                lines.append(f"{PREFIX}_slow_calls_total{_labels({'operation': operation})} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path=None):
+        """
+        Write the Prometheus text to a file, atomically
+
+        Parameters
+        ----------
+        path : str, optional
+            Target file; `export_path` by default
+
+        Returns
+        -------
+        None
+        """
+        path = path or self.export_path
+        if not path:
+            return
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # One temporary file per process and thread, so concurrent exports never share one
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
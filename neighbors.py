@@ -0,0 +1,375 @@
+"""
+Precomputed "more like this" table: the nearest series of every series.
+
+An offline job scores every embedding against every other one with blocked matrix
+products: the rows are split into blocks handled in parallel, and each block is
+scored against the columns one chunk at a time, keeping only the running top k. A
+tile of at most `memory_mb` is alive per worker, whatever the catalog size.
+
+The result is a compact table of ``int32`` neighbour rows and ``float16`` scores,
+saved next to the embeddings. The artifact build remaps it to catalog rows, so
+"more like this" is a single row lookup with no encoder and no index call.
+
+Run ``python neighbors.py`` from the project root after the embedding build; the
+settings live in the ``neighbors`` section of ``config.yaml``.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from vector_index import load_embeddings
+
+NEIGHBORS_FILE = 'neighbors.npy'
+NEIGHBOR_SCORES_FILE = 'neighbor_scores.npy'
+
+
+def _squared_norms(vectors, chunk_size=65536):
+    """Return the squared norm of every row, reading the matrix one chunk at a time."""
+    norms = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = np.asarray(vectors[start:start + chunk_size], dtype=np.float32)
+        norms[start:start + chunk_size] = np.einsum('ij,ij->i', chunk, chunk)
+    return norms
+
+
+def _block_neighbors(vectors, norms, rows, k, chunk_size):
+    """Return the k nearest rows of ``vectors[rows]`` and their squared distances."""
+    block = np.asarray(vectors[rows], dtype=np.float32)
+    best_rows = np.empty((len(block), 0), dtype=np.int64)
+    best_scores = np.empty((len(block), 0), dtype=np.float32)
+    for chunk_start in range(0, len(vectors), chunk_size):
+        chunk_stop = min(chunk_start + chunk_size, len(vectors))
+        # Squared euclidean distance, as scored by LocalIndex
+        scores = block @ np.asarray(vectors[chunk_start:chunk_stop], dtype=np.float32).T
+        scores *= -2
+        scores += norms[chunk_start:chunk_stop]
+        scores += norms[rows, None]
+        # A series is not its own neighbour
+        inside = (rows >= chunk_start) & (rows < chunk_stop)
+        scores[np.flatnonzero(inside), rows[inside] - chunk_start] = np.inf
+
+        # Merge the chunk into the running top k
+        keep = min(k, scores.shape[1])
+        top = np.argpartition(scores, keep - 1, axis=1)[:, :keep] if keep < scores.shape[1] \
+            else np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        best_rows = np.concatenate([best_rows, top + chunk_start], axis=1)
+        best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+        if best_rows.shape[1] > k:
+            top = np.argpartition(best_scores, k - 1, axis=1)[:, :k]
+            best_rows = np.take_along_axis(best_rows, top, axis=1)
+            best_scores = np.take_along_axis(best_scores, top, axis=1)
+
+    order = np.argsort(best_scores, axis=1, kind='stable')
+    return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+def nearest_neighbors(vectors, k=10, memory_mb=512, workers=None):
+    """
+    Find the `k` nearest rows of every row of an embedding matrix
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        The embedding matrix, one row per series, possibly memory-mapped: only the
+        rows of the tiles being scored are read into memory
+    k : int
+        Number of neighbours per row
+    memory_mb : float
+        Memory budget of the score tiles, shared by the workers
+    workers : int, optional
+        Number of blocks scored in parallel; all the cores by default
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        ``(rows, scores)``: the ``int32`` neighbour rows and their ``float16`` squared
+        euclidean distances, both of shape ``(len(vectors), k)`` and closest first.
+        Rows with fewer than `k` other rows are padded with -1 and infinity.
+    """
+    count = len(vectors)
+    workers = workers or os.cpu_count() or 1
+    norms = _squared_norms(vectors)
+
+    # A tile holds block x chunk float32 scores plus the argpartition int64 indices
+    cells = max(int(memory_mb * 2**20 / (12 * workers)), 1)
+    chunk_size = max(min(count, 16384, cells), 1)
+    block_size = max(min(cells // chunk_size, 4096), 1)
+    starts = range(0, count, block_size)
+
+    rows = np.full((count, k), -1, dtype=np.int32)
+    scores = np.full((count, k), np.inf, dtype=np.float16)
+
+    def score(start):
+        stop = min(start + block_size, count)
+        block_rows, block_scores = _block_neighbors(vectors, norms, np.arange(start, stop), k, chunk_size)
+        found = block_rows.shape[1]
+        rows[start:stop, :found] = block_rows
+        scores[start:stop, :found] = np.maximum(block_scores, 0)
+
+    # NumPy releases the GIL inside the matrix products and partitions
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(score, starts))
+    rows[~np.isfinite(scores)] = -1
+    return rows, scores
+
+
+def update_neighbors(previous_rows, previous_scores, previous_ids, vectors, ids, changed_ids, memory_mb=512):
+    """
+    Update a neighbour table after some embeddings were added, changed or removed
+
+    Only the changed rows are scored against the whole matrix, so the cost grows with
+    the size of the change: added and changed rows get a fresh list, and every other
+    row keeps its previous list, minus the neighbours that were removed or changed,
+    merged with its distances to the changed rows. A row that lost neighbours keeps a
+    shorter list until the next full build with `nearest_neighbors`.
+
+    Parameters
+    ----------
+    previous_rows, previous_scores : numpy.ndarray
+        The previous table, as returned by `nearest_neighbors`
+    previous_ids : numpy.ndarray
+        The IMDb ID of every row of the previous embeddings
+    vectors : numpy.ndarray
+        The new embedding matrix
+    ids : numpy.ndarray
+        The IMDb ID of every row of `vectors`
+    changed_ids : array-like of str
+        IDs whose embedding was added or changed
+    memory_mb : float
+        Memory budget of the score tiles
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        The ``(rows, scores)`` table over the rows of `vectors`
+    """
+    count, k = len(vectors), previous_rows.shape[1]
+    norms = _squared_norms(vectors)
+    new_positions = pd.Index(np.asarray(ids, dtype=str)).get_indexer(np.asarray(previous_ids, dtype=str))
+    changed = np.flatnonzero(pd.Index(np.asarray(ids, dtype=str)).isin(np.asarray(changed_ids, dtype=str)))
+    is_changed = np.zeros(count, dtype=bool)
+    is_changed[changed] = True
+
+    # Previous lists remapped to the new rows, without removed or changed neighbours
+    rows = np.full((count, k), -1, dtype=np.int64)
+    scores = np.full((count, k), np.inf, dtype=np.float32)
+    kept = new_positions >= 0
+    remapped = np.where(previous_rows >= 0, new_positions[np.maximum(previous_rows, 0)], -1)
+    rows[new_positions[kept]] = remapped[kept]
+    scores[new_positions[kept]] = previous_scores[kept]
+    stale = (rows < 0) | is_changed[np.maximum(rows, 0)]
+    rows[stale], scores[stale] = -1, np.inf
+
+    # Distances of every row to the changed rows, merged into the running top k
+    chunk_size = max(int(memory_mb * 2**20 / (12 * max(count, 1))), 1)
+    for start in range(0, len(changed), chunk_size):
+        columns = changed[start:start + chunk_size]
+        block = vectors @ np.asarray(vectors[columns], dtype=np.float32).T
+        block *= -2
+        block += norms[:, None]
+        block += norms[columns]
+        block[columns, np.arange(len(columns))] = np.inf
+        candidates = np.concatenate([rows, np.broadcast_to(columns, block.shape)], axis=1)
+        candidate_scores = np.concatenate([scores, np.maximum(block, 0)], axis=1)
+        top = np.argpartition(candidate_scores, k - 1, axis=1)[:, :k]
+        rows = np.take_along_axis(candidates, top, axis=1)
+        scores = np.take_along_axis(candidate_scores, top, axis=1)
+
+    # Added and changed rows get a list scored against the whole matrix
+    if len(changed):
+        cells = max(int(memory_mb * 2**20 / 12), 1)
+        for start in range(0, len(changed), max(cells // count, 1)):
+            block_rows = changed[start:start + max(cells // count, 1)]
+            found_rows, found_scores = _block_neighbors(vectors, norms, block_rows, k, min(count, 16384))
+            rows[block_rows] = -1
+            scores[block_rows] = np.inf
+            rows[block_rows, :found_rows.shape[1]] = found_rows
+            scores[block_rows, :found_rows.shape[1]] = np.maximum(found_scores, 0)
+
+    order = np.argsort(scores, axis=1, kind='stable')
+    rows = np.take_along_axis(rows, order, axis=1)
+    scores = np.take_along_axis(scores, order, axis=1).astype(np.float16)
+    rows[~np.isfinite(scores)] = -1
+    return rows.astype(np.int32), scores
+
+
+def save_neighbors(directory, rows, scores):
+    """
+    Save a neighbour table next to the embeddings
+
+    Parameters
+    ----------
+    directory : str
+        Target directory
+    rows, scores : numpy.ndarray
+        The table, as returned by `nearest_neighbors`
+
+    Returns
+    -------
+    None
+    """
+    np.save(os.path.join(directory, NEIGHBORS_FILE), rows)
+    np.save(os.path.join(directory, NEIGHBOR_SCORES_FILE), scores)
+
+
+def load_neighbors(directory):
+    """
+    Memory-map a neighbour table saved with `save_neighbors`
+
+    Parameters
+    ----------
+    directory : str
+        Source directory
+
+    Returns
+    -------
+    tuple of numpy.ndarray or None
+        ``(rows, scores)``, None when the directory has no table
+    """
+    if not os.path.exists(os.path.join(directory, NEIGHBORS_FILE)):
+        return None
+    return (np.load(os.path.join(directory, NEIGHBORS_FILE), mmap_mode='r'),
+            np.load(os.path.join(directory, NEIGHBOR_SCORES_FILE), mmap_mode='r'))
+
+
+class NeighborTable:
+    """
+    "More like this" table indexed by catalog row
+
+    Parameters
+    ----------
+    rows : numpy.ndarray
+        ``int32`` catalog rows of the neighbours of every catalog row, -1 padded
+    scores : numpy.ndarray
+        ``float16`` squared euclidean distance of every neighbour
+    """
+
+    def __init__(self, rows, scores):
+        self.rows = rows
+        self.scores = scores
+
+    @classmethod
+    def from_embeddings(cls, rows, scores, embedding_ids, catalog):
+        """
+        Remap a table over embedding rows to catalog rows
+
+        Parameters
+        ----------
+        rows, scores : numpy.ndarray
+            The table over embedding rows, as returned by `nearest_neighbors`
+        embedding_ids : numpy.ndarray
+            The IMDb ID of every embedding row
+        catalog : Catalog
+            The catalog the table is remapped to
+
+        Returns
+        -------
+        NeighborTable
+            The table over catalog rows; series without embeddings have no neighbours
+        """
+        if len(rows) != len(embedding_ids):
+            raise ValueError("The neighbour table does not match the embeddings, rerun neighbors.py")
+        positions = catalog.positions(np.asarray(embedding_ids, dtype=str))
+        rows = np.asarray(rows)
+        remapped = np.where(rows >= 0, positions[np.maximum(rows, 0)], -1).astype(np.int32)
+        table_rows = np.full((len(catalog), rows.shape[1]), -1, dtype=np.int32)
+        table_scores = np.full((len(catalog), rows.shape[1]), np.inf, dtype=np.float16)
+        known = positions >= 0
+        table_rows[positions[known]] = remapped[known]
+        table_scores[positions[known]] = np.asarray(scores)[known]
+        table_scores[table_rows < 0] = np.inf
+        return cls(table_rows, table_scores)
+
+    def save(self, directory):
+        """
+        Save the table so it can be memory-mapped with `load`
+
+        Parameters
+        ----------
+        directory : str
+            Target directory
+
+        Returns
+        -------
+        None
+        """
+        save_neighbors(directory, self.rows, self.scores)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Memory-map a table saved with `save`
+
+        Parameters
+        ----------
+        directory : str
+            Source directory
+
+        Returns
+        -------
+        NeighborTable or None
+            The loaded table, None when the directory has none
+        """
+        table = load_neighbors(directory)
+        return cls(*table) if table is not None else None
+
+    def lookup(self, position, n=10):
+        """
+        Return the nearest series of a catalog row
+
+        Parameters
+        ----------
+        position : int
+            Catalog row
+        n : int
+            Maximum number of neighbours
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            The catalog rows of the neighbours and their scores, closest first
+        """
+        rows = np.asarray(self.rows[position, :n])
+        known = rows >= 0
+        return rows[known], np.asarray(self.scores[position, :n], dtype=np.float32)[known]
+
+
+def build_neighbors(embeddings_dir, k=10, memory_mb=512, workers=None):
+    """
+    Compute the neighbour table of the saved embeddings and save it next to them
+
+    Parameters
+    ----------
+    embeddings_dir : str
+        Directory written by the embedding build stage
+    k, memory_mb, workers
+        See `nearest_neighbors`
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        The ``(rows, scores)`` table over embedding rows
+    """
+    start = time.perf_counter()
+    # Memory-mapped: only the tiles count against `memory_mb`
+    _, vectors, _ = load_embeddings(embeddings_dir, mmap=True)
+    rows, scores = nearest_neighbors(vectors, k=k, memory_mb=memory_mb, workers=workers)
+    save_neighbors(embeddings_dir, rows, scores)
+    seconds = time.perf_counter() - start
+    print(f"Computed {k} neighbours of {len(vectors)} series in {seconds:.1f}s "
+          f"({len(vectors) / seconds:.0f} rows/s), table of {(rows.nbytes + scores.nbytes) / 2**20:.1f} MiB.")
+    return rows, scores
+
+
+if __name__ == '__main__':
+    from settings import load_config
+
+    config = load_config()
+    settings = config['neighbors']
+    build_neighbors(config['vector_index']['embeddings_dir'],
+                    k=settings['k'],
+                    memory_mb=settings['memory_mb'],
+                    workers=settings.get('workers'))
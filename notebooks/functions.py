@@ -1,43 +1,125 @@
+import glob
+import os
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 import numpy as np
+import yaml
 import matplotlib.pyplot as plt
 import seaborn as sns
 from wordcloud import WordCloud
-from matplotlib.colors import LinearSegmentedColormap
+from matplotlib.colors import LinearSegmentedColormap, LogNorm
+
+# Columns read from the genre files and their types; `Runtime`, `Certificate` and
+# `Gross Revenue` are never loaded. `Number of Votes` is read as text and coerced
+# afterwards, like `clean_data` does, so a malformed value drops the row instead of
+# failing the whole read.
+SCHEMA = {
+    'Title': 'object',
+    'IMDb ID': 'object',
+    'Release Year': 'object',
+    'Genre': 'object',
+    'Cast': 'object',
+    'Synopsis': 'object',
+    'Rating': 'float64',
+    'Number of Votes': 'object',
+}
+
+
+def best_per_id(df):
+    """
+    Keep one row per `IMDb ID`: the most voted of its complete rows
+
+    Rows with missing values only win when the ID has no complete row, so the rows
+    `clean_data` drops later never hide a good duplicate.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Rows read from the genre files, with numeric `Number of Votes`
 
-def load_data():
+    Returns
+    -------
+    pandas.DataFrame
+        One row per `IMDb ID`, in the order the IDs first appear
     """
-    Load data from all genre CSV files and concatenate them into a single DataFrame
+    incomplete = df.isna().any(axis=1).to_numpy()
+    order = np.lexsort((-df['Number of Votes'].fillna(-1).to_numpy(), incomplete))
+    best = df.iloc[order].drop_duplicates(subset='IMDb ID', keep='first')
+    return best.sort_index(kind='stable')
+
+
+def read_genre_file(path, chunksize=50000):
     """
-    # Load each genre CSV file
-    action = pd.read_csv('../data/action_series.csv')
-    adventure = pd.read_csv('../data/adventure_series.csv')
-    animation = pd.read_csv('../data/animation_series.csv')
-    biography = pd.read_csv('../data/biography_series.csv')
-    comedy = pd.read_csv('../data/comedy_series.csv')
-    crime = pd.read_csv('../data/crime_series.csv')
-    documentary = pd.read_csv('../data/documentary_series.csv')
-    drama = pd.read_csv('../data/drama_series.csv')
-    family = pd.read_csv('../data/family_series.csv')
-    fantasy = pd.read_csv('../data/fantasy_series.csv')
-    history = pd.read_csv('../data/history_series.csv')
-    horror = pd.read_csv('../data/horror_series.csv')
-    music = pd.read_csv('../data/music_series.csv')
-    musical = pd.read_csv('../data/musical_series.csv')
-    mystery = pd.read_csv('../data/mystery_series.csv')
-    romance = pd.read_csv('../data/romance_series.csv')
-    sci_fi = pd.read_csv('../data/sci-fi_series.csv')
-    sport = pd.read_csv('../data/sport_series.csv')
-    superhero = pd.read_csv('../data/superhero_series.csv')
-    thriller = pd.read_csv('../data/thriller_series.csv')
-    war = pd.read_csv('../data/war_series.csv')
-    western = pd.read_csv('../data/western_series.csv')
-
-    # Concatenate all DataFrames into one
-    df = pd.concat([action, adventure, animation, biography, 
-                    comedy, crime, documentary, drama, family, fantasy, history, horror, music, 
-                    musical, mystery, romance, sci_fi, sport, superhero, thriller, war, western], axis=0)
+    Read one genre CSV file chunk by chunk, deduplicating as it goes
+
+    Only one chunk plus the best row of every ID seen so far is held in memory.
+
+    Parameters
+    ----------
+    path : str
+        Path of the CSV file
+    chunksize : int
+        Number of rows parsed at a time
 
+    Returns
+    -------
+    pandas.DataFrame or None
+        One row per `IMDb ID` of the file, None when the file has no rows
+    """
+    best = None
+    for chunk in pd.read_csv(path, usecols=list(SCHEMA), dtype=SCHEMA, chunksize=chunksize):
+        chunk['Number of Votes'] = pd.to_numeric(chunk['Number of Votes'], errors='coerce')
+        best = chunk if best is None else pd.concat([best, chunk])
+        best = best_per_id(best)
+    return best
+
+
+def load_data(data_dir='../data', pattern='*_series.csv', workers=8, chunksize=50000):
+    """
+    Load data from all genre CSV files and concatenate them into a single DataFrame
+
+    The genre files are discovered with `pattern`, read in parallel with the types of
+    `SCHEMA` and deduplicated by `IMDb ID` while they are read, keeping the most voted
+    row of every series. The time spent in every stage is printed.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory holding the genre CSV files
+    pattern : str
+        Glob pattern of the genre files inside `data_dir`
+    workers : int
+        Number of files read at the same time
+    chunksize : int
+        Number of rows parsed at a time from each file
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per `IMDb ID`, without the `Runtime`, `Certificate` and `Gross Revenue` columns
+    """
+    start = time.perf_counter()
+    paths = sorted(glob.glob(os.path.join(data_dir, pattern)))
+    if not paths:
+        raise FileNotFoundError(f"No files matching {pattern} in {data_dir}")
+    discovered = time.perf_counter()
+
+    # The C parser releases the GIL, so threads read the files concurrently
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        frames = list(pool.map(lambda path: read_genre_file(path, chunksize), paths))
+    read = time.perf_counter()
+
+    # The same series is listed in several genre files; keep its best row across files
+    frames = [frame for frame in frames if frame is not None]
+    df = best_per_id(pd.concat(frames, ignore_index=True)).reset_index(drop=True)
+    deduped = time.perf_counter()
+
+    print(f"Loaded {len(df)} series from {len(paths)} files in {deduped - start:.2f}s "
+          f"(discover {discovered - start:.2f}s, read {read - discovered:.2f}s, "
+          f"dedupe {deduped - read:.2f}s).")
     return df
 
 
@@ -55,8 +137,8 @@ def drop_columns(df):
     pandas.DataFrame
         The DataFrame with the columns dropped
     """
-    # Drop columns that are not useful for the analysis
-    df = df.drop(columns=['Runtime', 'Certificate', 'Gross Revenue'])
+    # Drop columns that are not useful for the analysis, `load_data` already skips them
+    df = df.drop(columns=['Runtime', 'Certificate', 'Gross Revenue'], errors='ignore')
     return df
 
 def clean_data(df):
@@ -110,13 +192,302 @@ def unique_films(df):
     return df
 
 
+def _shingles(text):
+    """
+    Hash the words and word pairs of every text into 64-bit shingles
+
+    Parameters
+    ----------
+    text : pandas.Series
+        Normalized texts, words separated by single spaces
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        The row position and the hash of every shingle, grouped by row
+    """
+    words = text.reset_index(drop=True).str.split().explode().dropna()
+    rows = words.index.to_numpy(dtype=np.int64)
+    codes, uniques = pd.factorize(words)
+    codes = codes.astype(np.int64)
+    # A word pair is encoded after all the single words, so the two never collide
+    pairs = rows[1:] == rows[:-1]
+    shingles = np.concatenate([codes, len(uniques) * (1 + codes[:-1][pairs]) + codes[1:][pairs]])
+    shingle_rows = np.concatenate([rows, rows[:-1][pairs]])
+    order = np.argsort(shingle_rows, kind='stable')
+    return shingle_rows[order], shingles[order].astype(np.uint64)
+
+
+def minhash_signatures(text, num_perm=64, seed=0):
+    """
+    Compute the MinHash signature of every text over its words and word pairs
+
+    Two signatures agree on a fraction of their values that estimates the Jaccard
+    similarity of the shingle sets of the two texts.
+
+    Parameters
+    ----------
+    text : pandas.Series
+        Normalized texts, words separated by single spaces
+    num_perm : int
+        Number of hash functions, the length of a signature
+    seed : int
+        Seed of the hash functions
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        A ``(len(text), num_perm)`` ``uint32`` signature matrix, and whether each text
+        had any word; the signature of an empty text is meaningless
+    """
+    rows, shingles = _shingles(text)
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]]) if len(rows) else np.empty(0, dtype=np.int64)
+    rng = np.random.default_rng(seed)
+    # Every shingle is hashed once to 32 bits (multiply-shift), then permuted by an
+    # affine map modulo 2**32 per hash function, all in place on uint32 arrays
+    with np.errstate(over='ignore'):
+        hashes = ((shingles * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(32)).astype(np.uint32)
+    multipliers = rng.integers(0, 2**32, size=num_perm, dtype=np.uint32) | np.uint32(1)
+    offsets = rng.integers(0, 2**32, size=num_perm, dtype=np.uint32)
+    signatures = np.full((len(text), num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+    has_words = np.zeros(len(text), dtype=bool)
+    has_words[rows[starts]] = True
+    permuted = np.empty_like(hashes)
+    with np.errstate(over='ignore'):
+        for i in range(num_perm):
+            np.multiply(hashes, multipliers[i], out=permuted)
+            permuted += offsets[i]
+            signatures[rows[starts], i] = np.minimum.reduceat(permuted, starts)
+    return signatures, has_words
+
+
+def _candidate_pairs(signatures, candidates, bands, max_bucket=50):
+    """
+    Pair rows whose signatures are identical on at least one band (LSH)
+
+    Every pair of rows within a bucket is a candidate. Buckets of more than
+    `max_bucket` rows are skipped: they gather boilerplate texts, and their
+    n * (n - 1) / 2 pairs would dominate the run time.
+    """
+    rows_per_band = signatures.shape[1] // bands
+    rng = np.random.default_rng(len(signatures))
+    multipliers = rng.integers(1, 2**63, size=rows_per_band, dtype=np.uint64) | np.uint64(1)
+    firsts, seconds = [], []
+    with np.errstate(over='ignore'):
+        for band in range(bands):
+            columns = signatures[candidates, band * rows_per_band:(band + 1) * rows_per_band].astype(np.uint64)
+            keys = (columns * multipliers).sum(axis=1)
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            bucket = np.cumsum(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]) - 1
+            sizes = np.bincount(bucket)
+            # Each row is paired with the rows `gap` places after it in the same bucket
+            small = sizes[bucket] <= max_bucket
+            largest = sizes[sizes <= max_bucket].max(initial=1)
+            for gap in range(1, largest):
+                pair = (bucket[:-gap] == bucket[gap:]) & small[:-gap]
+                firsts.append(candidates[order[:-gap][pair]])
+                seconds.append(candidates[order[gap:][pair]])
+    if not firsts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    first, second = np.concatenate(firsts), np.concatenate(seconds)
+    pairs = np.unique(np.stack([np.minimum(first, second), np.maximum(first, second)]), axis=1)
+    return pairs[0], pairs[1]
+
+
+def near_duplicates(df, num_perm=64, bands=16, threshold=0.8, cast_overlap=0.5, title_similarity=0.9,
+                    strong_threshold=0.95, strong_cast_overlap=0.75, max_bucket=50, changed=None, seed=0):
+    """
+    Find the rows that are near duplicates of a more voted row
+
+    The same show is sometimes listed under several IMDb IDs with slightly different
+    titles or synopses. Every row gets a MinHash signature over the words of its
+    normalized `Title` and `Synopsis`, and locality-sensitive hashing over bands of
+    the signatures finds the candidate pairs without comparing every pair of rows.
+    A pair is a duplicate when the estimated Jaccard similarity of the two texts
+    reaches `threshold`, both rows have the same release year, at least
+    `title_similarity` of the words of the two titles are shared and, when both
+    rows have a cast, at least `cast_overlap` of the smaller cast is shared.
+    Sequels, alternate cuts, remakes and versions in another language share a
+    synopsis, but not both a year and a title.
+
+    A pair with nearly the same text (`strong_threshold`) and cast
+    (`strong_cast_overlap`) only needs the same year or a similar title: this catches
+    a show listed again under another title, or a series and the film cut from it.
+    A video game and a show are never duplicates.
+
+    Duplicates are not grouped transitively: going from the most voted row down, a
+    row is dropped only when it pairs directly with a kept row, and collapses to the
+    most voted one.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The catalog, with the `Title`, `Synopsis`, `Release Year`, `Cast` and
+        `Number of Votes` columns
+    num_perm : int
+        Length of the MinHash signatures
+    bands : int
+        Number of LSH bands; pairs with a Jaccard similarity around
+        ``(1 / bands) ** (bands / num_perm)`` or more become candidates
+    threshold : float
+        Minimum estimated Jaccard similarity of the texts of a duplicate pair
+    cast_overlap : float
+        Minimum fraction of the smaller cast shared by a duplicate pair
+    title_similarity : float
+        Minimum Jaccard similarity of the title words of a duplicate pair
+    strong_threshold, strong_cast_overlap : float
+        Text similarity and cast overlap above which the same year or a similar
+        title is enough
+    max_bucket : int
+        Largest LSH bucket whose pairs are candidates
+    changed : iterable of str, optional
+        `IMDb ID` of the changed rows; when given, only the pairs with at least one
+        of them are duplicates
+    seed : int
+        Seed of the hash functions
+
+    Returns
+    -------
+    pandas.Series
+        For every row, the `IMDb ID` of the row it collapses to, its own for the rows kept
+    """
+    # Most voted rows first, so the smaller position of a pair is its most voted row
+    order = np.argsort(-pd.to_numeric(df['Number of Votes'], errors='coerce').fillna(-1).to_numpy(),
+                       kind='stable')
+    titles = normalize_names(df['Title'].fillna('').iloc[order]).str.replace(r'[^a-z0-9 ]+', ' ', regex=True)
+    text = normalize_names(df['Synopsis'].fillna('').iloc[order]).str.replace(r'[^a-z0-9 ]+', ' ', regex=True)
+    signatures, has_words = minhash_signatures(titles + ' ' + text, num_perm, seed)
+    first, second = _candidate_pairs(signatures, np.flatnonzero(has_words), bands, max_bucket)
+    ids = df['IMDb ID'].to_numpy()[order]
+    if changed is not None:
+        is_changed = np.isin(ids, list(changed))
+        involved = is_changed[first] | is_changed[second]
+        first, second = first[involved], second[involved]
+
+    # Check the candidates: text similarity first, then the year, title and cast of the few remaining pairs
+    similarity = (signatures[first] == signatures[second]).mean(axis=1)
+    similar = similarity >= threshold
+    first, second, similarity = first[similar], second[similar], similarity[similar]
+    rows = np.unique(np.concatenate([first, second]))
+    released = df['Release Year'].iloc[order[rows]].astype('string')
+    years = dict(zip(rows, released.str.extract(r'(\d{4})', expand=False).to_numpy()))
+    games = dict(zip(rows, released.str.contains('Video Game', regex=False).fillna(False).to_numpy()))
+    words = {row: set(title.split()) for row, title in zip(rows, titles.to_numpy()[rows])}
+    names = df['Cast Names'].iloc[order[rows]] if 'Cast Names' in df else parse_cast(df['Cast'].iloc[order[rows]])
+    casts = {row: set(cast.split('|')) if cast else set() for row, cast in zip(rows, names.fillna(''))}
+
+    def is_duplicate(a, b, text_similarity):
+        if games[a] != games[b]:
+            return False
+        same_year = pd.notna(years[a]) and years[a] == years[b]
+        same_title = len(words[a] & words[b]) >= title_similarity * len(words[a] | words[b])
+        if not casts[a] or not casts[b]:
+            return same_year and same_title
+        shared = len(casts[a] & casts[b]) / min(len(casts[a]), len(casts[b]))
+        if text_similarity >= strong_threshold and shared >= strong_cast_overlap:
+            return same_year or same_title
+        return same_year and same_title and shared >= cast_overlap
+
+    duplicate = np.array([is_duplicate(a, b, value) for a, b, value in zip(first, second, similarity)], dtype=bool)
+    first, second = first[duplicate], second[duplicate]
+
+    # Direct pairs only, by the less voted row: the status of the more voted one is final by then
+    labels = np.arange(len(df))
+    for position in np.lexsort((first, second)):
+        a, b = first[position], second[position]
+        if labels[a] == a and labels[b] == b:
+            labels[b] = a
+
+    canonical = np.empty(len(df), dtype=object)
+    canonical[order] = ids[labels]
+    return pd.Series(canonical, index=df.index, name='Canonical ID')
+
+
+def drop_near_duplicates(df, **kwargs):
+    """
+    Drop the rows that are near duplicates of a more voted row
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The catalog
+    **kwargs
+        Settings of `near_duplicates`
+
+    Returns
+    -------
+    pandas.DataFrame
+        The rows of `df` that are not a near duplicate of a more voted row, in the same order
+    """
+    start = time.perf_counter()
+    canonical = near_duplicates(df, **kwargs)
+    kept = (canonical == df['IMDb ID']).to_numpy()
+    print(f"Dropped {len(df) - kept.sum()} near duplicates of {len(df)} series "
+          f"in {time.perf_counter() - start:.2f}s.")
+    return df[kept]
+
+
+def normalize_names(names):
+    """
+    Normalize person names for search
+
+    Accents are removed, the text is lowercased and runs of whitespace are collapsed,
+    so "Penélope  Cruz" and "penelope cruz" become the same token.
+
+    Parameters
+    ----------
+    names : pandas.Series
+        The names to normalize
+
+    Returns
+    -------
+    pandas.Series
+        The normalized names
+    """
+    return (names.str.normalize('NFKD')
+            .str.encode('ascii', errors='ignore').str.decode('ascii')
+            .str.lower()
+            .str.replace(r'\s+', ' ', regex=True)
+            .str.strip())
+
+
+def parse_cast(cast):
+    """
+    Parse the raw `Cast` strings into lists of normalized person names
+
+    The raw strings look like ``"Director:, Ridley Scott, | ,     Stars:, Harrison Ford, , Rutger Hauer"``.
+    The role labels and separators are removed and every person becomes one token.
+
+    Parameters
+    ----------
+    cast : pandas.Series
+        The `Cast` column
+
+    Returns
+    -------
+    pandas.Series
+        The normalized names of every row joined with '|'
+    """
+    # Remove the role labels and turn the section separator into a regular comma, then
+    # normalize the whole string and rewrite the separators, with no per-name step
+    names = (cast.fillna('').astype(str)
+             .str.replace(r'(?:Directors?|Stars?):', '', regex=True)
+             .str.replace('|', ',', regex=False))
+    return (normalize_names(names)
+            .str.replace(r'\s*,[\s,]*', '|', regex=True)
+            .str.strip('|'))
+
+
 def new_columns(df):
     """
     Add new columns to the DataFrame
 
-    This function adds two new columns to the DataFrame:
+    This function adds three new columns to the DataFrame:
     - `embedding`: a column that concatenates the `Title` and `Synopsis` columns
     - `Main Genre`: a column that extracts the first genre from the `Genre` column
+    - `Cast Names`: the normalized person names of the `Cast` column joined with '|',
+      used to build the cast search index
 
     Parameters
     ----------
@@ -134,59 +505,99 @@ def new_columns(df):
     # Add a new column that extracts the first genre from the Genre column
     df['Main Genre'] = df['Genre'].str.split(',').str[0]
 
+    # Add a new column with the normalized person names of the Cast column
+    df['Cast Names'] = parse_cast(df['Cast'])
+
     return df
 
-def classify_mood(genre):
+def load_mood_rules(path='../config.yaml'):
+    """
+    Load the genre to mood rules from the `moods` section of ``config.yaml``
+
+    Parameters
+    ----------
+    path : str
+        Path of ``config.yaml``
+
+    Returns
+    -------
+    dict
+        The `default` mood and the `rules`, each with a `mood` and its `genres`
     """
-    Classify a genre into a mood category
+    with open(path, encoding='utf-8') as f:
+        return yaml.safe_load(f)['moods']
 
-    This function takes a genre as input and returns a mood category based on the genre.
-    The categories are:
-    - '😂 Fun 😂': comedy, animation, family, fantasy, musical, music, reality-tv
-    - '🥰 Romantic 🥰': romance
-    - '😢 Sad 😢': drama, documentary, biography
-    - '🤠 Adventurous 🤠': adventure, sci-fi, action, war, western
-    - '🫣 Tense 🫣': thriller, crime, mystery, horror
-    - '🤪 Mixed 🤪': any other genre
+
+def encode_genres(genres):
+    """
+    Parse the comma-separated `Genre` strings into a boolean genre matrix
 
     Parameters
     ----------
-    genre : str
-        The genre to classify
+    genres : pandas.Series
+        The `Genre` column
 
     Returns
     -------
-    str
-        The mood category
-    """
-    genre = genre.lower()  # Convert to lowercase for comparison
-    if any(g in genre for g in ['comedy', 'animation', 'family', 'fantasy', 'musical', 'music', 'reality-tv']):
-        # Genres that are generally considered fun
-        return '😂 Fun 😂'
-    elif any(g in genre for g in ['romance']):
-        # Genres that are generally considered romantic
-        return '🥰 Romantic 🥰'
-    elif any(g in genre for g in ['drama', 'documentary', 'biography']):
-        # Genres that are generally considered sad
-        return '😢 Sad 😢'
-    elif any(g in genre for g in ['adventure', 'sci-fi', 'action', 'war', 'western']):
-        # Genres that are generally considered adventurous
-        return '🤠 Adventurous 🤠'
-    elif any(g in genre for g in ['thriller', 'crime', 'mystery', 'horror']):
-        # Genres that are generally considered tense
-        return '🫣 Tense 🫣'
-    else:
-        # Any other genre is considered mixed
-        return '🤪 Mixed 🤪'
+    pandas.DataFrame
+        One boolean column per genre, in order of first appearance, aligned with `genres`
+    """
+    tokens = genres.fillna('').reset_index(drop=True).str.split(',').explode().str.strip()
+    tokens = tokens[tokens != '']
+    codes, labels = pd.factorize(tokens)
+    matrix = np.zeros((len(genres), len(labels)), dtype=bool)
+    matrix[tokens.index.to_numpy(), codes] = True
+    return pd.DataFrame(matrix, index=genres.index, columns=list(labels))
+
+
+def classify_moods(main_genres, moods=None):
+    """
+    Classify every main genre into a mood category
+
+    The rules of the `moods` section of ``config.yaml`` are checked in order and the
+    first one listing the genre gives its mood; genres no rule lists get the default
+    mood. The rules are resolved once per distinct genre into a lookup table, and
+    every row is then classified with a single table lookup.
+
+    Parameters
+    ----------
+    main_genres : pandas.Series
+        The `Main Genre` column
+    moods : dict, optional
+        The mood rules, as returned by `load_mood_rules`; read from ``config.yaml`` by default
 
-def to_csv(df):
+    Returns
+    -------
+    pandas.Series
+        The mood category of every row
     """
-    Save the cleaned DataFrame to a CSV file
+    moods = moods or load_mood_rules()
+    # Earlier rules win, so fill the lookup from the last rule to the first
+    lookup = {}
+    for rule in reversed(moods['rules']):
+        lookup.update({genre.lower(): rule['mood'] for genre in rule['genres']})
+    codes, uniques = pd.factorize(main_genres.str.lower())
+    # Code -1 (missing genre) picks the default mood at the end of the table
+    table = np.array([lookup.get(genre, moods['default']) for genre in uniques] + [moods['default']],
+                     dtype=object)
+    return pd.Series(table[codes], index=main_genres.index, name='Mood')
+
+def to_csv(df, path='../data/clean_data/series.csv', genre_matrix_path='../data/clean_data/genre_matrix.npz'):
+    """
+    Save the cleaned DataFrame to a CSV file, and its genre matrix next to it
+
+    The genre matrix (see `encode_genres`) is saved to ``genre_matrix.npz`` with the
+    `IMDb ID` of every row, so the app can build its genre index without parsing the
+    `Genre` column again.
 
     Parameters
     ----------
     df : pandas.DataFrame
         The DataFrame to save
+    path : str
+        Path of the CSV file
+    genre_matrix_path : str
+        Path of the genre matrix
 
     Returns
     -------
@@ -194,21 +605,163 @@ def to_csv(df):
         The same DataFrame
     """
     # Save the DataFrame to a CSV file
-    df.to_csv('../data/clean_data/series.csv', index=False)
+    df.to_csv(path, index=False)
+
+    # Save the genre matrix in the same row order
+    matrix = encode_genres(df['Genre'])
+    np.savez_compressed(genre_matrix_path,
+                        ids=df['IMDb ID'].to_numpy(dtype=str),
+                        labels=np.asarray(matrix.columns, dtype=str),
+                        matrix=matrix.to_numpy())
     return df
 
+class CatalogSummary:
+    """
+    Aggregates of the catalog behind the EDA plots, computed in one pass
+
+    Every plot function renders from these aggregates, so their cost does not grow
+    with the catalog after `summarize_catalog` ran once.
+
+    Attributes
+    ----------
+    rows : int
+        Number of series summarized
+    genre_counts : pandas.Series
+        Number of series of every main genre, most frequent first
+    rating_edges, rating_counts : numpy.ndarray
+        Histogram of the ratings
+    rating_curve : tuple of numpy.ndarray
+        Smoothed rating density, scaled to the counts of `rating_counts`
+    genre_mean_rating : pandas.Series
+        Average rating of every main genre, lowest first
+    top_votes : pandas.DataFrame
+        `Title` and `Number of Votes` of the most voted series, most voted first
+    density_rating_edges, density_vote_edges, density : numpy.ndarray
+        2D histogram of the ratings against the log10 of the number of votes
+    sample : pandas.DataFrame
+        Random rows with the `Rating`, `Number of Votes` and `Main Genre` columns
+    """
+
+    def __init__(self, rows, genre_counts, rating_edges, rating_counts, rating_curve, genre_mean_rating,
+                 top_votes, density_rating_edges, density_vote_edges, density, sample):
+        self.rows = rows
+        self.genre_counts = genre_counts
+        self.rating_edges = rating_edges
+        self.rating_counts = rating_counts
+        self.rating_curve = rating_curve
+        self.genre_mean_rating = genre_mean_rating
+        self.top_votes = top_votes
+        self.density_rating_edges = density_rating_edges
+        self.density_vote_edges = density_vote_edges
+        self.density = density
+        self.sample = sample
+
+
+# The last summary computed, as (weak reference to the DataFrame, settings, summary);
+# only one is kept, so an older catalog never stays in memory through its summary
+_LAST_SUMMARY = None
+
+
+def summarize_catalog(df, rating_bins=20, density_bins=60, top_n=10, sample_size=5000, seed=0):
+    """
+    Compute the aggregates of every EDA plot in one vectorized pass over the catalog
+
+    The summary of the last DataFrame summarized is cached, so the plot functions can
+    be given the DataFrame itself and only the first one pays for the pass. A DataFrame
+    changed in place after it was summarized must be summarized again with a new copy.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The clean catalog, with the 'Title', 'Main Genre', 'Rating' and 'Number of
+        Votes' columns; it is not modified
+    rating_bins : int
+        Bins of the rating histogram
+    density_bins : int
+        Bins per axis of the ratings vs votes density
+    top_n : int
+        Number of most voted series kept
+    sample_size : int
+        Rows kept for the sampled ratings vs votes scatter plot
+    seed : int
+        Seed of the sample
+
+    Returns
+    -------
+    CatalogSummary
+        The aggregates
+    """
+    key = (len(df), rating_bins, density_bins, top_n, sample_size, seed)
+    global _LAST_SUMMARY
+    if _LAST_SUMMARY is not None and _LAST_SUMMARY[0]() is df and _LAST_SUMMARY[1] == key:
+        return _LAST_SUMMARY[2]
+
+    genres, genre_names = pd.factorize(df['Main Genre'])
+    ratings = pd.to_numeric(df['Rating'], errors='coerce').to_numpy(dtype=np.float64)
+    votes = pd.to_numeric(df['Number of Votes'], errors='coerce').to_numpy(dtype=np.float64)
+    rated = ~np.isnan(ratings)
+
+    # Genre counts and mean ratings from two bincounts over the genre codes
+    known = genres >= 0
+    counts = np.bincount(genres[known], minlength=len(genre_names))
+    rated_genres = genres[known & rated]
+    rating_sums = np.bincount(rated_genres, weights=ratings[known & rated], minlength=len(genre_names))
+    rated_counts = np.bincount(rated_genres, minlength=len(genre_names))
+    genre_counts = pd.Series(counts, index=genre_names, name='count').sort_values(ascending=False, kind='stable')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = pd.Series(rating_sums / rated_counts, index=genre_names, name='Rating')
+    genre_mean_rating = means.dropna().sort_values(kind='stable')
+
+    # Rating histogram, and a finer one smoothed with a gaussian kernel for the density curve
+    valid_ratings = ratings[rated]
+    low, high = (valid_ratings.min(), valid_ratings.max()) if len(valid_ratings) else (0.0, 10.0)
+    rating_counts, rating_edges = np.histogram(valid_ratings, bins=rating_bins, range=(low, high))
+    fine_counts, fine_edges = np.histogram(valid_ratings, bins=rating_bins * 10, range=(low, high))
+    kernel = np.exp(-0.5 * (np.arange(-30, 31) / 10) ** 2)
+    # Ten fine bins per histogram bin, so the curve is on the scale of the histogram
+    smoothed = np.convolve(fine_counts, kernel / kernel.sum(), mode='same') * 10
+    rating_curve = ((fine_edges[:-1] + fine_edges[1:]) / 2, smoothed)
+
+    # Most voted series without sorting the catalog
+    voted = np.flatnonzero(~np.isnan(votes))
+    top = voted[np.argpartition(-votes[voted], min(top_n, len(voted)) - 1)[:top_n]] if len(voted) else voted
+    top = top[np.argsort(-votes[top], kind='stable')]
+    top_votes = pd.DataFrame({'Title': df['Title'].to_numpy()[top], 'Number of Votes': votes[top]})
+
+    # Ratings vs votes: a 2D histogram of every row, and a random sample for the scatter plot
+    both = rated & (votes > 0)
+    log_votes = np.log10(votes[both])
+    density, density_rating_edges, density_vote_edges = np.histogram2d(
+        ratings[both], log_votes, bins=density_bins)
+    rng = np.random.default_rng(seed)
+    picked = np.sort(rng.choice(np.flatnonzero(both), size=min(sample_size, both.sum()), replace=False))
+    sample = pd.DataFrame({'Rating': ratings[picked], 'Number of Votes': votes[picked],
+                           'Main Genre': df['Main Genre'].to_numpy()[picked]})
+
+    summary = CatalogSummary(len(df), genre_counts, rating_edges, rating_counts, rating_curve, genre_mean_rating,
+                             top_votes, density_rating_edges, density_vote_edges, density, sample)
+    _LAST_SUMMARY = (weakref.ref(df), key, summary)
+    return summary
+
+
+def _summary(data):
+    """Return `data` if it is a `CatalogSummary`, else the cached summary of the DataFrame."""
+    return data if isinstance(data, CatalogSummary) else summarize_catalog(data)
+
+
 def generate_word_cloud(df):
     """
     Generate a word cloud of the main genres in the DataFrame.
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The DataFrame containing the 'Main Genre' column
+    df : pandas.DataFrame or CatalogSummary
+        The DataFrame containing the 'Main Genre' column, or its summary
 
     Returns
     -------
-    None
+    matplotlib.axes.Axes
+        The axes of the plot
     """
     # Define the colors for the word cloud
     colors = ["#a564d3", "#d689ff", "#431259", "#9b72cf", "#5a108f"]
@@ -217,7 +770,7 @@ def generate_word_cloud(df):
     custom_cmap = LinearSegmentedColormap.from_list("violet", colors)
 
     # Get the frequency of each main genre
-    genre_frequencies = df['Main Genre'].value_counts()
+    genre_frequencies = _summary(df).genre_counts
 
     # Generate the word cloud
     wordcloud = WordCloud(width=800, height=400, background_color="white", colormap=custom_cmap).generate_from_frequencies(genre_frequencies)
@@ -227,7 +780,9 @@ def generate_word_cloud(df):
     plt.imshow(wordcloud, interpolation="bilinear")
     plt.axis("off")
     plt.title("Word Cloud of Main Genres")
+    ax = plt.gca()
     plt.show()
+    return ax
 
 def plot_main_genre_distribution(df):
     """
@@ -238,12 +793,13 @@ def plot_main_genre_distribution(df):
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The DataFrame containing the 'Main Genre' column
+    df : pandas.DataFrame or CatalogSummary
+        The DataFrame containing the 'Main Genre' column, or its summary
 
     Returns
     -------
-    None
+    matplotlib.axes.Axes
+        The axes of the plot
     """
     # Set the seaborn style to whitegrid
     sns.set(style="whitegrid")
@@ -252,14 +808,15 @@ def plot_main_genre_distribution(df):
     plt.figure(figsize=(10, 6))
 
     # Get the counts of each main genre
-    main_genre_counts = df['Main Genre'].value_counts()
+    main_genre_counts = _summary(df).genre_counts
 
     # Plot the bar chart
-    sns.barplot(x=main_genre_counts.values, y=main_genre_counts.index, palette="viridis")
+    ax = sns.barplot(x=main_genre_counts.values, y=main_genre_counts.index, palette="viridis")
     plt.title('Distribution of Main Genre')
     plt.xlabel('Number of Shows')
     plt.ylabel('Main Genre')
     plt.show()
+    return ax
 
 
 def plot_ratings_distribution(df):
@@ -267,25 +824,31 @@ def plot_ratings_distribution(df):
     Plot the distribution of ratings in the DataFrame.
 
     This function takes a DataFrame as input and plots a histogram of the ratings
-    with a kernel density estimate (KDE) of the distribution.
+    with a smoothed density curve of the distribution.
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The DataFrame containing the 'Rating' column
+    df : pandas.DataFrame or CatalogSummary
+        The DataFrame containing the 'Rating' column, or its summary
 
     Returns
     -------
-    None
+    matplotlib.axes.Axes
+        The axes of the plot
     """
+    summary = _summary(df)
+
     # Set the seaborn style to whitegrid
     sns.set(style="whitegrid")
 
     # Create a new figure with a specified size
     plt.figure(figsize=(10, 6))
 
-    # Plot the histogram and KDE of the ratings
-    sns.histplot(df['Rating'], bins=20, kde=True, color='blue')
+    # Plot the precomputed histogram and density curve of the ratings
+    edges = summary.rating_edges
+    plt.bar(edges[:-1], summary.rating_counts, width=np.diff(edges), align='edge', color='blue', alpha=0.4,
+            edgecolor='white')
+    plt.plot(*summary.rating_curve, color='blue')
 
     # Set the title and labels
     plt.title('Distribution of Ratings')
@@ -293,46 +856,68 @@ def plot_ratings_distribution(df):
     plt.ylabel('Count')
 
     # Show the plot
+    ax = plt.gca()
     plt.show()
+    return ax
 
 
 
-def plot_ratings_vs_votes(df):
+def plot_ratings_vs_votes(df, mode='density'):
     """
     Plot the relationship between ratings and the number of votes for each show.
 
-    This function takes a DataFrame as input and plots a scatter plot of the ratings
-    against the number of votes. The size of the points is determined by the number of
-    votes, and the color is determined by the main genre.
+    In ``'density'`` mode every show is counted in a 2D histogram of the ratings
+    against the number of votes (log scale), drawn as a heatmap. In ``'sample'``
+    mode a random sample of the shows is drawn as a scatter plot, the size of the
+    points given by the number of votes and the color by the main genre.
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The DataFrame containing the 'Rating', 'Number of Votes', and 'Main Genre' columns
+    df : pandas.DataFrame or CatalogSummary
+        The DataFrame containing the 'Rating', 'Number of Votes', and 'Main Genre' columns,
+        or its summary
+    mode : str
+        ``'density'`` or ``'sample'``
 
     Returns
     -------
-    None
+    matplotlib.axes.Axes
+        The axes of the plot
     """
+    if mode not in ('density', 'sample'):
+        raise ValueError(f"Unknown mode {mode!r}, expected 'density' or 'sample'")
+    summary = _summary(df)
+
     # Set the seaborn style to whitegrid
     sns.set(style="whitegrid")
 
     # Create a new figure with a specified size
     plt.figure(figsize=(10, 6))
 
-    # Plot the scatter plot
-    sns.scatterplot(data=df, x='Rating', y='Number of Votes', 
-                    hue='Main Genre', size='Number of Votes', 
-                    sizes=(20, 200), palette='viridis', alpha=0.7, edgecolor='w')
+    if mode == 'density':
+        # Shows per cell, log color scale so the sparse cells stay visible
+        density = np.ma.masked_equal(summary.density.T, 0)
+        mesh = plt.pcolormesh(summary.density_rating_edges, 10 ** summary.density_vote_edges, density,
+                              cmap='viridis', norm=LogNorm())
+        plt.yscale('log')
+        plt.colorbar(mesh, label='Number of Shows')
+    else:
+        # Plot the scatter plot of the sample
+        sns.scatterplot(data=summary.sample, x='Rating', y='Number of Votes',
+                        hue='Main Genre', size='Number of Votes',
+                        sizes=(20, 200), palette='viridis', alpha=0.7, edgecolor='w')
+        # Put the legend on the right side
+        plt.legend(loc='upper left', bbox_to_anchor=(1, 1))
     # Set the title and labels
-    plt.title('Ratings vs Number of Votes')
+    plt.title('Ratings vs Number of Votes' if mode == 'density' else
+              f'Ratings vs Number of Votes ({len(summary.sample)} of {summary.rows} shows)')
     plt.xlabel('Rating')
     plt.ylabel('Number of Votes')
-    # Put the legend on the right side
-    plt.legend(loc='upper left', bbox_to_anchor=(1, 1))
 
     # Show the plot
+    ax = plt.gca()
     plt.show()
+    return ax
 
 
 def plot_average_ratings_by_genre(df):
@@ -341,24 +926,24 @@ def plot_average_ratings_by_genre(df):
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The DataFrame containing the 'Rating' and 'Main Genre' columns
+    df : pandas.DataFrame or CatalogSummary
+        The DataFrame containing the 'Rating' and 'Main Genre' columns, or its summary
 
     Returns
     -------
-    None
+    matplotlib.axes.Axes
+        The axes of the plot
     """
     plt.style.use('ggplot')
 
-    # Group the DataFrame by 'Main Genre', calculate the average rating for each group,
-    # and sort the results by average rating
-    average_ratings = df.groupby('Main Genre')['Rating'].mean().sort_values()
+    # Average rating of each main genre, sorted by average rating
+    average_ratings = _summary(df).genre_mean_rating
 
     # Create a new figure with a specified size
     plt.figure(figsize=(12, 6))
 
     # Plot the horizontal bar chart
-    average_ratings.plot(kind='barh', color='skyblue')
+    ax = average_ratings.plot(kind='barh', color='skyblue')
 
     # Set the title and labels
     plt.title('Average Ratings by Main Genre')
@@ -370,35 +955,34 @@ def plot_average_ratings_by_genre(df):
 
     # Show the plot
     plt.show()
+    return ax
 
 
 def plot_top_10_votes(df):
     """
     Plot the top 10 movies or series with the most votes.
 
-    This function ensures that the 'Number of Votes' column is in numeric format, sorts the DataFrame by 
-    'Number of Votes' in descending order, selects the top 10 entries, and creates a bar plot to visualize 
-    the data.
+    The most voted entries come from the summary of the DataFrame, which reads the
+    'Number of Votes' column as numbers without modifying the DataFrame, and are
+    drawn as a bar plot.
 
     Parameters
     ----------
-    df : pandas.DataFrame
-        The DataFrame containing the 'Number of Votes' and 'Title' columns
+    df : pandas.DataFrame or CatalogSummary
+        The DataFrame containing the 'Number of Votes' and 'Title' columns, or its summary
 
     Returns
     -------
-    None
+    matplotlib.axes.Axes
+        The axes of the plot
     """
-    # Ensure that the 'Number of Votes' column is in numeric format
-    df['Number of Votes'] = pd.to_numeric(df['Number of Votes'], errors='coerce')
-
-    # Sort the DataFrame by 'Number of Votes' in descending order and select the top 10 entries
-    top_10_votes = df.nlargest(10, 'Number of Votes')
+    top_10_votes = _summary(df).top_votes.head(10)
 
     # Create the bar plot
     plt.figure(figsize=(12, 6))
-    sns.barplot(x='Number of Votes', y='Title', data=top_10_votes, palette='viridis')
+    ax = sns.barplot(x='Number of Votes', y='Title', data=top_10_votes, palette='viridis')
     plt.title('Top 10 Movies/Series with Most Votes')
     plt.xlabel('Number of Votes')
     plt.ylabel('Title')
     plt.show()
+    return ax
@@ -0,0 +1,222 @@
+"""
+Bounded LRU cache of query embeddings in front of the encoder.
+
+Popular queries repeat a lot, so the Title/Synopsis searches look the normalized query
+up here before calling `model.encode`. Hot entries can be spilled to disk so they
+survive a restart; the spill records the encoder it came from and is ignored by a
+cache in front of another one.
+"""
+import atexit
+import os
+import re
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_text(text):
+    """
+    Normalize a query so trivially different spellings share a cache entry
+
+    Parameters
+    ----------
+    text : str
+        The query
+
+    Returns
+    -------
+    str
+        The query in Unicode NFKC form, casefolded and with single spaces
+    """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class QueryEmbeddingCache:
+    """
+    LRU cache of query embeddings with hit/miss counters
+
+    Parameters
+    ----------
+    model : sentence_transformers.SentenceTransformer
+        The encoder called on a cache miss
+    maxsize : int
+        Maximum number of cached queries
+    spill_path : str, optional
+        ``.npz`` file the entries are saved to and reloaded from at startup
+    spill_every : int
+        Save to `spill_path` every this many misses, as well as at exit
+    encoder_key : str
+        Model, backend and quantization of `model`; a spill saved under another key
+        is not loaded
+    """
+
+    def __init__(self, model, maxsize=4096, spill_path=None, spill_every=100, encoder_key=''):
+        self.model = model
+        self.maxsize = maxsize
+        self.spill_path = spill_path
+        self.spill_every = spill_every
+        self.encoder_key = encoder_key
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        # Streamlit serves sessions from several threads
+        self._lock = threading.Lock()
+        if spill_path:
+            self.load()
+            atexit.register(self.save)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def encode(self, query):
+        """
+        Return the embedding of `query`, encoding it only on a cache miss
+
+        Parameters
+        ----------
+        query : str
+            The search query
+
+        Returns
+        -------
+        numpy.ndarray
+            The float32 query embedding
+        """
+        key = normalize_text(query)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        vector = np.asarray(self.model.encode(key), dtype=np.float32)
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            spill = self.spill_path and self.misses % self.spill_every == 0
+        if spill:
+            self.save()
+        return vector
+
+    def encode_many(self, queries):
+        """
+        Return the embeddings of several queries, encoding all the misses in one batch
+
+        Parameters
+        ----------
+        queries : list of str
+            The search queries
+
+        Returns
+        -------
+        numpy.ndarray
+            One float32 embedding per query, in the same order
+        """
+        keys = [normalize_text(query) for query in queries]
+        vectors = {}
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    vectors[key] = vector
+            missing = list(dict.fromkeys(key for key in keys if key not in vectors))
+            self.misses += len(missing)
+
+        if missing:
+            encoded = np.asarray(self.model.encode(missing), dtype=np.float32)
+            with self._lock:
+                for key, vector in zip(missing, encoded):
+                    self._entries[key] = vector
+                    self._entries.move_to_end(key)
+                    vectors[key] = vector
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+                # Spill when this batch crossed a multiple of spill_every misses
+                spill = self.spill_path and self.misses % self.spill_every < len(missing)
+            if spill:
+                self.save()
+        return np.stack([vectors[key] for key in keys])
+
+    def stats(self):
+        """
+        Return the cache counters
+
+        Returns
+        -------
+        dict
+            Size, hits, misses, evictions and hit rate
+        """
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def save(self):
+        """
+        Spill the cached entries to `spill_path`, least recently used first
+
+        Every call writes its own temporary file before renaming it, so concurrent
+        saves never write to the same file.
+
+        Returns
+        -------
+        None
+        """
+        if not self.spill_path:
+            return
+        with self._lock:
+            keys = list(self._entries)
+            vectors = list(self._entries.values())
+        if not keys:
+            return
+        directory = os.path.dirname(self.spill_path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory, suffix='.tmp.npz', delete=False) as tmp:
+            try:
+                np.savez(tmp, keys=np.asarray(keys, dtype=str), vectors=np.stack(vectors),
+                         encoder=np.asarray(self.encoder_key))
+            except BaseException:
+                tmp.close()
+                os.remove(tmp.name)
+                raise
+        os.replace(tmp.name, self.spill_path)
+
+    def load(self):
+        """
+        Reload the entries spilled to `spill_path`, if any
+
+        A spill saved by another encoder, or before the encoder was recorded, is
+        skipped: its vectors do not match the ones `model` returns.
+
+        Returns
+        -------
+        None
+        """
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return
+        with np.load(self.spill_path) as spilled:
+            if 'encoder' not in spilled or str(spilled['encoder']) != self.encoder_key:
+                return
+            keys, vectors = spilled['keys'], spilled['vectors']
+        with self._lock:
+            # Keep the most recently used entries when the file holds more than maxsize
+            for key, vector in list(zip(keys, vectors))[-self.maxsize:]:
+                self._entries[str(key)] = vector
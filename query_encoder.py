@@ -0,0 +1,282 @@
+"""
+Query encoder backends of the search path.
+
+The query embedding is the most expensive step of a Synopsis or Hybrid search, so
+the model behind the query cache can run on one of two backends:
+
+- ``torch``: the reference `SentenceTransformer`, eager PyTorch in float32;
+- ``onnx``: the same model exported once to an ONNX graph in ``onnx_dir`` and run
+  with ONNX Runtime, optionally with int8 dynamic quantization of its weights.
+
+Either way the thread count is configurable and the model encodes a few queries at
+load, so the first user query does not pay for the lazy initialisation of the
+runtime. The catalog embeddings are always built with the reference model (see
+``embedding_build.py``); only the queries go through the faster backend.
+
+``python query_encoder.py`` encodes a sample of queries with the reference model and
+with the configured backend, and reports the per-query latency, the batch throughput,
+the cosine agreement of the embeddings and, when the catalog embeddings are on disk,
+how many of the top 10 results stay the same. The settings live in the
+``query_encoder`` section of ``config.yaml``.
+"""
+import os
+import re
+import time
+
+import numpy as np
+
+DEFAULT_MODEL = 'all-MiniLM-L6-v2'
+BACKENDS = ('torch', 'onnx')
+# Quantization configurations of `export_dynamic_quantized_onnx_model`, by CPU
+QUANTIZATIONS = ('arm64', 'avx2', 'avx512', 'avx512_vnni')
+WARMUP_QUERIES = ['a detective solving crimes in a small town', 'romantic comedy', 'space adventure']
+
+
+def _export_onnx(model_name, onnx_dir, quantization=None):
+    """
+    Export the model to ONNX under `onnx_dir`, once, and return the graph file to load
+
+    Every model is exported to its own subdirectory, so changing the configured model
+    never loads the graphs exported for the previous one.
+
+    Parameters
+    ----------
+    model_name : str
+        Name or path of the sentence-transformers model
+    onnx_dir : str
+        Directory the exported models are saved to
+    quantization : str, optional
+        One of `QUANTIZATIONS`; the float32 graph when None
+
+    Returns
+    -------
+    model_dir : str
+        Directory of the exported model
+    file_name : str
+        Path of the graph file, relative to `model_dir`
+    """
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    model_dir = os.path.join(onnx_dir, re.sub(r'[^\w.-]+', '--', model_name).strip('-.'))
+    file_name = os.path.join('onnx', 'model.onnx')
+    if not os.path.exists(os.path.join(model_dir, file_name)):
+        SentenceTransformer(model_name, backend='onnx', device='cpu').save(model_dir)
+    if quantization is None:
+        return model_dir, file_name
+
+    quantized_name = os.path.join('onnx', f"model_qint8_{quantization}.onnx")
+    if not os.path.exists(os.path.join(model_dir, quantized_name)):
+        model = SentenceTransformer(model_dir, backend='onnx', device='cpu',
+                                    model_kwargs={'file_name': file_name})
+        export_dynamic_quantized_onnx_model(model, quantization, model_dir)
+    return model_dir, quantized_name
+
+
+def encoder_key(settings=None):
+    """
+    Identify the encoder configured in `settings`
+
+    Parameters
+    ----------
+    settings : dict, optional
+        The ``query_encoder`` section of ``config.yaml``; the reference model when None
+
+    Returns
+    -------
+    str
+        ``model/backend/quantization``, equal for two settings only when they encode
+        queries to the same vectors
+    """
+    settings = settings or {}
+    return f"{settings.get('model', DEFAULT_MODEL)}/{settings.get('backend', 'torch')}/" \
+           f"{settings.get('quantization')}"
+
+
+def load_query_model(settings=None):
+    """
+    Load the query embedding model on the configured backend and warm it up
+
+    Parameters
+    ----------
+    settings : dict, optional
+        The ``query_encoder`` section of ``config.yaml``; the reference model when None
+
+    Returns
+    -------
+    sentence_transformers.SentenceTransformer
+        The model, already run on `WARMUP_QUERIES`
+    """
+    from sentence_transformers import SentenceTransformer
+
+    settings = settings or {}
+    model_name = settings.get('model', DEFAULT_MODEL)
+    backend = settings.get('backend', 'torch')
+    threads = settings.get('threads')
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown encoder backend {backend!r}, expected one of {BACKENDS}")
+    quantization = settings.get('quantization')
+    if quantization is not None and (backend != 'onnx' or quantization not in QUANTIZATIONS):
+        raise ValueError(f"Quantization {quantization!r} needs the onnx backend and one of {QUANTIZATIONS}")
+
+    start = time.perf_counter()
+    if backend == 'torch':
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        model = SentenceTransformer(model_name, device='cpu')
+    else:
+        import onnxruntime
+
+        onnx_dir = settings.get('onnx_dir', 'data/clean_data/onnx_encoder')
+        model_dir, file_name = _export_onnx(model_name, onnx_dir, quantization)
+        session_options = onnxruntime.SessionOptions()
+        if threads:
+            session_options.intra_op_num_threads = threads
+            session_options.inter_op_num_threads = 1
+        model = SentenceTransformer(model_dir, backend='onnx', device='cpu',
+                                    model_kwargs={'file_name': file_name,
+                                                  'provider': 'CPUExecutionProvider',
+                                                  'session_options': session_options})
+    loaded = time.perf_counter()
+
+    # The first calls initialise the runtime and its memory pools
+    for _ in range(settings.get('warmup_rounds', 2)):
+        model.encode(WARMUP_QUERIES)
+        for query in WARMUP_QUERIES:
+            model.encode(query)
+    print(f"Query encoder {backend}{f' ({quantization})' if quantization else ''} loaded in "
+          f"{loaded - start:.1f}s, warmed up in {time.perf_counter() - loaded:.1f}s.")
+    return model
+
+
+def _latency(seconds):
+    """Return the mean and p50/p95/p99 of durations in seconds, in milliseconds."""
+    milliseconds = np.asarray(seconds, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+    return {'mean_ms': float(milliseconds.mean()), 'p50_ms': float(p50), 'p95_ms': float(p95),
+            'p99_ms': float(p99)}
+
+
+def time_encoder(model, queries, batch_size=32):
+    """
+    Time a model on single queries and on batches of queries
+
+    Parameters
+    ----------
+    model : sentence_transformers.SentenceTransformer
+        The model, already warmed up
+    queries : list of str
+        The queries
+    batch_size : int
+        Queries per batch, like the service micro-batches
+
+    Returns
+    -------
+    tuple
+        The embedding of every query and the latency and throughput figures
+    """
+    seconds = []
+    vectors = []
+    for query in queries:
+        start = time.perf_counter()
+        vectors.append(model.encode(query))
+        seconds.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for first in range(0, len(queries), batch_size):
+        model.encode(queries[first:first + batch_size], batch_size=batch_size)
+    batch_seconds = time.perf_counter() - start
+
+    return np.asarray(vectors, dtype=np.float32), dict(
+        _latency(seconds),
+        single_per_second=len(queries) / sum(seconds),
+        batch_per_second=len(queries) / batch_seconds)
+
+
+def compare_encoders(reference, candidate, queries, embeddings=None, batch_size=32, top_k=10):
+    """
+    Compare the latency and the embeddings of a candidate encoder with the reference
+
+    Parameters
+    ----------
+    reference, candidate : sentence_transformers.SentenceTransformer
+        The reference model and the faster backend, both warmed up
+    queries : list of str
+        The queries
+    embeddings : numpy.ndarray, optional
+        The catalog embeddings; when given, the top `top_k` results of both encoders
+        are compared
+    batch_size : int
+        Queries per batch of the throughput measure
+    top_k : int
+        Results compared per query
+
+    Returns
+    -------
+    dict
+        Latency and throughput of each encoder, cosine agreement of the embeddings
+        and overlap of the top results
+    """
+    reference_vectors, reference_timing = time_encoder(reference, queries, batch_size)
+    candidate_vectors, candidate_timing = time_encoder(candidate, queries, batch_size)
+
+    def unit(vectors):
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    cosine = np.einsum('ij,ij->i', unit(reference_vectors), unit(candidate_vectors))
+    report = {
+        'queries': len(queries),
+        'reference': reference_timing,
+        'candidate': candidate_timing,
+        'speedup_p50': reference_timing['p50_ms'] / candidate_timing['p50_ms'],
+        'cosine_mean': float(cosine.mean()),
+        'cosine_min': float(cosine.min()),
+        'cosine_p01': float(np.percentile(cosine, 1)),
+    }
+    if embeddings is not None:
+        # Nearest catalog rows by squared euclidean distance, like the vector index
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.einsum('ij,ij->i', matrix, matrix)
+        overlaps = []
+        for first in range(0, len(queries), 256):
+            tops = []
+            for vectors in (reference_vectors[first:first + 256], candidate_vectors[first:first + 256]):
+                distances = norms - 2 * vectors @ matrix.T
+                tops.append(np.argpartition(distances, top_k, axis=1)[:, :top_k])
+            overlaps += [len(np.intersect1d(a, b)) / top_k for a, b in zip(*tops)]
+        report[f'top{top_k}_overlap'] = float(np.mean(overlaps))
+    return report
+
+
+if __name__ == '__main__':
+    import pandas as pd
+
+    from settings import load_config
+    from vector_index import VECTORS_FILE
+
+    config = load_config()
+    settings = config['query_encoder']
+    compare = settings.get('compare', {})
+    df = pd.read_csv(config['paths']['data_cleaned'], usecols=['Title', 'Synopsis'])
+    rng = np.random.default_rng(compare.get('seed', 0))
+    rows = df.iloc[rng.integers(len(df), size=compare.get('queries', 200))]
+    # Titles and synopsis fragments, the two kinds of query the searches see
+    queries = [title if i % 2 else ' '.join(synopsis.split()[:8])
+               for i, (title, synopsis) in enumerate(zip(rows['Title'], rows['Synopsis']))]
+
+    embeddings_path = os.path.join(config['vector_index']['embeddings_dir'], VECTORS_FILE)
+    embeddings = np.load(embeddings_path, mmap_mode='r') if os.path.exists(embeddings_path) else None
+    reference = load_query_model({'model': settings.get('model', DEFAULT_MODEL), 'backend': 'torch',
+                                  'threads': settings.get('threads')})
+    report = compare_encoders(reference, load_query_model(settings), queries, embeddings,
+                              batch_size=compare.get('batch_size', 32))
+    for name in ('reference', 'candidate'):
+        timing = report[name]
+        print(f"{name:<10} p50 {timing['p50_ms']:7.2f} ms  p95 {timing['p95_ms']:7.2f} ms  "
+              f"p99 {timing['p99_ms']:7.2f} ms  {timing['single_per_second']:7.1f} queries/s single  "
+              f"{timing['batch_per_second']:7.1f} queries/s batched")
+    print(f"Speedup (p50): {report['speedup_p50']:.2f}x")
+    print(f"Cosine agreement: mean {report['cosine_mean']:.4f}, p01 {report['cosine_p01']:.4f}, "
+          f"min {report['cosine_min']:.4f}")
+    if 'top10_overlap' in report:
+        print(f"Top 10 overlap with the reference: {report['top10_overlap']:.3f}")
@@ -0,0 +1,351 @@
+"""
+Search and recommendation logic shared by the service and any other caller.
+
+`Recommender` answers the Recommender, Top 10 and Moods pages from the serving data
+(catalog and indexes, see ``artifact.py``) and the query embedding cache. It is plain
+synchronous code with no UI or network; ``service.py`` exposes it over a local JSON
+API.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from artifact import build_serving, current_version, open_artifact, report_cold_start
+from bm25_index import RRF_K, reciprocal_rank_fusion
+from genre_index import load_genre_matrix
+from metrics import Metrics
+from query_cache import QueryEmbeddingCache
+from query_encoder import encoder_key, load_query_model
+
+SEARCH_TYPES = ['Title', 'Cast', 'Synopsis', 'Hybrid']
+# Search types whose query is encoded
+DENSE_SEARCH_TYPES = ('Synopsis', 'Hybrid')
+# Minimum number of votes of the Synopsis, Hybrid and Title search results
+SEARCH_MIN_VOTES = 1000
+# Minimum number of votes of the Top 10 and Moods results
+TOP_MIN_VOTES = 10000
+
+
+def load_serving(config, pinecone_client=None):
+    """
+    Open the serving data: the current artifact, or everything built from the CSV
+
+    Parameters
+    ----------
+    config : dict
+        The parsed ``config.yaml``
+    pinecone_client : pinecone.Pinecone, optional
+        Client used when the vector backend is ``'pinecone'``
+
+    Returns
+    -------
+    Serving
+        The serving data
+    """
+    version = current_version(config['artifact']['dir'])
+    if version:
+        serving = open_artifact(os.path.join(config['artifact']['dir'], version),
+                                config['vector_index'], pinecone_client)
+    else:
+        df = pd.read_csv(config['paths']['data_cleaned'])
+        genre_matrix = load_genre_matrix(config['paths'].get('genre_matrix'), df['IMDb ID'])
+        serving = build_serving(df, config['vector_index'], pinecone_client, genre_matrix=genre_matrix)
+    report_cold_start(serving.open_seconds * 1000, config['artifact'].get('cold_start_budget_ms'))
+    return serving
+
+
+def reload_serving(config, serving, pinecone_client=None):
+    """
+    Open the current artifact if a newer version than `serving` was published
+
+    Parameters
+    ----------
+    config : dict
+        The parsed ``config.yaml``
+    serving : Serving
+        The serving data in use
+    pinecone_client : pinecone.Pinecone, optional
+        Client used when the vector backend is ``'pinecone'``
+
+    Returns
+    -------
+    Serving or None
+        The serving data of the current version, None when `serving` is already it
+    """
+    version = current_version(config['artifact']['dir'])
+    if not version or version == serving.version:
+        return None
+    return open_artifact(os.path.join(config['artifact']['dir'], version), config['vector_index'], pinecone_client)
+
+
+def load_encoder(config):
+    """
+    Load the embedding model behind the query embedding cache
+
+    Parameters
+    ----------
+    config : dict
+        The parsed ``config.yaml``
+
+    Returns
+    -------
+    QueryEmbeddingCache
+        The cached encoder, on the backend of the ``query_encoder`` section
+    """
+    settings = config['query_cache']
+    encoder = config.get('query_encoder') or {}
+    return QueryEmbeddingCache(load_query_model(encoder),
+                               maxsize=settings['maxsize'],
+                               spill_path=settings.get('spill_path'),
+                               spill_every=settings.get('spill_every', 100),
+                               encoder_key=encoder_key(encoder))
+
+
+class Recommender:
+    """
+    Searches and top-N lookups over the serving data
+
+    Parameters
+    ----------
+    serving : Serving
+        The catalog and indexes
+    encoder : QueryEmbeddingCache
+        Encoder of the Synopsis queries
+    cast_limit : int
+        Maximum number of results of a Cast search
+    max_results : int
+        Maximum number of results of the other searches
+    hybrid_candidates : int
+        Results taken from each of the dense and keyword searches before fusing them
+    rrf_k : float
+        Rank constant of the reciprocal-rank fusion of a Hybrid search
+    metrics : Metrics, optional
+        Records the time of every stage of the calls; disabled by default
+    """
+
+    def __init__(self, serving, encoder, cast_limit=50, max_results=50, hybrid_candidates=50, rrf_k=RRF_K,
+                 metrics=None):
+        self.serving = serving
+        self.encoder = encoder
+        self.cast_limit = cast_limit
+        self.max_results = max_results
+        self.hybrid_candidates = hybrid_candidates
+        self.rrf_k = rrf_k
+        self.metrics = metrics or Metrics(enabled=False)
+
+    def search(self, query, search_type, min_rating, vector=None, keyword_positions=None, trace=None,
+               offset=0, limit=10, serving=None):
+        """
+        Search the catalog by title, cast, synopsis or both synopsis and keywords
+
+        Results are ranked up to `cast_limit` (Cast) or `max_results` (other types) and
+        only the page ``[offset, offset + limit)`` of them is returned, so later pages
+        can be fetched lazily and only the rows shown are hydrated.
+
+        Parameters
+        ----------
+        query : str
+            The search query
+        search_type : str
+            One of `SEARCH_TYPES`
+        min_rating : float
+            Minimum rating of the results
+        vector : array-like of float, optional
+            Embedding of `query`, for Synopsis and Hybrid searches whose query was
+            already encoded
+        keyword_positions : numpy.ndarray, optional
+            Result of `keyword_search` for `query`, for Hybrid searches that already
+            ran it
+        trace : Trace, optional
+            Trace the caller already opened for this search, see `Metrics.trace`
+        offset : int
+            Rank of the first result returned
+        limit : int
+            Maximum number of results returned
+        serving : Serving, optional
+            Serving data to search, `serving` by default; a caller that already ran
+            `keyword_search` passes the one it used, so both run on the same version
+
+        Returns
+        -------
+        list of dict
+            The display records of the results, best first
+        """
+        if search_type not in SEARCH_TYPES:
+            raise ValueError(f"Unknown search type {search_type!r}, expected one of {SEARCH_TYPES}")
+        # The serving data can be swapped by a reload while the search runs
+        serving = serving or self.serving
+        catalog = serving.catalog
+        # Rank only as many results as the requested page needs
+        stop = min(offset + limit, self.cast_limit if search_type == 'Cast' else self.max_results)
+        if stop <= offset:
+            return []
+        with trace or self.metrics.trace('search', query=query, search_type=search_type,
+                                         min_rating=min_rating) as trace:
+            if search_type == 'Synopsis':
+                matches = self._dense_matches(serving, query, min_rating, vector, stop, trace)[offset:]
+                with trace.stage('hydrate'):
+                    return catalog.hydrate([match['id'] for match in matches], [match['score'] for match in matches])
+            if search_type == 'Hybrid':
+                matches = self._dense_matches(serving, query, min_rating, vector, max(self.hybrid_candidates, stop),
+                                             trace)
+                if keyword_positions is None:
+                    keyword_positions = self.keyword_search(query, min_rating, trace, serving)
+                with trace.stage('fusion'):
+                    dense_positions = catalog.positions([match['id'] for match in matches])
+                    positions, scores = reciprocal_rank_fusion(
+                        [dense_positions[dense_positions >= 0], keyword_positions], limit=stop, k=self.rrf_k)
+                with trace.stage('hydrate'):
+                    records = catalog.records(positions[offset:])
+                    for record, score in zip(records, scores[offset:]):
+                        record['Score'] = float(score)
+                    return records
+            with trace.stage('index_lookup'):
+                if search_type == 'Title':
+                    positions = serving.title_index.search(query, min_rating, min_votes=SEARCH_MIN_VOTES,
+                                                           limit=stop)
+                else:
+                    positions = serving.cast_index.search(query, min_rating, limit=stop)
+            with trace.stage('hydrate'):
+                return catalog.records(positions[offset:])
+
+    def _dense_matches(self, serving, query, min_rating, vector, top_k, trace):
+        """Return the vector index matches of `query`, encoding it unless `vector` is given."""
+        if vector is None:
+            with trace.stage('encode'):
+                vector = self.encoder.encode(query)
+        # Filter inside the index: enough votes and the minimum rating
+        rating_filter = {'Number of Votes': {'$gte': SEARCH_MIN_VOTES}, 'Rating': {'$gte': min_rating}}
+        with trace.stage('vector_query'):
+            results = serving.vector_index.query(vector=list(map(float, vector)), top_k=top_k,
+                                                 filter=rating_filter)
+        return results['matches']
+
+    def keyword_search(self, query, min_rating, trace=None, serving=None):
+        """
+        Return the best BM25 matches of a query over the titles and synopses
+
+        Parameters
+        ----------
+        query : str
+            The search query
+        min_rating : float
+            Minimum rating of the results
+        trace : Trace, optional
+            Trace of the Hybrid search this lookup is part of
+        serving : Serving, optional
+            Serving data to search, `serving` by default
+
+        Returns
+        -------
+        numpy.ndarray
+            Up to `hybrid_candidates` catalog rows, best first; empty when the serving
+            data has no keyword index
+        """
+        serving = serving or self.serving
+        if serving.bm25_index is None:
+            return np.empty(0, dtype=np.int32)
+        with trace or self.metrics.trace('keyword_search', query=query, min_rating=min_rating) as trace:
+            with trace.stage('keyword_query'):
+                positions, _ = serving.bm25_index.search(query, min_rating, min_votes=SEARCH_MIN_VOTES,
+                                                         limit=self.hybrid_candidates)
+        return positions
+
+    def top_by_genre(self, genre, subgenres=(), n=10):
+        """
+        Return the best rated series of a genre, optionally narrowed to some subgenres
+
+        Parameters
+        ----------
+        genre : str
+            Genre every series must have
+        subgenres : list of str
+            When not empty, every series must also have at least one of them
+        n : int
+            Maximum number of results
+
+        Returns
+        -------
+        list of dict
+            The display records, best rated first
+        """
+        serving = self.serving
+        with self.metrics.trace('top_by_genre', genre=genre, subgenres=list(subgenres), n=n) as trace:
+            with trace.stage('index_lookup'):
+                positions = serving.genre_index.top(genre, subgenres, min_votes=TOP_MIN_VOTES, n=n)
+            with trace.stage('hydrate'):
+                return serving.catalog.records(positions)
+
+    def top_by_mood(self, mood, n=10):
+        """
+        Return the best rated series of a mood
+
+        Parameters
+        ----------
+        mood : str
+            The mood
+        n : int
+            Maximum number of results
+
+        Returns
+        -------
+        dict
+            Whether any series has the mood (`known`) and the display records
+            (`results`), best rated first
+        """
+        serving = self.serving
+        genre_index = serving.genre_index
+        if not genre_index.has_mood(mood):
+            return {'known': False, 'results': []}
+        with self.metrics.trace('top_by_mood', mood=mood, n=n) as trace:
+            with trace.stage('index_lookup'):
+                positions = genre_index.top_by_mood(mood, min_votes=TOP_MIN_VOTES, n=n)
+            with trace.stage('hydrate'):
+                return {'known': True, 'results': serving.catalog.records(positions)}
+
+    def more_like_this(self, imdb_id, n=10):
+        """
+        Return the series most similar to a series, from the precomputed neighbour table
+
+        Parameters
+        ----------
+        imdb_id : str
+            IMDb ID of the series
+        n : int
+            Maximum number of results
+
+        Returns
+        -------
+        list of dict
+            The display records of the most similar series, closest first, with their
+            distance as 'Score'; empty when the table was not computed or the series
+            has no embedding
+        """
+        serving = self.serving
+        neighbors = serving.neighbors
+        position = serving.catalog.positions([imdb_id])[0]
+        if neighbors is None or position < 0:
+            return []
+        with self.metrics.trace('more_like_this', imdb_id=imdb_id, n=n) as trace:
+            with trace.stage('index_lookup'):
+                positions, scores = neighbors.lookup(position, n)
+            with trace.stage('hydrate'):
+                records = serving.catalog.records(positions)
+                for record, score in zip(records, scores):
+                    record['Score'] = float(score)
+                return records
+
+    def options(self):
+        """
+        Return the choices offered by the Top 10 and Moods pages
+
+        Returns
+        -------
+        dict
+            The main genres, the genres and the moods
+        """
+        genre_index = self.serving.genre_index
+        return {'main_genres': list(genre_index.main_genre_options),
+                'genres': list(genre_index.genre_options),
+                'moods': list(genre_index.mood_bits)}
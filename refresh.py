@@ -0,0 +1,323 @@
+"""
+Delta refresh of the catalog, its embeddings and the serving artifact.
+
+Every genre CSV under ``data/`` is fingerprinted (size, modification time and
+content hash). A refresh only reads the files that were added, changed or removed
+since the previous one: their deduplicated rows are cached per file, the series
+they list are recomputed through the cleaning, mood and embedding stages from the
+cached rows of every file, and the rest of the clean catalog is kept as is; only the
+near duplicate pairs with a recomputed series are dropped. The embedding build
+reuses every vector whose text did not change, the "more like this" table is
+updated for the changed series only, and a new artifact version is published. A
+running service picks the new version up on its next check of ``CURRENT`` (see
+``service.py``) and finishes the requests already in flight on the previous one.
+
+Known limit: the cleaning, encoding and neighbour steps scale with the change, but
+``series.csv`` and the genre matrix are still read and written in full, and the
+artifact (catalog, title, BM25 and genre indexes) is rebuilt from the whole catalog.
+Those steps cost a few seconds per 100k series whatever the size of the change.
+
+Run ``python refresh.py`` from the project root; the settings live in the
+``refresh`` section of ``config.yaml``.
+"""
+import glob
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from artifact import build_artifact
+from embedding_build import build_embeddings, upsert_enabled
+from genre_index import load_genre_matrix
+from neighbors import build_neighbors, load_neighbors, save_neighbors, update_neighbors
+from vector_index import IDS_FILE, connect_pinecone, load_embeddings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'notebooks'))
+from functions import (best_per_id, classify_moods, clean_data, drop_columns,  # noqa: E402
+                       drop_near_duplicates, new_columns, read_genre_file, to_csv, unique_films)
+
+STATE_FILE = 'state.json'
+FILES_DIR = 'files'
+
+
+def fingerprint(path):
+    """
+    Fingerprint a file by size, modification time and SHA-1 of its content
+
+    Parameters
+    ----------
+    path : str
+        Path of the file
+
+    Returns
+    -------
+    dict
+        ``size``, ``mtime_ns`` and ``sha1`` of the file
+    """
+    stat = os.stat(path)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': digest.hexdigest()}
+
+
+class RefreshState:
+    """
+    Fingerprints of the genre files and their deduplicated rows, as of the last refresh
+
+    The cached rows of a changed file are replaced as soon as it is read, but the
+    `IMDb ID` each file listed are saved in ``state.json`` together with the
+    fingerprints. A refresh that fails before `save` is retried against the series
+    the files listed at the last completed refresh, so the series removed from a file
+    are still recomputed.
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding the state file and the cached rows of every genre file
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, FILES_DIR), exist_ok=True)
+        self.fingerprints = {}
+        self.ids = {}
+        self._new_ids = {}
+        state_path = os.path.join(directory, STATE_FILE)
+        if os.path.exists(state_path):
+            with open(state_path, encoding='utf-8') as f:
+                state = json.load(f)
+            self.fingerprints = state['files']
+            self.ids = state.get('ids', {})
+
+    def changes(self, paths):
+        """
+        Compare the genre files on disk with the last refresh
+
+        Unchanged size and modification time skip hashing the file.
+
+        Parameters
+        ----------
+        paths : list of str
+            The genre files currently on disk
+
+        Returns
+        -------
+        tuple
+            The fingerprints of every file on disk, the names of the added or
+            changed files and the names of the removed ones
+        """
+        current, changed = {}, []
+        for path in paths:
+            name = os.path.basename(path)
+            previous = self.fingerprints.get(name)
+            stat = os.stat(path)
+            if previous and previous['size'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns:
+                current[name] = previous
+                continue
+            current[name] = fingerprint(path)
+            if not previous or previous['sha1'] != current[name]['sha1']:
+                changed.append(name)
+        removed = sorted(set(self.fingerprints) - set(current))
+        return current, changed, removed
+
+    def _rows_path(self, name):
+        return os.path.join(self.directory, FILES_DIR, f"{name}.pkl")
+
+    def rows(self, name):
+        """Return the cached rows of a genre file, None when it has none."""
+        path = self._rows_path(name)
+        return pd.read_pickle(path) if os.path.exists(path) else None
+
+    def previous_ids(self, name):
+        """Return the `IMDb ID` a genre file listed at the last completed refresh."""
+        if name in self.ids:
+            return self.ids[name]
+        # State written before the IDs were recorded
+        rows = self.rows(name) if name in self.fingerprints else None
+        return [] if rows is None else list(rows['IMDb ID'])
+
+    def set_rows(self, name, rows):
+        """Cache the deduplicated rows of a genre file; None removes them."""
+        path = self._rows_path(name)
+        self._new_ids[name] = [] if rows is None else list(rows['IMDb ID'])
+        if rows is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        rows.to_pickle(path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def save(self, fingerprints):
+        """Record the fingerprints and IDs of the files the cached rows now reflect."""
+        ids = {name: self._new_ids[name] if name in self._new_ids else self.previous_ids(name)
+               for name in fingerprints}
+        tmp_path = os.path.join(self.directory, STATE_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'files': fingerprints, 'ids': ids}, f)
+        os.replace(tmp_path, os.path.join(self.directory, STATE_FILE))
+        self.fingerprints, self.ids, self._new_ids = fingerprints, ids, {}
+
+
+def clean_rows(rows, moods):
+    """
+    Run the rows of some series through the cleaning pipeline of ``main.ipynb``
+
+    Parameters
+    ----------
+    rows : pandas.DataFrame
+        Deduplicated rows read from the genre files
+    moods : dict
+        The ``moods`` section of ``config.yaml``
+
+    Returns
+    -------
+    pandas.DataFrame
+        The clean rows, with the columns added by `new_columns` and the `Mood`
+    """
+    df = unique_films(clean_data(drop_columns(rows)))
+    df = new_columns(df.copy())
+    df['Mood'] = classify_moods(df['Main Genre'], moods)
+    return df
+
+
+def refresh(config, model, pinecone_index=None):
+    """
+    Bring the clean catalog, the embeddings and the artifact up to date with ``data/``
+
+    Parameters
+    ----------
+    config : dict
+        The parsed ``config.yaml``
+    model : sentence_transformers.SentenceTransformer
+        Encoder of the new or changed series; with ``embedding_build.model`` it keys
+        the cached vectors
+    pinecone_index : pinecone.Index, optional
+        Index the new vectors are upserted to
+
+    Returns
+    -------
+    dict or None
+        Counts and timings of the refresh, None when no genre file changed or there
+        is no catalog to publish yet
+    """
+    settings = config['refresh']
+    paths = config['paths']
+    start = time.perf_counter()
+    state = RefreshState(settings['state_dir'])
+    files = sorted(glob.glob(os.path.join(settings['data_dir'], settings.get('pattern', '*_series.csv'))))
+    fingerprints, changed, removed = state.changes(files)
+    if not changed and not removed:
+        print("No genre file changed, nothing to refresh.")
+        return None
+
+    # Series listed, at the last completed refresh or now, in the files that changed
+    affected = set()
+    for name in changed + removed:
+        affected.update(state.previous_ids(name))
+    for name in changed:
+        rows = read_genre_file(os.path.join(settings['data_dir'], name))
+        state.set_rows(name, rows)
+        if rows is not None:
+            affected.update(rows['IMDb ID'])
+    for name in removed:
+        state.set_rows(name, None)
+    read = time.perf_counter()
+
+    # Best row of every affected series across all the files, then the usual cleaning
+    candidates = [rows[rows['IMDb ID'].isin(affected)] for rows in map(state.rows, fingerprints)
+                  if rows is not None]
+    candidates = [rows for rows in candidates if len(rows)]
+    fresh = clean_rows(best_per_id(pd.concat(candidates, ignore_index=True)), config['moods']) if candidates \
+        else None
+
+    previous_df = pd.read_csv(paths['data_cleaned']) if os.path.exists(paths['data_cleaned']) else None
+    if previous_df is None:
+        df = fresh
+    else:
+        df = previous_df[~previous_df['IMDb ID'].isin(affected)]
+        if fresh is not None:
+            df = pd.concat([df, fresh[df.columns]], ignore_index=True)
+    if df is None:
+        # First refresh and the genre files list no series yet
+        state.save(fingerprints)
+        print("The genre files list no series, nothing to publish.")
+        return None
+    df = df.sort_values('Number of Votes', ascending=False, kind='stable').reset_index(drop=True)
+    # The rest of the catalog was deduplicated before; a dropped row stays out until
+    # its file changes or a full rebuild
+    df = drop_near_duplicates(df, changed=affected).reset_index(drop=True)
+    cleaned = time.perf_counter()
+
+    # Texts whose content hash changed are the only ones encoded again
+    embeddings_dir = config['vector_index']['embeddings_dir']
+    previous_table = load_neighbors(embeddings_dir)
+    if previous_table is not None:
+        # Read into memory, the files are overwritten below
+        previous_table = tuple(np.array(part) for part in previous_table)
+        previous_ids = np.load(os.path.join(embeddings_dir, IDS_FILE))
+    to_csv(df, paths['data_cleaned'], paths['genre_matrix'])
+    build = config['embedding_build']
+    stats = build_embeddings(df, model, build['cache_dir'], embeddings_dir, index=pinecone_index,
+                             batch_size=build.get('batch_size', 256), chunk_size=build.get('chunk_size', 8192),
+                             workers=build.get('workers', 1),
+                             upsert_batch_size=build.get('upsert_batch_size', 200),
+                             quantize=build.get('quantize', []),
+                             model_name=build.get('model', 'all-MiniLM-L6-v2'))
+    embedded = time.perf_counter()
+
+    neighbor_settings = config['neighbors']
+    if previous_table is None:
+        build_neighbors(embeddings_dir, k=neighbor_settings.get('k', 10),
+                        memory_mb=neighbor_settings.get('memory_mb', 512), workers=neighbor_settings.get('workers'))
+    else:
+        ids, vectors, _ = load_embeddings(embeddings_dir)
+        rows, scores = update_neighbors(*previous_table, previous_ids, vectors, ids, sorted(affected),
+                                        memory_mb=neighbor_settings.get('memory_mb', 512))
+        save_neighbors(embeddings_dir, rows, scores)
+
+    artifact = config['artifact']
+    path = build_artifact(df, embeddings_dir, root=artifact['dir'], vector_settings=config['vector_index'],
+                          cold_start_budget_ms=artifact.get('cold_start_budget_ms'),
+                          genre_matrix=load_genre_matrix(paths['genre_matrix'], df['IMDb ID']),
+                          evaluate_quantization=build.get('evaluate_quantization', False),
+                          keep=artifact.get('keep', 3))
+    state.save(fingerprints)
+    done = time.perf_counter()
+
+    summary = {
+        'changed_files': changed,
+        'removed_files': removed,
+        'affected_series': len(affected),
+        'rows': len(df),
+        'encoded': stats['encoded'],
+        'artifact': path,
+        'read_seconds': read - start,
+        'clean_seconds': cleaned - read,
+        'embed_seconds': embedded - cleaned,
+        'publish_seconds': done - embedded,
+    }
+    print(f"Refreshed {len(affected)} series from {len(changed)} changed and {len(removed)} removed files "
+          f"in {done - start:.1f}s (read {summary['read_seconds']:.1f}s, clean {summary['clean_seconds']:.1f}s, "
+          f"embed {summary['embed_seconds']:.1f}s, publish {summary['publish_seconds']:.1f}s).")
+    return summary
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from sentence_transformers import SentenceTransformer
+
+    from settings import load_config
+
+    load_dotenv()
+    config = load_config()
+    build = config['embedding_build']
+    pinecone_index = None
+    if upsert_enabled(config):
+        pinecone_index = connect_pinecone(os.getenv("key")).Index(config['vector_index']['pinecone_index'])
+    refresh(config, SentenceTransformer(build.get('model', 'all-MiniLM-L6-v2')), pinecone_index)
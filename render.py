@@ -0,0 +1,150 @@
+"""
+Paginated rendering of the result lists of the app.
+
+A result list is kept in ``st.session_state`` under a key of its own, with a function
+that fetches one page of results from the service. Only the pages the user opens are
+fetched, each one page size plus one row so we know whether a next page exists. A
+page is drawn as a single HTML block plus a fixed set of widgets (previous/next and
+"More like this"), so the size of what is sent to the browser depends on the page
+size, not on how many series matched.
+"""
+import html
+
+import streamlit as st
+
+PAGE_SIZE = 10
+
+
+def series_html(series, genre_column='Genre'):
+    """
+    Build the HTML card of a series
+
+    Parameters
+    ----------
+    series : dict
+        Display record of the series
+    genre_column : str
+        Column shown as the genre
+
+    Returns
+    -------
+    str
+        The card, with every field escaped
+    """
+    field = {name: html.escape(str(series.get(name, ''))) for name in
+             ('Title', genre_column, 'Cast', 'Rating', 'Synopsis')}
+    return (f"<p><b>✨{field['Title']}✨</b><br>"
+            f"🎭 Genre: {field[genre_column]}<br>"
+            f"🎥 Cast: {field['Cast']}<br>"
+            f"⭐️ Rating: {field['Rating']}<br>"
+            f"<b>🎬 Synopsis:</b> {field['Synopsis']}</p><hr>")
+
+
+def render_page(records, genre_column='Genre'):
+    """
+    Draw a page of series with a single markdown call
+
+    Parameters
+    ----------
+    records : list of dict
+        Display records of the page
+    genre_column : str
+        Column shown as the genre
+
+    Returns
+    -------
+    None
+    """
+    st.markdown(''.join(series_html(series, genre_column) for series in records), unsafe_allow_html=True)
+
+
+def start_results(key, fetch, page_size=PAGE_SIZE, max_results=None):
+    """
+    Start a new result list and fetch its first page
+
+    Parameters
+    ----------
+    key : str
+        Session state key of the list
+    fetch : callable
+        ``fetch(offset, limit)`` returns up to `limit` display records starting at
+        rank `offset`
+    page_size : int
+        Series per page
+    max_results : int, optional
+        Number of series after which no more pages are offered
+
+    Returns
+    -------
+    None
+    """
+    st.session_state[key] = {'fetch': fetch, 'page_size': page_size, 'max_results': max_results,
+                             'rows': [], 'complete': False, 'page': 0}
+    _fetch_page(st.session_state[key], 0)
+
+
+def _fetch_page(state, page):
+    """Fetch the rows of `page` and the one after it, unless they are already known."""
+    size = state['page_size']
+    stop = (page + 1) * size + 1
+    if state['max_results'] is not None:
+        stop = min(stop, state['max_results'])
+    if state['complete'] or len(state['rows']) >= stop:
+        return
+    offset = len(state['rows'])
+    fetched = state['fetch'](offset, stop - offset)
+    state['rows'] += fetched
+    # The service returned fewer rows than asked, or the cap was reached: nothing more to fetch
+    state['complete'] = len(fetched) < stop - offset or (state['max_results'] is not None
+                                                        and len(state['rows']) >= state['max_results'])
+
+
+def _turn_page(key, step):
+    state = st.session_state[key]
+    state['page'] += step
+    _fetch_page(state, state['page'])
+
+
+def has_results(key):
+    """Return whether the result list `key` exists and has rows."""
+    return bool(st.session_state.get(key, {}).get('rows'))
+
+
+def show_results(key, genre_column='Genre', on_more_like_this=None):
+    """
+    Draw the current page of a result list with its navigation
+
+    Parameters
+    ----------
+    key : str
+        Session state key of the list, see `start_results`
+    genre_column : str
+        Column shown as the genre
+    on_more_like_this : callable, optional
+        Called with the chosen series when "More like this" is clicked; no button
+        when None
+
+    Returns
+    -------
+    None
+    """
+    state = st.session_state.get(key)
+    if not state or not state['rows']:
+        return
+    size = state['page_size']
+    page = state['page']
+    records = state['rows'][page * size:(page + 1) * size]
+    render_page(records, genre_column)
+
+    more = len(state['rows']) > (page + 1) * size
+    if page > 0 or more:
+        previous, position, following = st.columns([1, 2, 1])
+        previous.button("Previous", key=f"{key}-previous", disabled=page == 0, on_click=_turn_page,
+                        args=(key, -1))
+        position.caption(f"Page {page + 1}")
+        following.button("Next", key=f"{key}-next", disabled=not more, on_click=_turn_page, args=(key, 1))
+
+    if on_more_like_this is not None:
+        choice = st.selectbox("More like this", range(len(records)), key=f"{key}-choice-{page}",
+                              format_func=lambda i: records[i]['Title'])
+        st.button("More like this", key=f"{key}-more", on_click=on_more_like_this, args=(records[choice],))
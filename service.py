@@ -0,0 +1,560 @@
+"""
+Local JSON API over the recommender, with micro-batched query encoding.
+
+The service runs on asyncio. Synopsis and Hybrid queries that arrive within a short window are
+merged into one batch before each call to the encoder, so concurrent users share
+encoder calls instead of encoding one query at a time. Every request has a deadline,
+and the service sheds load instead of queueing without bound: a request is rejected
+with 503 when too many are in flight or the encoder queue is full, and answered with
+504 when its deadline passes. A request answered with 504 keeps its in-flight slot
+until the recommender work it started in the executor has finished, and work still
+queued when the deadline passes never starts.
+
+Endpoints (all return JSON):
+
+    GET  /health     status and serving version
+    GET  /stats      request, batching and query cache counters
+    GET  /metrics    per-stage latency histograms, in the Prometheus text format
+    GET  /options    choices of the Top 10 and Moods pages
+    POST /search     {"query", "search_type", "min_rating", "offset", "limit"}
+    POST /top        {"genre", "subgenres", "n"}
+    POST /mood       {"mood", "n"}
+    POST /similar    {"imdb_id", "n"}
+
+POST bodies may also carry ``timeout_ms`` to shorten the default deadline.
+
+Every ``reload_interval_s`` seconds the service checks the ``CURRENT`` pointer of the
+artifacts and, when ``refresh.py`` or ``artifact.py`` published a new version, opens
+it in the background and swaps it in. Each request reads the serving data once when
+it starts, so the requests in flight during a swap finish on the previous version. Run
+``python service.py`` from the project root; the settings live in the ``service``
+section of ``config.yaml``. `ServiceClient` is the blocking client used by the app.
+"""
+import asyncio
+import contextvars
+import json
+import time
+import urllib.error
+import urllib.request
+from functools import partial
+
+import numpy as np
+
+from metrics import Metrics
+from recommender import DENSE_SEARCH_TYPES, SEARCH_TYPES, Recommender, load_encoder, load_serving, reload_serving
+from vector_index import connect_pinecone
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                500: 'Internal Server Error', 503: 'Service Unavailable', 504: 'Gateway Timeout'}
+# Largest request body accepted, in bytes
+MAX_BODY = 64 * 1024
+# Largest page of results returned by one request
+MAX_PAGE = 100
+
+
+class Overloaded(Exception):
+    """Raised when the service has no capacity left for a request."""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline passes before it is answered."""
+
+
+class _Slot:
+    """
+    In-flight slot of one request
+
+    Released once the request is answered and the executor work it started is done,
+    so requests that timed out still count while their work occupies a thread.
+    """
+
+    def __init__(self, service, deadline):
+        self.service = service
+        self.deadline = deadline
+        self.jobs = 0
+        self.answered = False
+
+    def start(self):
+        self.jobs += 1
+
+    def finish(self):
+        self.jobs -= 1
+        self._release()
+
+    def close(self):
+        self.answered = True
+        self._release()
+
+    def _release(self):
+        if self.answered and not self.jobs:
+            self.service.inflight -= 1
+            self.jobs = -1
+
+
+# Slot of the request handled by the current task and the tasks it starts
+_SLOT = contextvars.ContextVar('slot', default=None)
+
+
+class MicroBatcher:
+    """
+    Merge concurrent encoding requests into batches
+
+    The first queued query opens a window of `window_ms`; every query queued before
+    the window closes, up to `max_batch`, is encoded in the same call. Queries whose
+    deadline passed while they waited are dropped from the batch.
+
+    Parameters
+    ----------
+    encode_batch : callable
+        Called with a list of queries, returns one embedding per query; it runs in
+        the default executor so the event loop keeps serving
+    window_ms : float
+        How long a batch stays open for more queries
+    max_batch : int
+        Maximum number of queries per batch
+    max_pending : int
+        Maximum number of queued queries; more raise `Overloaded`
+    """
+
+    def __init__(self, encode_batch, window_ms=5, max_batch=32, max_pending=256):
+        self.encode_batch = encode_batch
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.batches = 0
+        self.encoded = 0
+        self.expired = 0
+
+    async def encode(self, query, deadline):
+        """
+        Queue `query` for the next batch and wait for its embedding
+
+        Parameters
+        ----------
+        query : str
+            The query to encode
+        deadline : float
+            Event loop time by which the embedding is needed
+
+        Returns
+        -------
+        numpy.ndarray
+            The query embedding
+        """
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((query, future, deadline))
+        except asyncio.QueueFull:
+            raise Overloaded('encoder queue is full') from None
+        return await future
+
+    async def _collect(self):
+        """Wait for a first query, then gather more until the window closes or the batch is full."""
+        loop = asyncio.get_running_loop()
+        items = [await self.queue.get()]
+        closes = loop.time() + self.window
+        while len(items) < self.max_batch:
+            if not self.queue.empty():
+                items.append(self.queue.get_nowait())
+                continue
+            remaining = closes - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def run(self):
+        """Encode batches until cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+            now = loop.time()
+            live = []
+            for query, future, deadline in items:
+                if future.done():
+                    continue
+                if deadline <= now:
+                    self.expired += 1
+                    future.set_exception(DeadlineExceeded('deadline passed before encoding'))
+                    continue
+                live.append((query, future))
+            if not live:
+                continue
+
+            try:
+                vectors = await loop.run_in_executor(None, self.encode_batch, [query for query, _ in live])
+            except Exception as error:
+                for _, future in live:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            self.batches += 1
+            self.encoded += len(live)
+            for (_, future), vector in zip(live, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+    def stats(self):
+        """Return the batching counters."""
+        return {'batches': self.batches,
+                'encoded': self.encoded,
+                'expired': self.expired,
+                'mean_batch_size': self.encoded / self.batches if self.batches else 0.0,
+                'pending': self.queue.qsize()}
+
+
+class RecommenderService:
+    """
+    asyncio HTTP server exposing a `Recommender` as JSON endpoints
+
+    Parameters
+    ----------
+    recommender : Recommender
+        The recommender to serve
+    timeout_ms : float
+        Default deadline of a request
+    max_inflight : int
+        Maximum number of requests handled at the same time; more get a 503
+    window_ms, max_batch, max_pending
+        See `MicroBatcher`
+    reload : callable, optional
+        Called with the serving data in use, returns the serving data of a newer
+        version or None; see `reload_serving`
+    reload_interval_s : float, optional
+        Seconds between two calls of `reload`; no reloads when None
+    """
+
+    def __init__(self, recommender, timeout_ms=2000, max_inflight=64, window_ms=5, max_batch=32,
+                 max_pending=256, reload=None, reload_interval_s=None):
+        self.recommender = recommender
+        self.timeout = timeout_ms / 1000
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.reload = reload
+        self.reload_interval = reload_interval_s
+        self.counts = {'requests': 0, 'rejected': 0, 'timeouts': 0, 'errors': 0, 'reloads': 0}
+        self.batcher = None
+        self.routes = {
+            ('GET', '/health'): self.health,
+            ('GET', '/stats'): self.stats,
+            ('GET', '/metrics'): self.metrics,
+            ('GET', '/options'): self.options,
+            ('POST', '/search'): self.search,
+            ('POST', '/top'): self.top,
+            ('POST', '/mood'): self.mood,
+            ('POST', '/similar'): self.similar,
+        }
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        """
+        Serve requests until cancelled
+
+        Parameters
+        ----------
+        host : str
+            Interface to listen on
+        port : int
+            Port to listen on
+
+        Returns
+        -------
+        None
+        """
+        self.batcher = MicroBatcher(self.recommender.encoder.encode_many, self.window_ms,
+                                    self.max_batch, self.max_pending)
+        tasks = [asyncio.create_task(self.batcher.run())]
+        if self.reload is not None and self.reload_interval:
+            tasks.append(asyncio.create_task(self._watch()))
+        server = await asyncio.start_server(self._handle, host, port)
+        print(f"Serving the recommender on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _watch(self):
+        """Swap in the serving data of every new artifact version until cancelled."""
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                serving = await self._run(self.reload, self.recommender.serving)
+            except Exception as error:
+                print(f"Reload failed, still serving {self.recommender.serving.version}: {error}")
+                continue
+            if serving is not None:
+                # A reference swap: requests already running keep the version they started with
+                self.recommender.serving = serving
+                self.counts['reloads'] += 1
+                print(f"Serving version {serving.version}, opened in {serving.open_seconds * 1000:.0f} ms.")
+
+    async def _run(self, function, *args):
+        """
+        Run blocking recommender code in the default executor
+
+        Work of a request is skipped when its deadline passed while it was queued, and
+        it holds the request's slot until it finishes even if the request timed out.
+        """
+        loop = asyncio.get_running_loop()
+        slot = _SLOT.get()
+        if slot is None:
+            return await loop.run_in_executor(None, partial(function, *args))
+
+        def work():
+            try:
+                # The event loop clock is time.monotonic
+                if time.monotonic() >= slot.deadline:
+                    raise DeadlineExceeded('deadline passed before the work started')
+                return function(*args)
+            finally:
+                loop.call_soon_threadsafe(slot.finish)
+
+        slot.start()
+        future = loop.run_in_executor(None, work)
+        # Not retrieved when the request timed out first
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        # Shielded so a timeout does not cancel queued work before it can release the slot
+        return await asyncio.shield(future)
+
+    async def health(self, body, deadline):
+        return {'status': 'ok', 'version': self.recommender.serving.version}
+
+    async def stats(self, body, deadline):
+        return dict(self.counts, inflight=self.inflight, batching=self.batcher.stats(),
+                    query_cache=self.recommender.encoder.stats())
+
+    async def metrics(self, body, deadline):
+        # Plain text, not JSON
+        return self.recommender.metrics.render()
+
+    async def options(self, body, deadline):
+        return self.recommender.options()
+
+    async def search(self, body, deadline):
+        query = str(body.get('query', '')).strip()
+        search_type = body.get('search_type', 'Title')
+        if not query or search_type not in SEARCH_TYPES:
+            raise ValueError(f"Expected a non-empty query and a search_type in {SEARCH_TYPES}")
+        min_rating = float(body.get('min_rating', 0.0))
+        offset = max(int(body.get('offset', 0)), 0)
+        limit = min(max(int(body.get('limit', 10)), 0), MAX_PAGE)
+        vector = keyword_positions = None
+        # Both halves of a Hybrid search must run on the same version of the serving data
+        serving = self.recommender.serving
+        with self.recommender.metrics.trace('search', query=query, search_type=search_type,
+                                            min_rating=min_rating) as trace:
+            if search_type == 'Hybrid':
+                # The keyword search runs while the query waits for its encoder batch
+                vector, keyword_positions = await asyncio.gather(
+                    self._encode(query, deadline, trace),
+                    self._run(self.recommender.keyword_search, query, min_rating, trace, serving))
+            elif search_type in DENSE_SEARCH_TYPES:
+                vector = await self._encode(query, deadline, trace)
+            results = await self._run(self.recommender.search, query, search_type, min_rating, vector,
+                                      keyword_positions, trace, offset, limit, serving)
+        return {'results': results}
+
+    async def _encode(self, query, deadline, trace):
+        """Encode the query in the next batch, timing the wait and the encoding as one stage."""
+        with trace.stage('encode'):
+            return await self.batcher.encode(query, deadline)
+
+    async def top(self, body, deadline):
+        results = await self._run(self.recommender.top_by_genre, body['genre'],
+                                  list(body.get('subgenres', [])), min(int(body.get('n', 10)), MAX_PAGE))
+        return {'results': results}
+
+    async def mood(self, body, deadline):
+        return await self._run(self.recommender.top_by_mood, body['mood'], min(int(body.get('n', 10)), MAX_PAGE))
+
+    async def similar(self, body, deadline):
+        # A row lookup in the precomputed table, cheap enough to answer on the event loop
+        return {'results': self.recommender.more_like_this(str(body['imdb_id']),
+                                                           min(int(body.get('n', 10)), MAX_PAGE))}
+
+    async def _handle(self, reader, writer):
+        """Answer one HTTP request on the connection, then close it."""
+        try:
+            status, payload = await self._respond(reader)
+        except Exception as error:
+            status, payload = 500, {'error': str(error)}
+        if isinstance(payload, str):
+            body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body, content_type = json.dumps(payload, default=_json_default).encode('utf-8'), 'application/json'
+        writer.write(f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                     f"Content-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode('ascii') + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _respond(self, reader):
+        """Parse the request, apply backpressure and the deadline, and dispatch it."""
+        try:
+            method, path, headers = await _read_head(reader)
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY:
+                return 400, {'error': 'request body too large'}
+            body = json.loads(await reader.readexactly(length)) if length else {}
+        except (ValueError, asyncio.IncompleteReadError) as error:
+            return 400, {'error': f"malformed request: {error}"}
+        if not isinstance(body, dict):
+            return 400, {'error': 'the request body must be a JSON object'}
+
+        handler = self.routes.get((method, path))
+        if handler is None:
+            known = any(route_path == path for _, route_path in self.routes)
+            return (405, {'error': 'method not allowed'}) if known else (404, {'error': 'not found'})
+
+        self.counts['requests'] += 1
+        if self.inflight >= self.max_inflight:
+            self.counts['rejected'] += 1
+            return 503, {'error': 'too many requests in flight'}
+        timeout = min(self.timeout, float(body.get('timeout_ms', self.timeout * 1000)) / 1000)
+        deadline = asyncio.get_running_loop().time() + timeout
+        self.inflight += 1
+        slot = _Slot(self, deadline)
+        _SLOT.set(slot)
+        try:
+            return 200, await asyncio.wait_for(handler(body, deadline), timeout)
+        except (asyncio.TimeoutError, DeadlineExceeded):
+            self.counts['timeouts'] += 1
+            return 504, {'error': 'deadline exceeded'}
+        except Overloaded as error:
+            self.counts['rejected'] += 1
+            return 503, {'error': str(error)}
+        except (KeyError, TypeError, ValueError) as error:
+            return 400, {'error': f"bad request: {error}"}
+        except Exception as error:
+            self.counts['errors'] += 1
+            return 500, {'error': str(error)}
+        finally:
+            slot.close()
+
+
+async def _read_head(reader):
+    """Read the request line and headers of an HTTP request."""
+    request_line = (await reader.readline()).decode('latin-1').strip()
+    method, path, _ = request_line.split(' ', 2)
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return method.upper(), path.split('?', 1)[0], headers
+
+
+def _json_default(value):
+    """Convert the NumPy values left in records to JSON."""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class ServiceClient:
+    """
+    Blocking client of the recommender service
+
+    Parameters
+    ----------
+    url : str
+        Base URL of the service, e.g. ``http://127.0.0.1:8765``
+    timeout : float
+        Seconds to wait for an answer
+    """
+
+    def __init__(self, url, timeout=5.0):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _call(self, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode('utf-8')
+        request = urllib.request.Request(self.url + path, data=data,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as error:
+            try:
+                message = json.load(error).get('error', error.reason)
+            except (ValueError, AttributeError):
+                # Empty or non-JSON body, e.g. from a proxy in front of the service
+                message = error.reason
+            raise RuntimeError(f"Recommender service answered {error.code}: {message}") from None
+        except (urllib.error.URLError, TimeoutError, ConnectionError) as error:
+            reason = getattr(error, 'reason', error)
+            raise RuntimeError(f"Recommender service unreachable at {self.url}: {reason}") from None
+
+    def search(self, query, search_type, min_rating, offset=0, limit=10):
+        """Search by title, cast or synopsis, one page at a time, see `Recommender.search`."""
+        return self._call('/search', {'query': query, 'search_type': search_type, 'min_rating': min_rating,
+                                      'offset': offset, 'limit': limit})['results']
+
+    def top(self, genre, subgenres=(), n=10):
+        """Best rated series of a genre, see `Recommender.top_by_genre`."""
+        return self._call('/top', {'genre': genre, 'subgenres': list(subgenres), 'n': n})['results']
+
+    def mood(self, mood, n=10):
+        """Best rated series of a mood, see `Recommender.top_by_mood`."""
+        return self._call('/mood', {'mood': mood, 'n': n})
+
+    def similar(self, imdb_id, n=10):
+        """Series most similar to a series, see `Recommender.more_like_this`."""
+        return self._call('/similar', {'imdb_id': imdb_id, 'n': n})['results']
+
+    def options(self):
+        """Choices of the Top 10 and Moods pages, see `Recommender.options`."""
+        return self._call('/options')
+
+
+def main():
+    import os
+
+    from dotenv import load_dotenv
+
+    from settings import load_config
+
+    load_dotenv()
+    config = load_config()
+    settings = config['service']
+
+    # Connect to Pinecone only when it is the selected vector index
+    pinecone_client = None
+    if config['vector_index']['backend'] == 'pinecone':
+        pinecone_client = connect_pinecone(os.getenv("key"))
+
+    start = time.perf_counter()
+    recommender = Recommender(load_serving(config, pinecone_client), load_encoder(config),
+                              cast_limit=config['search']['cast_limit'],
+                              max_results=config['search'].get('max_results', 50),
+                              hybrid_candidates=config['search'].get('hybrid_candidates', 50),
+                              rrf_k=config['search'].get('rrf_k', 60),
+                              metrics=Metrics.from_config(config.get('metrics')))
+    print(f"Recommender ready in {time.perf_counter() - start:.1f}s.")
+    service = RecommenderService(recommender,
+                                 timeout_ms=settings['timeout_ms'],
+                                 max_inflight=settings['max_inflight'],
+                                 window_ms=settings['batch_window_ms'],
+                                 max_batch=settings['max_batch'],
+                                 max_pending=settings['max_pending'],
+                                 reload=partial(reload_serving, config, pinecone_client=pinecone_client),
+                                 reload_interval_s=settings.get('reload_interval_s'))
+    asyncio.run(service.serve(settings['host'], settings['port']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+import yaml
+
+
+def load_config(path='config.yaml'):
+    """
+    Load the project configuration from a YAML file
+
+    Parameters
+    ----------
+    path : str
+        Path to the YAML configuration file
+
+    Returns
+    -------
+    dict
+        The parsed configuration
+    """
+    with open(path, encoding='utf-8') as f:
+        return yaml.safe_load(f)
@@ -0,0 +1,109 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'notebooks'))
+from functions import drop_near_duplicates, near_duplicates  # noqa: E402
+
+UP = ('Director Michael Apted interviews the same group of British-born adults after a seven-year wait as to '
+      'the changes that have occurred in their lives during the last seven years.')
+UP_CAST = ('Director:, Michael Apted, | ,     Stars:, Bruce Balden, , Jacqueline Bassett, , Symon Basterfield, '
+           ', Andrew Brackfield')
+SUPERMAN = ('Superman agrees to sacrifice his powers to start a relationship with Lois Lane, unaware that three '
+            'Kryptonian criminals he inadvertently released are conquering Earth.')
+RIGBY = ('Told from the {} perspective, the story of a couple trying to reclaim the life and love they once knew '
+         'and pick up the pieces of a past that may be too far gone.')
+TRAILER_PARK = '{} petty felons have a documentary made about their life in a trailer park.'
+RAAVAN = 'A bandit leader kidnaps the wife of the policeman who killed his sister, but later falls in love with her.'
+OZ = ('Dorothy Gale discovers that her best selling novels are actually based on suppressed childhood memories '
+      'of her time in Oz, and that she may be in danger of experiencing it all over again.')
+RESIDUE = ('The government cover-up of the causes behind a massive explosion in a futuristic UK metropolis spur '
+           'photo journalist Jennifer Preston on to search for the truth and in the process blow open a '
+           'paranormal phenomenon haunting the city.')
+
+# Sequels, cuts, film and series, and language versions that share a synopsis, then two true duplicates,
+# the second one under another title
+ROWS = [
+    ('28 Up', 'tt0088650', '1984 TV Movie', UP_CAST, UP, 2986),
+    ('21 Up', 'tt0075610', '1977 TV Movie', UP_CAST, UP, 2819),
+    ('7 Plus Seven', 'tt0066356', '1970 TV Movie', UP_CAST,
+     'Director Michael Apted revisits the same group of British-born children after a seven-year wait. The '
+     'subjects are interviewed as to the changes that have occurred in their lives during the last seven years.',
+     3115),
+    ('Superman II', 'tt0081573', '1980',
+     'Directors:, Richard Lester, , Richard Donner, | ,     Stars:, Gene Hackman, , Christopher Reeve, '
+     ', Margot Kidder, , Ned Beatty', SUPERMAN, 110948),
+    ('Superman II: The Richard Donner Cut', 'tt0839995', '2006',
+     'Directors:, Richard Donner, , Richard Lester, | ,     Stars:, Gene Hackman, , Christopher Reeve, '
+     ', Marlon Brando, , Ned Beatty', SUPERMAN, 17970),
+    ('The Disappearance of Eleanor Rigby: Him', 'tt1531924', '2013',
+     'Director:, Ned Benson, | ,     Stars:, James McAvoy, , Jessica Chastain, , Nina Arianda, , Viola Davis',
+     RIGBY.format('male'), 10112),
+    ('The Disappearance of Eleanor Rigby: Her', 'tt3720788', '2013',
+     'Director:, Ned Benson, | ,     Stars:, Jessica Chastain, , James McAvoy, , Nina Arianda, , Viola Davis',
+     RIGBY.format('female'), 9529),
+    ('Trailer Park Boys', 'tt0290988', '2001–2018',
+     'Stars:, John Paul Tremblay, , Robb Wells, , Mike Smith, , John Dunsworth', TRAILER_PARK.format('Three'),
+     46927),
+    ('Trailer Park Boys', 'tt0383678', '1999',
+     'Director:, Mike Clattenburg, | ,     Stars:, John Paul Tremblay, , Robb Wells, , Lucy Decoutere, '
+     ', Jeanna Harrison', TRAILER_PARK.format('Two'), 3851),
+    ('Raavan', 'tt1334470', '2010',
+     'Director:, Mani Ratnam, | ,     Stars:, Abhishek Bachchan, , Aishwarya Rai Bachchan, , Govinda, , Vikram',
+     RAAVAN, 4639),
+    ('Raavanan', 'tt1664806', '2010',
+     'Director:, Mani Ratnam, | ,     Stars:, Vikram, , Aishwarya Rai Bachchan, , Prithviraj Sukumaran, '
+     ', Priyamani', RAAVAN, 4360),
+    ('Residue', 'tt4568372', '2015',
+     'Stars:, Natalia Tena, , Iwan Rheon, , Jamie Draven, , Danny Webb', RESIDUE, 2632),
+    ('Residue', 'tt3328442', '2015',
+     'Director:, Alex Garcia Lopez, | ,     Stars:, Natalia Tena, , Iwan Rheon, , Jamie Draven, , Danny Webb',
+     RESIDUE, 2307),
+    ('The Witches of Oz', 'tt1592287', '2011– ',
+     'Stars:, Paulie Rojas, , Eliza Swenson, , Billy Boyd, , Lance Henriksen', OZ, 1961),
+    ('Dorothy and the Witches of Oz', 'tt2342071', '2011',
+     'Director:, Leigh Scott, | ,     Stars:, Paulie Rojas, , Eliza Swenson, , Billy Boyd, , Christopher Lloyd',
+     OZ, 485),
+]
+
+
+@pytest.fixture
+def catalog():
+    return pd.DataFrame(ROWS, columns=['Title', 'IMDb ID', 'Release Year', 'Cast', 'Synopsis', 'Number of Votes'])
+
+
+def test_only_the_true_duplicates_are_dropped(catalog):
+    canonical = near_duplicates(catalog)
+    dropped = canonical[canonical != catalog['IMDb ID']]
+    assert dropped.to_dict() == {12: 'tt4568372', 14: 'tt1592287'}
+
+
+def test_drop_keeps_sequels_and_cuts(catalog):
+    kept = drop_near_duplicates(catalog)
+    assert list(kept['IMDb ID']) == list(catalog['IMDb ID'].drop([12, 14]))
+
+
+def test_cast_names_are_reused(catalog):
+    # Names that share nothing, so no pair passes the cast check
+    names = catalog.assign(**{'Cast Names': [f'person {i}' for i in range(len(catalog))]})
+    assert (near_duplicates(names) == catalog['IMDb ID']).all()
+
+
+def test_duplicates_are_not_chained(catalog):
+    # A third listing whose cast only matches the dropped row stays in the catalog
+    extra = catalog.iloc[[12]].assign(**{
+        'IMDb ID': 'tt0000001', 'Number of Votes': 10,
+        'Cast': 'Director:, Alex Garcia Lopez, | ,     Stars:, Natalia Tena, , Jane Doe, , John Doe'})
+    canonical = near_duplicates(pd.concat([catalog, extra], ignore_index=True))
+    assert canonical[12] == 'tt4568372'
+    assert canonical[15] == 'tt0000001'
+    assert near_duplicates(pd.concat([catalog.drop(index=11), extra], ignore_index=True))[14] == 'tt3328442'
+
+
+def test_changed_restricts_the_pairs(catalog):
+    canonical = near_duplicates(catalog, changed=['tt0290988'])
+    assert (canonical == catalog['IMDb ID']).all()
+    canonical = near_duplicates(catalog, changed=['tt3328442'])
+    assert canonical[12] == 'tt4568372'
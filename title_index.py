@@ -0,0 +1,301 @@
+"""
+Lexical index for the Title search.
+
+Titles are normalized once and indexed three ways: sorted whole titles for prefix
+ranges, a word index for titles where every query word starts a title word, and a
+character trigram index that finds candidates for typo-tolerant matching. Results are
+ranked by match quality and then by `Number of Votes`.
+"""
+import os
+import re
+import unicodedata
+
+import numpy as np
+
+from cast_index import PostingLists
+
+# Whole titles are kept up to this many characters, enough for any prefix typed
+TITLE_WIDTH = 64
+# Trigram candidates verified with the edit distance
+FUZZY_CANDIDATES = 50
+# Rarest query trigrams whose postings are counted to pick the candidates
+FUZZY_TRIGRAMS = 8
+# Query characters compared by the edit distance, longer queries are cut
+FUZZY_QUERY_LENGTH = 16
+# Trigrams found in more than this share of the titles are too common to pick candidates
+COMMON_TRIGRAM_SHARE = 0.05
+
+
+def normalize_titles(titles):
+    """
+    Normalize titles for lexical search
+
+    Parameters
+    ----------
+    titles : pandas.Series
+        The `Title` column
+
+    Returns
+    -------
+    pandas.Series
+        The titles without accents or punctuation, lowercased and with single spaces
+    """
+    return (titles.fillna('').str.normalize('NFKD')
+            .str.encode('ascii', errors='ignore').str.decode('ascii')
+            .str.lower()
+            .str.replace(r'[^a-z0-9 ]+', ' ', regex=True)
+            .str.replace(r'\s+', ' ', regex=True)
+            .str.strip())
+
+
+def normalize_title_query(query):
+    """
+    Normalize a query the same way `normalize_titles` normalizes titles
+
+    Parameters
+    ----------
+    query : str
+        The query
+
+    Returns
+    -------
+    str
+        The normalized query
+    """
+    query = unicodedata.normalize('NFKD', query).encode('ascii', errors='ignore').decode('ascii')
+    query = re.sub(r'[^a-z0-9 ]+', ' ', query.lower())
+    return re.sub(r'\s+', ' ', query).strip()
+
+
+def trigrams(text):
+    """
+    Return the character trigrams of every word of `text`, padded with spaces
+
+    Parameters
+    ----------
+    text : str
+        Normalized text
+
+    Returns
+    -------
+    list of str
+        The trigrams, with repetitions
+    """
+    grams = []
+    for word in text.split(' '):
+        padded = f"  {word} "
+        grams.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def prefix_distances(query, titles, limit):
+    """
+    Edit distance between `query` and the closest prefix of each title
+
+    The Levenshtein table is filled one query character at a time for all titles at
+    once. Within a row, the insertion chain ``D[j] = min(D[j], D[j - 1] + 1)`` is a
+    running minimum of ``D[j] - j``, so it needs no loop over the title characters.
+
+    Parameters
+    ----------
+    query : str
+        The normalized query
+    titles : numpy.ndarray
+        Normalized titles as fixed-width ASCII bytes
+    limit : int
+        Distances above `limit` are reported as ``limit + 1``
+
+    Returns
+    -------
+    numpy.ndarray
+        The smallest distance between `query` and any prefix of each title
+    """
+    # Prefixes longer than the query plus `limit` insertions can never be close enough
+    width = min(len(query) + limit, titles.dtype.itemsize)
+    chars = np.frombuffer(np.ascontiguousarray(titles).tobytes(), dtype=np.uint8)
+    chars = chars.reshape(len(titles), titles.dtype.itemsize)[:, :width].astype(np.int16)
+    columns = np.arange(width + 1, dtype=np.int16)
+    previous = np.broadcast_to(columns, (len(titles), width + 1))
+    for i, char in enumerate(query.encode('ascii'), 1):
+        current = np.empty_like(previous)
+        current[:, 0] = i
+        np.minimum(previous[:, 1:] + 1, previous[:, :-1] + (chars != char), out=current[:, 1:])
+        current = np.minimum.accumulate(current - columns, axis=1) + columns
+        previous = current
+        if previous.min() > limit:
+            break
+    return np.minimum(previous.min(axis=1), limit + 1)
+
+
+class TitleIndex:
+    """
+    Prefix, word and trigram index over the normalized titles
+
+    Parameters
+    ----------
+    titles : pandas.Series
+        The `Title` column
+    ratings : array-like of float
+        The `Rating` of every row, used to filter results
+    votes : array-like of float
+        The `Number of Votes` of every row, used to filter and rank results
+
+    Without `titles` an empty index is created, to be filled by `load`.
+    """
+
+    def __init__(self, titles=None, ratings=None, votes=None):
+        if titles is None:
+            return
+        normalized = normalize_titles(titles.reset_index(drop=True))
+        self.titles = normalized.str.slice(0, TITLE_WIDTH).to_numpy(dtype=f"S{TITLE_WIDTH}")
+        self.sorted_rows = np.argsort(self.titles, kind='stable').astype(np.int32)
+        self.sorted_titles = self.titles[self.sorted_rows]
+
+        words = normalized.str.split(' ').explode()
+        words = words[words != '']
+        self.words = PostingLists(words, words.index)
+        grams = normalized.map(trigrams).explode().dropna()
+        self.trigrams = PostingLists(grams, grams.index)
+
+        self.ratings = np.asarray(ratings, dtype=np.float32)
+        self.votes = np.asarray(votes, dtype=np.float64)
+
+    def save(self, directory):
+        """
+        Save the index so it can be memory-mapped with `load`
+
+        Parameters
+        ----------
+        directory : str
+            Target directory
+
+        Returns
+        -------
+        None
+        """
+        np.save(os.path.join(directory, 'title_titles.npy'), self.titles)
+        np.save(os.path.join(directory, 'title_sorted_rows.npy'), self.sorted_rows)
+        np.save(os.path.join(directory, 'title_sorted_titles.npy'), self.sorted_titles)
+        self.words.save(directory, 'title_words')
+        self.trigrams.save(directory, 'title_trigrams')
+
+    @classmethod
+    def load(cls, directory, ratings, votes):
+        """
+        Memory-map an index saved with `save`
+
+        Parameters
+        ----------
+        directory : str
+            Source directory
+        ratings, votes : array-like of float
+            See `TitleIndex`
+
+        Returns
+        -------
+        TitleIndex
+            The loaded index
+        """
+        index = cls()
+        index.titles = np.asarray(np.load(os.path.join(directory, 'title_titles.npy'), mmap_mode='r'))
+        index.sorted_rows = np.asarray(np.load(os.path.join(directory, 'title_sorted_rows.npy'), mmap_mode='r'))
+        index.sorted_titles = np.asarray(np.load(os.path.join(directory, 'title_sorted_titles.npy'),
+                                                 mmap_mode='r'))
+        index.words = PostingLists.load(directory, 'title_words')
+        index.trigrams = PostingLists.load(directory, 'title_trigrams')
+        index.ratings = np.asarray(ratings, dtype=np.float32)
+        index.votes = np.asarray(votes, dtype=np.float64)
+        return index
+
+    def _allowed(self, rows, min_rating, min_votes):
+        return rows[(self.ratings[rows] >= min_rating) & (self.votes[rows] >= min_votes)]
+
+    def _most_voted(self, rows, limit):
+        """Return up to `limit` of `rows`, most voted first."""
+        if len(rows) > limit:
+            rows = rows[np.argpartition(-self.votes[rows], limit - 1)[:limit]]
+        return rows[np.argsort(-self.votes[rows], kind='stable')]
+
+    def search(self, query, min_rating=0.0, min_votes=0, limit=10):
+        """
+        Find the titles matching `query`, tolerating typos
+
+        Matches are ranked in tiers: exact title, title starting with the query, titles
+        where every query word starts a title word, and finally titles within a small
+        edit distance of the query. Within a tier the most voted series come first.
+        Typo-tolerant matching only runs when the exact tiers find nothing, and only
+        compares the first `FUZZY_QUERY_LENGTH` characters of the query.
+
+        Parameters
+        ----------
+        query : str
+            A full or partial title
+        min_rating : float
+            Minimum rating of the returned rows
+        min_votes : float
+            Minimum number of votes of the returned rows
+        limit : int
+            Maximum number of rows returned
+
+        Returns
+        -------
+        numpy.ndarray
+            The matching row positions, best first
+        """
+        query = normalize_title_query(query)
+        if not query:
+            return np.empty(0, dtype=np.int32)
+        key = query[:TITLE_WIDTH].encode('ascii')
+
+        # Titles starting with the query form one range of the sorted titles
+        lo = np.searchsorted(self.sorted_titles, key, side='left')
+        # A bound wider than the titles would make searchsorted widen the whole array
+        hi = np.searchsorted(self.sorted_titles, key + b'\xff', side='left') if len(key) < TITLE_WIDTH \
+            else np.searchsorted(self.sorted_titles, key, side='right')
+        prefixed = self._allowed(np.asarray(self.sorted_rows[lo:hi]), min_rating, min_votes)
+        exact = prefixed[self.titles[prefixed] == key]
+        results = [self._most_voted(exact, limit),
+                   self._most_voted(np.setdiff1d(prefixed, exact, assume_unique=True), limit)]
+        found = sum(len(rows) for rows in results)
+
+        if found < limit:
+            # Finished words must match exactly, the word being typed is a prefix
+            # Shortest lists first, the prefix of the typed word last, stopping once empty
+            *complete, typing = query.split(' ')
+            rows = None
+            for postings in sorted((self.words.exact(word) for word in set(complete)), key=len):
+                rows = postings if rows is None else np.intersect1d(rows, postings, assume_unique=True)
+                if not len(rows):
+                    break
+            if rows is None or len(rows):
+                typed = self.words.prefix(typing)
+                rows = typed if rows is None else np.intersect1d(rows, typed, assume_unique=True)
+            rows = self._allowed(np.setdiff1d(rows, prefixed, assume_unique=True), min_rating, min_votes)
+            results.append(self._most_voted(rows, limit - found))
+            found += len(results[-1])
+
+        if not found:
+            results.append(self._fuzzy(query[:FUZZY_QUERY_LENGTH].strip(), min_rating, min_votes, limit))
+
+        return np.concatenate(results).astype(np.int32)[:limit]
+
+    def _fuzzy(self, query, min_rating, min_votes, limit):
+        """Rank the titles sharing the most trigrams with `query` by prefix edit distance."""
+        postings = [self.trigrams.exact(gram) for gram in set(trigrams(query))]
+        postings = [rows for rows in postings if len(rows)]
+        rare = [rows for rows in postings if len(rows) <= COMMON_TRIGRAM_SHARE * len(self.titles)]
+        postings = sorted(rare or postings, key=len)[:FUZZY_TRIGRAMS]
+        if not postings:
+            return np.empty(0, dtype=np.int32)
+        rows, counts = np.unique(np.concatenate(postings), return_counts=True)
+        allowed = (self.ratings[rows] >= min_rating) & (self.votes[rows] >= min_votes)
+        rows, counts = rows[allowed], counts[allowed]
+        if len(rows) > FUZZY_CANDIDATES:
+            rows = rows[np.argpartition(-counts, FUZZY_CANDIDATES - 1)[:FUZZY_CANDIDATES]]
+
+        max_distance = 1 if len(query) <= 4 else 2 if len(query) <= 8 else 3
+        distances = prefix_distances(query, np.asarray(self.titles[rows]), max_distance)
+        close = distances <= max_distance
+        rows, distances = rows[close], distances[close]
+        order = np.lexsort((-self.votes[rows], distances))
+        return rows[order[:limit]]
@@ -0,0 +1,590 @@
+"""
+Vector index backends for the series recommender.
+
+Every backend answers ``query(vector=..., top_k=...)`` with the same response shape
+as a Pinecone index (``{'matches': [{'id': ..., 'score': ...}]}``), so the search code
+does not need to know which one is serving. Scores follow the euclidean metric of the
+Pinecone index created in ``pinecone_setup.ipynb``: the squared euclidean distance,
+lower is more similar.
+"""
+import os
+
+import numpy as np
+
+EMBEDDING_DIM = 384
+VECTORS_FILE = 'embeddings.npy'
+IDS_FILE = 'ids.npy'
+NORMS_FILE = 'norms.npy'
+METADATA_FILE = 'metadata.npz'
+METADATA_COLUMNS = ['Rating', 'Number of Votes', 'Main Genre', 'Mood']
+IVF_CENTROIDS_FILE = 'ivf_centroids.npy'
+IVF_ORDER_FILE = 'ivf_order.npy'
+IVF_OFFSETS_FILE = 'ivf_offsets.npy'
+QUANTIZED_FILES = {'float16': 'embeddings_float16.npy', 'int8': 'embeddings_int8.npy'}
+INT8_SCALE_FILE = 'embeddings_int8_scale.npy'
+# Rows scored at once on quantized vectors; the float32 copy of a block stays in cache
+QUANTIZED_BLOCK = 1024
+
+
+def save_embeddings(directory, ids, vectors, metadata=None):
+    """
+    Save an embedding matrix and its IMDb IDs so a LocalIndex can memory-map them
+
+    Parameters
+    ----------
+    directory : str
+        Directory where the files are written
+    ids : sequence of str
+        The IMDb ID of each row of `vectors`
+    vectors : array-like of shape (n, 384)
+        The embedding matrix
+    metadata : pandas.DataFrame, optional
+        Columns stored with every vector and usable in query filters
+
+    Returns
+    -------
+    None
+    """
+    os.makedirs(directory, exist_ok=True)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    np.save(os.path.join(directory, VECTORS_FILE), vectors)
+    np.save(os.path.join(directory, IDS_FILE), np.asarray(ids, dtype=str))
+    # Squared norms are saved too so opening the index does not need a pass over the matrix
+    np.save(os.path.join(directory, NORMS_FILE), np.einsum('ij,ij->i', vectors, vectors))
+    if metadata is not None:
+        columns = {}
+        for column in metadata.columns:
+            values = metadata[column].to_numpy()
+            # Strings are stored as fixed-width unicode so they load without pickle
+            columns[column] = values.astype(str) if values.dtype == object else values
+        np.savez(os.path.join(directory, METADATA_FILE), **columns)
+
+
+def load_embeddings(directory, mmap=True):
+    """
+    Load an embedding matrix and its IMDb IDs saved with `save_embeddings`
+
+    Parameters
+    ----------
+    directory : str
+        Directory containing the files
+    mmap : bool
+        Whether to memory-map the embedding matrix instead of reading it into memory
+
+    Returns
+    -------
+    tuple of (numpy.ndarray, numpy.ndarray, dict)
+        The IDs, the embedding matrix and the metadata columns
+    """
+    vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode='r' if mmap else None)
+    ids = np.load(os.path.join(directory, IDS_FILE))
+    metadata = {}
+    if os.path.exists(os.path.join(directory, METADATA_FILE)):
+        with np.load(os.path.join(directory, METADATA_FILE)) as columns:
+            metadata = {column: columns[column] for column in columns.files}
+    return ids, vectors, metadata
+
+
+def quantize(vectors, mode):
+    """
+    Quantize an embedding matrix to float16, or to int8 with one scale per dimension
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        The float32 embedding matrix
+    mode : str
+        ``'float16'`` or ``'int8'``
+
+    Returns
+    -------
+    tuple of (numpy.ndarray, numpy.ndarray or None)
+        The quantized matrix and, for int8, the scale of every dimension: a row is
+        approximated by ``codes * scale``
+    """
+    if mode == 'float16':
+        return np.asarray(vectors, dtype=np.float16), None
+    if mode == 'int8':
+        codes = np.empty(vectors.shape, dtype=np.int8)
+        # Symmetric per-dimension scale, so the largest magnitude maps to 127
+        scale = np.zeros(vectors.shape[1], dtype=np.float32)
+        for start in range(0, len(vectors), 65536):
+            block = np.asarray(vectors[start:start + 65536], dtype=np.float32)
+            np.maximum(scale, np.abs(block).max(axis=0), out=scale)
+        scale = np.where(scale > 0, scale / 127, 1).astype(np.float32)
+        for start in range(0, len(vectors), 65536):
+            block = np.asarray(vectors[start:start + 65536], dtype=np.float32)
+            codes[start:start + 65536] = np.clip(np.rint(block / scale), -127, 127)
+        return codes, scale
+    raise ValueError(f"Unknown quantization: {mode!r}, expected one of {list(QUANTIZED_FILES)}")
+
+
+def save_quantized(directory, vectors, mode):
+    """
+    Save a quantized copy of the embedding matrix next to it
+
+    Parameters
+    ----------
+    directory : str
+        Directory containing the embeddings
+    vectors : numpy.ndarray
+        The float32 embedding matrix
+    mode : str
+        ``'float16'`` or ``'int8'``
+
+    Returns
+    -------
+    None
+    """
+    codes, scale = quantize(vectors, mode)
+    np.save(os.path.join(directory, QUANTIZED_FILES[mode]), codes)
+    if scale is not None:
+        np.save(os.path.join(directory, INT8_SCALE_FILE), scale)
+
+
+def load_quantized(directory, mode):
+    """
+    Memory-map a quantized matrix saved with `save_quantized`
+
+    Parameters
+    ----------
+    directory : str
+        Directory containing the embeddings
+    mode : str
+        ``'float16'`` or ``'int8'``
+
+    Returns
+    -------
+    tuple of (numpy.ndarray, numpy.ndarray or None) or None
+        The output of `quantize`, None when it was not saved
+    """
+    path = os.path.join(directory, QUANTIZED_FILES[mode])
+    if not os.path.exists(path):
+        return None
+    scale = np.load(os.path.join(directory, INT8_SCALE_FILE)) if mode == 'int8' else None
+    return np.load(path, mmap_mode='r'), scale
+
+
+def quantization_report(vectors, mode, rescore=4, top_k=10, sample=500, seed=0):
+    """
+    Measure the memory saved by a quantization mode and its recall against exact search
+
+    A random sample of the rows is used as queries. Recall@`top_k` is the share of the
+    exact `top_k` neighbours of a query that the quantized search, with rescoring of
+    ``top_k * rescore`` candidates, also returns.
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        The float32 embedding matrix
+    mode : str
+        ``'float16'`` or ``'int8'``
+    rescore : int
+        Shortlist size, as a multiple of `top_k`, rescored in full precision
+    top_k : int
+        Number of neighbours compared
+    sample : int
+        Number of queries
+    seed : int
+        Seed of the query sample
+
+    Returns
+    -------
+    dict
+        Bytes of the float32 and quantized matrices, bytes saved and recall
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    ids = np.arange(len(vectors)).astype(str)
+    exact = LocalIndex(ids, vectors)
+    approximate = LocalIndex(ids, vectors, quantized=quantize(vectors, mode), rescore=rescore)
+    queries = np.random.default_rng(seed).choice(len(vectors), size=min(sample, len(vectors)), replace=False)
+
+    found = 0
+    for query in queries:
+        expected = {match['id'] for match in exact.query(vectors[query], top_k=top_k)['matches']}
+        returned = {match['id'] for match in approximate.query(vectors[query], top_k=top_k)['matches']}
+        found += len(expected & returned)
+    quantized_bytes = approximate.quantized[0].nbytes + (0 if approximate.quantized[1] is None
+                                                          else approximate.quantized[1].nbytes)
+    report = {
+        'mode': mode,
+        'float32_bytes': vectors.nbytes,
+        'quantized_bytes': quantized_bytes,
+        'saved_bytes': vectors.nbytes - quantized_bytes,
+        'recall': found / (len(queries) * min(top_k, len(vectors))) if len(queries) else 1.0,
+    }
+    print(f"{mode}: {quantized_bytes / 2**20:.1f} MiB instead of {vectors.nbytes / 2**20:.1f} MiB "
+          f"({report['saved_bytes'] / 2**20:.1f} MiB saved), recall@{top_k} {report['recall']:.3f} "
+          f"with {top_k * rescore} rescored candidates.")
+    return report
+
+
+def filter_mask(metadata, filter):
+    """
+    Evaluate a Pinecone metadata filter over the metadata columns
+
+    Supports the same syntax as Pinecone: ``{'Rating': {'$gte': 7}}``, bare values as
+    ``$eq``, the ``$eq``, ``$ne``, ``$gt``, ``$gte``, ``$lt``, ``$lte``, ``$in`` and ``$nin``
+    operators, and ``$and`` / ``$or`` lists. Several fields in one dict are combined
+    with AND.
+
+    Parameters
+    ----------
+    metadata : dict of str to numpy.ndarray
+        The metadata columns
+    filter : dict
+        The filter
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask of the rows that pass the filter
+    """
+    mask = None
+    for field, condition in filter.items():
+        if field == '$and':
+            result = np.logical_and.reduce([filter_mask(metadata, part) for part in condition])
+        elif field == '$or':
+            result = np.logical_or.reduce([filter_mask(metadata, part) for part in condition])
+        else:
+            if field not in metadata:
+                raise KeyError(f"Cannot filter on {field!r}, it is not stored as vector metadata")
+            column = metadata[field]
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            result = np.ones(len(column), dtype=bool)
+            for operator, value in condition.items():
+                result &= _OPERATORS[operator](column, value)
+        mask = result if mask is None else mask & result
+    return mask
+
+
+_OPERATORS = {
+    '$eq': lambda column, value: column == value,
+    '$ne': lambda column, value: column != value,
+    '$gt': lambda column, value: column > value,
+    '$gte': lambda column, value: column >= value,
+    '$lt': lambda column, value: column < value,
+    '$lte': lambda column, value: column <= value,
+    '$in': lambda column, value: np.isin(column, value),
+    '$nin': lambda column, value: ~np.isin(column, value),
+}
+
+
+def build_ivf(vectors, nlist=256, iterations=10, sample_size=50000, seed=0):
+    """
+    Partition the embedding matrix into `nlist` inverted lists with k-means
+
+    The centroids are trained on a random sample of the rows and every row is then
+    assigned to its nearest centroid. The inverted lists are stored CSR-style: `order`
+    holds the row numbers grouped by list and `offsets[i]:offsets[i + 1]` is the slice
+    of `order` that belongs to list `i`.
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        The embedding matrix
+    nlist : int
+        Number of inverted lists
+    iterations : int
+        Number of k-means iterations
+    sample_size : int
+        Number of rows used to train the centroids
+    seed : int
+        Seed for the random sample and the initial centroids
+
+    Returns
+    -------
+    tuple of (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        The centroids, the grouped row order and the list offsets
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    nlist = max(1, min(nlist, n))
+    sample = np.asarray(vectors[np.sort(rng.choice(n, size=min(sample_size, n), replace=False))],
+                        dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = _nearest_centroid(sample, centroids)
+        # Move each centroid to the mean of its rows, empty lists keep their centroid
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=nlist)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+
+    # Assign every row in blocks so the full matrix is never copied at once
+    assignment = np.concatenate([
+        _nearest_centroid(np.asarray(vectors[start:start + 65536], dtype=np.float32), centroids)
+        for start in range(0, n, 65536)
+    ])
+    order = np.argsort(assignment, kind='stable').astype(np.int32)
+    offsets = np.zeros(nlist + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assignment, minlength=nlist))
+    return centroids, order, offsets
+
+
+def save_ivf(directory, centroids, order, offsets):
+    """
+    Save the inverted lists produced by `build_ivf` next to the embeddings
+
+    Parameters
+    ----------
+    directory : str
+        Directory containing the embeddings
+    centroids, order, offsets : numpy.ndarray
+        The output of `build_ivf`
+
+    Returns
+    -------
+    None
+    """
+    np.save(os.path.join(directory, IVF_CENTROIDS_FILE), centroids)
+    np.save(os.path.join(directory, IVF_ORDER_FILE), order)
+    np.save(os.path.join(directory, IVF_OFFSETS_FILE), offsets)
+
+
+def _nearest_centroid(vectors, centroids):
+    """Return the position of the nearest centroid for every row of `vectors`."""
+    # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2, and ||x||^2 does not change the argmin
+    distances = (centroids ** 2).sum(axis=1) - 2 * vectors @ centroids.T
+    return distances.argmin(axis=1)
+
+
+class LocalIndex:
+    """
+    In-process vector index over a memory-mapped embedding matrix
+
+    In ``'exact'`` mode every query is scored against all rows with a single
+    matrix-vector product. In ``'ivf'`` mode only the rows of the `nprobe` inverted
+    lists closest to the query are scored, which trades a little recall for speed on
+    large catalogs. Metadata filters are applied before scoring, so a filtered query
+    still returns `top_k` matches whenever that many rows pass the filter.
+
+    With `quantized` vectors, the rows are first scored on the float16 or int8 copy
+    and only the best ``top_k * rescore`` are rescored on the float32 matrix, so the
+    full-precision matrix can stay on disk except for those rows.
+
+    Parameters
+    ----------
+    ids : numpy.ndarray
+        The IMDb ID of each row
+    vectors : numpy.ndarray
+        The embedding matrix, usually memory-mapped
+    metadata : dict of str to numpy.ndarray, optional
+        Metadata columns usable in query filters
+    mode : str
+        ``'exact'`` or ``'ivf'``
+    norms : numpy.ndarray, optional
+        Precomputed squared norms of the rows; computed when missing
+    ivf : tuple, optional
+        Precomputed ``(centroids, order, offsets)``; built on the fly when missing
+    nlist : int
+        Number of inverted lists when the IVF has to be built
+    nprobe : int
+        Number of inverted lists scanned per query in ``'ivf'`` mode
+    quantized : tuple, optional
+        Quantized ``(codes, scale)`` copy of `vectors`, as returned by `quantize`
+    rescore : int
+        Shortlist size, as a multiple of `top_k`, rescored in full precision when
+        `quantized` is given
+    """
+
+    def __init__(self, ids, vectors, metadata=None, mode='exact', norms=None, ivf=None, nlist=256, nprobe=16,
+                 quantized=None, rescore=4):
+        if mode not in ('exact', 'ivf'):
+            raise ValueError(f"Unknown vector index mode: {mode!r}")
+        self.ids = ids
+        self.vectors = vectors
+        self.metadata = metadata or {}
+        self.mode = mode
+        self.nprobe = nprobe
+        # Squared norms are computed once, a query then only needs one dot product per row
+        self.norms = norms if norms is not None else np.einsum('ij,ij->i', vectors, vectors, dtype=np.float32)
+        self.ivf = None
+        if mode == 'ivf':
+            self.ivf = ivf if ivf is not None else build_ivf(vectors, nlist=nlist)
+        self.quantized = quantized
+        self.rescore = rescore
+
+    @classmethod
+    def from_directory(cls, directory, mode='exact', nlist=256, nprobe=16, quantization=None, rescore=4):
+        """
+        Open the embeddings saved in `directory` with `save_embeddings`
+
+        Parameters
+        ----------
+        directory : str
+            Directory containing the embeddings and, optionally, the IVF and
+            quantized files
+        mode, nlist, nprobe, rescore
+            See `LocalIndex`
+        quantization : str, optional
+            ``'float16'`` or ``'int8'`` to score on quantized vectors; they are
+            quantized on the fly when `save_quantized` was not run
+
+        Returns
+        -------
+        LocalIndex
+            The opened index
+        """
+        ids, vectors, metadata = load_embeddings(directory)
+        norms = None
+        if os.path.exists(os.path.join(directory, NORMS_FILE)):
+            norms = np.load(os.path.join(directory, NORMS_FILE), mmap_mode='r')
+        ivf = None
+        if mode == 'ivf' and os.path.exists(os.path.join(directory, IVF_CENTROIDS_FILE)):
+            ivf = tuple(np.load(os.path.join(directory, name))
+                        for name in (IVF_CENTROIDS_FILE, IVF_ORDER_FILE, IVF_OFFSETS_FILE))
+        quantized = None
+        if quantization:
+            quantized = load_quantized(directory, quantization) or quantize(vectors, quantization)
+        return cls(ids, vectors, metadata=metadata, mode=mode, norms=norms, ivf=ivf, nlist=nlist, nprobe=nprobe,
+                   quantized=quantized, rescore=rescore)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _candidates(self, vector):
+        """Return the rows to score for `vector`, or None to score every row."""
+        if self.ivf is None:
+            return None
+        centroids, order, offsets = self.ivf
+        distances = (centroids ** 2).sum(axis=1) - 2 * centroids @ vector
+        probes = np.argsort(distances)[:self.nprobe]
+        return np.sort(np.concatenate([order[offsets[p]:offsets[p + 1]] for p in probes]))
+
+    def _shortlist(self, vector, rows, size):
+        """Return the `size` rows (of `rows`, or of all rows) scoring best on the quantized vectors."""
+        codes, scale = self.quantized
+        query = vector * scale if scale is not None else vector
+        count = len(codes) if rows is None else len(rows)
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, QUANTIZED_BLOCK):
+            stop = min(start + QUANTIZED_BLOCK, count)
+            block = codes[start:stop] if rows is None else codes[rows[start:stop]]
+            scores[start:stop] = block.astype(np.float32) @ query
+        scores = (self.norms if rows is None else self.norms[rows]) - 2 * scores
+        if size < count:
+            best = np.argpartition(scores, size - 1)[:size]
+        else:
+            best = np.arange(count)
+        best = best if rows is None else rows[best]
+        # Sorted rows read the float32 matrix front to back
+        return np.sort(best)
+
+    def query(self, vector, top_k=10, filter=None, include_values=False, **kwargs):
+        """
+        Return the `top_k` rows closest to `vector`
+
+        Parameters
+        ----------
+        vector : array-like of shape (384,)
+            The query embedding
+        top_k : int
+            Number of matches to return
+        filter : dict, optional
+            Pinecone-style metadata filter, see `filter_mask`
+        include_values : bool
+            Whether to include the stored vector of every match
+
+        Returns
+        -------
+        dict
+            A Pinecone-like response with a ``'matches'`` list sorted by score
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        rows = self._candidates(vector)
+        if filter:
+            allowed = filter_mask(self.metadata, filter)
+            rows = np.flatnonzero(allowed) if rows is None else rows[allowed[rows]]
+            # The probed lists may hold fewer qualifying rows than requested
+            if self.ivf is not None and len(rows) < top_k:
+                rows = np.flatnonzero(allowed)
+        if self.quantized is not None:
+            rows = self._shortlist(vector, rows, top_k * self.rescore)
+        if rows is None:
+            scores = self.norms - 2 * (self.vectors @ vector)
+        else:
+            scores = self.norms[rows] - 2 * (self.vectors[rows] @ vector)
+        scores += vector @ vector
+
+        top_k = min(top_k, len(scores))
+        if top_k == 0:
+            return {'matches': []}
+        best = np.argpartition(scores, top_k - 1)[:top_k] if top_k < len(scores) else np.arange(len(scores))
+        best = best[np.argsort(scores[best], kind='stable')]
+        positions = best if rows is None else rows[best]
+
+        matches = []
+        for position, score in zip(positions, scores[best]):
+            match = {'id': str(self.ids[position]), 'score': float(max(score, 0.0))}
+            if include_values:
+                match['values'] = self.vectors[position].tolist()
+            matches.append(match)
+        return {'matches': matches}
+
+
+def connect_pinecone(api_key):
+    """
+    Create the Pinecone client
+
+    Parameters
+    ----------
+    api_key : str or None
+        The Pinecone API key, read from the ``key`` environment variable (``.env``)
+
+    Returns
+    -------
+    pinecone.Pinecone
+        The client
+
+    Raises
+    ------
+    ValueError
+        If `api_key` is missing
+    """
+    if not api_key:
+        raise ValueError("The Pinecone API key is missing: set the `key` environment variable, e.g. in .env")
+    from pinecone import Pinecone
+    return Pinecone(api_key=api_key)
+
+
+def open_index(settings, pinecone_client=None, embeddings_dir=None):
+    """
+    Open the vector index selected in the ``vector_index`` section of the config
+
+    Parameters
+    ----------
+    settings : dict
+        The ``vector_index`` section of ``config.yaml``
+    pinecone_client : pinecone.Pinecone, optional
+        Client used when the backend is ``'pinecone'``
+    embeddings_dir : str, optional
+        Overrides the ``embeddings_dir`` setting of the local backend
+
+    Returns
+    -------
+    LocalIndex or pinecone.Index
+        An object answering Pinecone-style ``query`` calls
+
+    Raises
+    ------
+    ValueError
+        If the backend is unknown, or is ``'pinecone'`` and `pinecone_client` is None
+    """
+    backend = settings.get('backend', 'local')
+    if backend == 'pinecone':
+        if pinecone_client is None:
+            raise ValueError("The 'pinecone' vector backend needs a Pinecone client and none was given; "
+                             "create it with connect_pinecone()")
+        return pinecone_client.Index(settings.get('pinecone_index', 'series'))
+    if backend == 'local':
+        return LocalIndex.from_directory(embeddings_dir or settings['embeddings_dir'],
+                                         mode=settings.get('mode', 'exact'),
+                                         nlist=settings.get('nlist', 256),
+                                         nprobe=settings.get('nprobe', 16),
+                                         quantization=settings.get('quantization'),
+                                         rescore=settings.get('rescore', 4))
+    raise ValueError(f"Unknown vector index backend: {backend!r}")